@@ -0,0 +1,176 @@
+# app/admission.py
+# 生成请求的准入控制（每个 worker 一个实例）：
+#   - 按请求的画像数与问题数估算成本（上游调用次数），同时限制在途流水线数与在途总成本
+#   - 超出容量的请求进入有界 FIFO 队列；队列已满或排队超时则拒绝
+#   - 拒绝时返回 503，Retry-After 根据最近的完成速率（成本/秒）估算排在前面的工作需要多久清空
+#   - 记录队列深度、准入/拒绝次数与排队时间，供 /v1/metrics 输出
+# 与 scheduler.py 的区别：scheduler 调度单次 LLM 调用，这里在请求入口限制同时进行的整条流水线。
+import asyncio
+import collections
+import contextlib
+import math
+import time
+from typing import Deque, Dict, List, Tuple
+
+from .config import settings
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Server is busy ({reason}), retry after {retry_after}s.")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def estimate_generation_cost(num_profiles: int, num_questions_per_profile: int) -> int:
+    """Upstream calls of one generation: summary + profiles + one call per non-empty question type per profile."""
+    question_types = 2 if num_questions_per_profile >= 2 else 1
+    return 2 + num_profiles * question_types
+
+
+class _Waiter:
+    __slots__ = ("cost", "future", "enqueued_at")
+
+    def __init__(self, cost: int, future: asyncio.Future):
+        self.cost = cost
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int, max_cost: int, max_queue: int, queue_timeout: float,
+                 drain_window: float = 60.0):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_cost = max(1, max_cost)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.drain_window = drain_window
+        self._in_flight = 0
+        self._in_flight_cost = 0
+        self._queue: Deque[_Waiter] = collections.deque()
+        # 最近完成的 (完成时间, 成本)，用于估算清空速率
+        self._completions: Deque[Tuple[float, int]] = collections.deque()
+        self._durations: Deque[float] = collections.deque(maxlen=200)
+        self._counters: Dict[str, int] = collections.defaultdict(int)
+        self._total_queue_wait = 0.0
+
+    def _fits(self, cost: int) -> bool:
+        if self._in_flight == 0:
+            return True  # 单个超大请求也要能执行，否则永远无法准入
+        return self._in_flight < self.max_in_flight and self._in_flight_cost + cost <= self.max_cost
+
+    def _grant(self, cost: int) -> None:
+        self._in_flight += 1
+        self._in_flight_cost += cost
+
+    def _dispatch(self) -> None:
+        # 严格 FIFO：队首放不下时不让后面的小请求插队，避免大请求饿死
+        while self._queue and (self._queue[0].future.done() or self._fits(self._queue[0].cost)):
+            waiter = self._queue.popleft()
+            if waiter.future.done():
+                continue  # 已取消、尚未自行出队的等待者
+            self._grant(waiter.cost)
+            waiter.future.set_result(None)
+
+    def _drain_rate(self) -> float:
+        """Completed cost per second over the recent window (0 when nothing completed yet)."""
+        now = time.monotonic()
+        while self._completions and now - self._completions[0][0] > self.drain_window:
+            self._completions.popleft()
+        if not self._completions:
+            return 0.0
+        elapsed = max(now - self._completions[0][0], 1.0)
+        return sum(cost for _, cost in self._completions) / elapsed
+
+    def retry_after(self, cost: int) -> int:
+        """Seconds until the work ahead of a new request of `cost` is expected to have drained."""
+        backlog = self._in_flight_cost + sum(w.cost for w in self._queue) + cost - self.max_cost
+        rate = self._drain_rate()
+        if rate > 0:
+            seconds = max(backlog, cost) / rate
+        elif self._durations:
+            # 还没有足够的完成记录：按平均流水线耗时 × 排在前面的批次数估算
+            seconds = sum(self._durations) / len(self._durations) * (1 + len(self._queue) / self.max_in_flight)
+        else:
+            seconds = settings.ADMISSION_DEFAULT_RETRY_AFTER
+        return int(min(max(math.ceil(seconds), 1), settings.ADMISSION_MAX_RETRY_AFTER))
+
+    def _reject(self, reason: str, cost: int) -> AdmissionRejected:
+        self._counters["rejected"] += 1
+        self._counters[f"rejected_{reason}"] += 1
+        return AdmissionRejected(reason, self.retry_after(cost))
+
+    async def acquire(self, cost: int) -> float:
+        """Wait for admission; returns the time spent queued (seconds) or raises AdmissionRejected."""
+        if not self._queue and self._fits(cost):
+            self._grant(cost)
+            self._counters["admitted"] += 1
+            return 0.0
+        if len(self._queue) >= self.max_queue:
+            raise self._reject("queue_full", cost)
+
+        waiter = _Waiter(cost, asyncio.get_running_loop().create_future())
+        self._queue.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(cost, completed=False)  # 已准入但调用方放弃，归还容量
+            else:
+                waiter.future.cancel()
+                if waiter in self._queue:
+                    self._queue.remove(waiter)
+                self._dispatch()
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject("queue_timeout", cost) from None
+            raise
+        waited = time.perf_counter() - waiter.enqueued_at
+        self._counters["admitted"] += 1
+        self._counters["admitted_after_queue"] += 1
+        self._total_queue_wait += waited
+        return waited
+
+    def release(self, cost: int, completed: bool = True, duration: float = 0.0) -> None:
+        self._in_flight -= 1
+        self._in_flight_cost -= cost
+        if completed:
+            self._completions.append((time.monotonic(), cost))
+            self._durations.append(duration)
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def admit(self, cost: int):
+        await self.acquire(cost)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(cost, duration=time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        queued: List[_Waiter] = list(self._queue)
+        now = time.perf_counter()
+        admitted_after_queue = self._counters["admitted_after_queue"]
+        return {
+            "in_flight": self._in_flight,
+            "in_flight_cost": self._in_flight_cost,
+            "queue_depth": len(queued),
+            "queued_cost": sum(w.cost for w in queued),
+            "oldest_queued_ms": round((now - queued[0].enqueued_at) * 1000, 1) if queued else 0.0,
+            "max_in_flight": self.max_in_flight,
+            "max_cost": self.max_cost,
+            "max_queue": self.max_queue,
+            "admitted": self._counters["admitted"],
+            "admitted_after_queue": admitted_after_queue,
+            "avg_queue_wait_ms": round(self._total_queue_wait / admitted_after_queue * 1000, 1)
+            if admitted_after_queue else 0.0,
+            "rejected": self._counters["rejected"],
+            "rejected_queue_full": self._counters["rejected_queue_full"],
+            "rejected_queue_timeout": self._counters["rejected_queue_timeout"],
+            "drain_rate_cost_per_s": round(self._drain_rate(), 3),
+            "estimated_retry_after_s": self.retry_after(1) if queued or self._in_flight >= self.max_in_flight else 0,
+        }
+
+
+admission = AdmissionController(settings.ADMISSION_MAX_IN_FLIGHT, settings.ADMISSION_MAX_COST,
+                                settings.ADMISSION_MAX_QUEUE, settings.ADMISSION_QUEUE_TIMEOUT_SECONDS)
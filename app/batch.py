@@ -0,0 +1,299 @@
+# app/batch.py
+# 离线批量生成：对目录或 glob 匹配的一批产品文档运行生成流水线（与 API 相同的 llm_service 调用、画像/问题去重），
+# 不经过 HTTP 接口，也不创建会话目录：
+#   - 最多 --concurrency 个文档同时生成；所有上游调用经过同一个 LLM 调度器（客户端标识 "batch"）
+#     与共享状态库中的 RPM/TPM 令牌桶（--rpm / --tpm 覆盖 LLM_RATE_LIMIT_*；与服务使用同一个
+#     SHARED_STATE_PATH 时和在线请求共用上游配额）
+#   - 每个文档完成后立即向输出 JSONL 追加一行
+#   - 检查点清单（<output>.manifest.json）记录每个文档（路径 + 内容哈希）的结果与输出文件的有效长度；
+#     中断后用相同的命令重新运行即跳过已完成的文档，截掉清单之后写了一半的行；文档内容改变或上次失败的文档重新生成；
+#     输出文件缺失或短于清单记录的长度时拒绝继续（已完成的结果丢失），需要 --restart 重新开始
+#   - 结束时打印吞吐量与 token 用量报告
+#
+# 用法（在项目根目录）：
+#   python -m app.batch data --output data/batch_results.jsonl --concurrency 4
+#   python -m app.batch "data/Example_product*.txt" --output data/batch_results.jsonl --profiles 5 --questions 6
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import glob
+import hashlib
+import json
+import pathlib
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .config import settings
+from . import generation
+from . import llm_service
+from . import prompt_sets
+from . import structured_logging
+from . import upstream_usage
+from .pydantic_models import ProductInfoRequest
+from .scheduler import current_client_id
+from .session_store import write_json_atomic
+
+logger = structured_logging.get_logger(__name__)
+
+BATCH_CLIENT_ID = "batch"
+DOCUMENT_SUFFIXES = (".txt", ".md")
+
+def find_documents(source: str) -> List[pathlib.Path]:
+    """A directory (its .txt/.md files, non-recursive) or a glob pattern, in sorted order."""
+    path = pathlib.Path(source)
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.is_file() and p.suffix.lower() in DOCUMENT_SUFFIXES)
+    return sorted(pathlib.Path(p) for p in glob.glob(source, recursive=True) if pathlib.Path(p).is_file())
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class Manifest:
+    """
+    Checkpoint of a batch run, saved atomically next to the output file after every document.
+    `output_bytes` is the length of the output file covered by the recorded documents.
+    """
+
+    def __init__(self, path: pathlib.Path, params: Dict[str, Any]):
+        self.path = path
+        self.params = params
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.output_bytes = 0
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> Optional["Manifest"]:
+        if not path.is_file():
+            return None
+        data = json.loads(path.read_text(encoding="utf-8"))
+        manifest = cls(path, data.get("params", {}))
+        manifest.documents = data.get("documents", {})
+        manifest.output_bytes = data.get("output_bytes", 0)
+        return manifest
+
+    def is_done(self, document: str, content_hash: str) -> bool:
+        entry = self.documents.get(document)
+        return entry is not None and entry.get("status") == "done" and entry.get("sha256") == content_hash
+
+    def save(self) -> None:
+        write_json_atomic(self.path, {
+            "params": self.params,
+            "output_bytes": self.output_bytes,
+            "updated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "documents": self.documents,
+        })
+
+
+class BatchRunner:
+    def __init__(self, documents: List[pathlib.Path], output_path: pathlib.Path, manifest: Manifest,
+                 num_profiles: int, num_questions: int, template_set: Optional[str], concurrency: int):
+        self.documents = documents
+        self.output_path = output_path
+        self.manifest = manifest
+        self.num_profiles = num_profiles
+        self.num_questions = num_questions
+        self.template_set = template_set
+        self.concurrency = concurrency
+        self.usage = upstream_usage.CallUsage()
+        self.counts = {"total": len(documents), "skipped": 0, "completed": 0, "failed": 0,
+                       "profiles": 0, "questions": 0}
+        self._write_lock = asyncio.Lock()
+
+    async def _record(self, key: str, entry: Dict[str, Any], line: Optional[Dict[str, Any]]) -> None:
+        # 先追加输出行，再更新清单中的有效长度；两步之间中断时，下次运行会截掉这行并重新生成该文档
+        async with self._write_lock:
+            if line is not None:
+                encoded = (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+                await asyncio.to_thread(self._append_output, encoded)
+                self.manifest.output_bytes += len(encoded)
+            self.manifest.documents[key] = entry
+            await asyncio.to_thread(self.manifest.save)
+
+    def _append_output(self, encoded: bytes) -> None:
+        with open(self.output_path, "ab") as f:
+            f.write(encoded)
+
+    async def _process(self, path: pathlib.Path, text: str, content_hash: str, semaphore: asyncio.Semaphore) -> None:
+        key = str(path)
+        async with semaphore:
+            usage = upstream_usage.CallUsage()
+            upstream_usage.current_usage.set(usage)  # 该文档流水线中的上游调用计入 usage
+            session_id = uuid.uuid4().hex[:8]
+            structured_logging.current_session_id.set(session_id)
+            request = ProductInfoRequest(product_document=text, num_customer_profiles=self.num_profiles,
+                                         num_questions_per_profile=self.num_questions, reuse="off",
+                                         template_set=self.template_set)
+            job = generation.GenerationJob(request=request, session_id=session_id,
+                                           session_date_str=datetime.date.today().strftime("%Y%m%d"), persist=False)
+            started = time.perf_counter()
+            try:
+                response_data_obj, _ = await generation.run_generation(job)
+            except Exception as e:
+                self.usage.add(usage)
+                self.counts["failed"] += 1
+                error = getattr(e, "error", e)  # PipelineError 包装了阶段内的原始异常
+                error = getattr(error, "detail", error)
+                logger.warning("文档 %s 生成失败: %s", key, error)
+                await self._record(key, {"sha256": content_hash, "status": "failed", "error": str(error)[:500],
+                                         "usage": dataclasses.asdict(usage)}, None)
+                return
+
+            elapsed = round(time.perf_counter() - started, 2)
+            profiles = response_data_obj.customer_profiles
+            num_questions = sum(len(p.b2b_questions) + len(p.b2c_questions) for p in profiles)
+            self.usage.add(usage)
+            self.counts["completed"] += 1
+            self.counts["profiles"] += len(profiles)
+            self.counts["questions"] += num_questions
+            line = {
+                "document": key,
+                "sha256": content_hash,
+                **response_data_obj.model_dump(mode="json", exclude_none=True),
+                "usage": dataclasses.asdict(usage),
+                "elapsed_seconds": elapsed,
+            }
+            await self._record(key, {"sha256": content_hash, "status": "done", "profiles": len(profiles),
+                                     "questions": num_questions, "usage": dataclasses.asdict(usage),
+                                     "elapsed_seconds": elapsed}, line)
+            logger.info("文档 %s 完成：%s 个画像，%s 个问题，%.1f 秒", key, len(profiles), num_questions, elapsed)
+
+    async def run(self) -> Dict[str, Any]:
+        current_client_id.set(BATCH_CLIENT_ID)
+        prompt_sets.current_template_set.set(self.template_set)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = []
+        for path in self.documents:
+            text = await asyncio.to_thread(path.read_text, encoding="utf-8")
+            content_hash = _content_hash(text)
+            if self.manifest.is_done(str(path), content_hash):
+                self.counts["skipped"] += 1
+                continue
+            # 每个文档一个任务，各自持有 contextvar（用量、会话 ID）的副本
+            pending.append(asyncio.create_task(self._process(path, text, content_hash, semaphore)))
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*pending)
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        return self.report(time.perf_counter() - started)
+
+    def report(self, elapsed_seconds: float) -> Dict[str, Any]:
+        completed = self.counts["completed"]
+        minutes = elapsed_seconds / 60 if elapsed_seconds > 0 else 0.0
+        return {
+            **self.counts,
+            "elapsed_seconds": round(elapsed_seconds, 1),
+            "documents_per_minute": round(completed / minutes, 2) if minutes else None,
+            "profiles_per_minute": round(self.counts["profiles"] / minutes, 2) if minutes else None,
+            **dataclasses.asdict(self.usage),
+            "tokens_per_document": round((self.usage.prompt_tokens + self.usage.completion_tokens) / completed)
+            if completed else None,
+        }
+
+
+def _truncate_output(output_path: pathlib.Path, size: int) -> None:
+    # 截掉清单未记录的尾部（上次中断时写了一半或未登记的行）
+    if output_path.stat().st_size > size:
+        with open(output_path, "r+b") as f:
+            f.truncate(size)
+
+
+def _print_report(report: Dict[str, Any], output_path: pathlib.Path) -> None:
+    print(f"documents: {report['total']} total, {report['completed']} generated, "
+          f"{report['skipped']} already done, {report['failed']} failed")
+    print(f"generated: {report['profiles']} profiles, {report['questions']} questions "
+          f"in {report['elapsed_seconds']} s ({report['documents_per_minute']} documents/min, "
+          f"{report['profiles_per_minute']} profiles/min)")
+    print(f"upstream: {report['llm_calls']} calls ({report['http_errors']} HTTP errors), "
+          f"{report['prompt_tokens']} prompt + {report['completion_tokens']} completion tokens "
+          f"({report['tokens_per_document']} per document)")
+    print(f"results: {output_path}")
+    if report["failed"]:
+        print("失败的文档已记录在检查点清单中，重新运行同一命令会重试这些文档")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Generate customer data for a directory or glob of product documents.")
+    parser.add_argument("source", help="Directory of .txt/.md product documents, or a glob pattern.")
+    parser.add_argument("-o", "--output", type=pathlib.Path, required=True, help="Results JSONL file (appended).")
+    parser.add_argument("--profiles", type=int, default=3, help="Profiles per document (1-10).")
+    parser.add_argument("--questions", type=int, default=6, help="Questions per profile (2-10).")
+    parser.add_argument("--template-set", choices=list(prompt_sets.TEMPLATE_SETS),
+                        help="Prompt template set (defaults to PROMPT_TEMPLATE_SET).")
+    parser.add_argument("--concurrency", type=int, default=4, help="Documents generated at the same time.")
+    parser.add_argument("--rpm", type=int, help="Upstream requests per minute (overrides LLM_RATE_LIMIT_RPM).")
+    parser.add_argument("--tpm", type=int, help="Upstream tokens per minute (overrides LLM_RATE_LIMIT_TPM).")
+    parser.add_argument("--restart", action="store_true",
+                        help="Discard the output file and checkpoint manifest and start over.")
+    parser.add_argument("--report", type=pathlib.Path, help="Also write the final report as JSON.")
+    args = parser.parse_args(argv)
+
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    try:
+        ProductInfoRequest(product_document="", num_customer_profiles=args.profiles,
+                           num_questions_per_profile=args.questions)
+    except ValueError as e:
+        parser.error(f"invalid --profiles/--questions: {e}")
+    documents = find_documents(args.source)
+    if not documents:
+        parser.error(f"no documents found at {args.source}")
+
+    params = {"profiles": args.profiles, "questions": args.questions,
+              "template_set": prompt_sets.resolve(args.template_set)}
+    manifest_path = args.output.with_name(args.output.name + ".manifest.json")
+    manifest = None if args.restart else Manifest.load(manifest_path)
+    if manifest is not None and manifest.params != params:
+        parser.error(f"{manifest_path} was written with different parameters {manifest.params}; "
+                     f"rerun with the same parameters or pass --restart")
+    if manifest is None:
+        manifest = Manifest(manifest_path, params)
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_bytes(b"")
+    else:
+        # 输出文件被删除或截短时，清单中标记为已完成的文档的结果已经不在了，继续运行会跳过它们
+        output_size = args.output.stat().st_size if args.output.is_file() else None
+        if output_size is None or output_size < manifest.output_bytes:
+            parser.error(f"{args.output} is {'missing' if output_size is None else f'only {output_size} bytes'} "
+                         f"but {manifest_path} records {manifest.output_bytes} bytes of results; "
+                         f"pass --restart to start over")
+        _truncate_output(args.output, manifest.output_bytes)
+
+    if args.rpm is not None:
+        settings.LLM_RATE_LIMIT_RPM = args.rpm
+    if args.tpm is not None:
+        settings.LLM_RATE_LIMIT_TPM = args.tpm
+    llm_service.set_http_transport(upstream_usage.MeteringTransport(httpx.AsyncHTTPTransport()))
+    structured_logging.configure()
+
+    runner = BatchRunner(documents, args.output, manifest, args.profiles, args.questions, args.template_set,
+                         args.concurrency)
+
+    async def _run() -> Dict[str, Any]:
+        try:
+            return await runner.run()
+        finally:
+            await llm_service.close_http_client()
+
+    try:
+        report = asyncio.run(_run())
+    except KeyboardInterrupt:
+        structured_logging.shutdown()
+        done = sum(1 for entry in manifest.documents.values() if entry.get("status") == "done")
+        print(f"已中断：{done}/{len(documents)} 个文档已完成并记录在 {manifest_path}，重新运行同一命令即可继续")
+        raise SystemExit(130)
+    structured_logging.shutdown()  # 写完队列中的日志再输出报告
+    _print_report(report, args.output)
+    if args.report:
+        args.report.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+# app/benchmark.py
+# 比较提示词模板集（app/prompt_sets.py）：对固定语料中的每个产品文档，按每个模板集依次运行
+# 摘要 → 画像 → 每个画像的 B2B/B2C 问题（与生成流水线相同的 llm_service 调用，不做去重），统计：
+#   - prompt / completion tokens（上游返回的 usage；缺失时按字符数估算 prompt tokens）
+#   - 每次调用的延迟（p50 / p95）
+#   - JSON 解析：一次通过 / 逐条修复 / 失败（见 app/structured_output.py）
+#   - 条目产出率：实际返回的画像数、问题数 / 请求数
+#   - 日志开销：运行期间的日志记录数与调用方（事件循环）耗时（--log-sync 对比同步写出，--log-level DEBUG 增加日志量）
+# 后端：
+#   live    配置的 EXTERNAL_API_URL（--api-url 可指向本地 vLLM、Ollama 等 OpenAI 兼容接口）；
+#           --record FILE 把每次请求的响应与延迟录制为 JSONL
+#   replay  从 --replay FILE 回放录制的响应：不访问网络、不消耗配额，延迟取录制值
+#
+# 用法（在项目根目录）：
+#   python -m app.benchmark --backend live --record data/benchmark_calls.jsonl
+#   python -m app.benchmark --backend replay --replay data/benchmark_calls.jsonl --output benchmark_report.json
+import argparse
+import asyncio
+import dataclasses
+import glob
+import hashlib
+import json
+import pathlib
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .config import settings, PROJECT_ROOT_DIR
+from . import llm_service
+from . import prompt_sets
+from . import structured_logging
+from . import structured_output
+from . import upstream_usage
+from .generation import info_for_llm, split_question_counts
+
+_REPLAYED_LATENCY_HEADER = "x-benchmark-latency-ms"
+
+def _request_key(body: Dict[str, Any]) -> str:
+    # max_tokens 随自适应预算变化，不参与匹配
+    identity = [body.get("model"), body.get("messages"), body.get("response_format")]
+    return hashlib.sha256(json.dumps(identity, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))], 1)
+
+
+@dataclasses.dataclass
+class _StageStats(upstream_usage.CallUsage):
+    latencies_ms: List[float] = dataclasses.field(default_factory=list)
+    requested_items: int = 0
+    returned_items: int = 0
+    parse_failures: int = 0  # 只用于摘要；画像/问题的解析结果来自 structured_output 计数
+
+    def record(self, body: Dict[str, Any], status_code: int, data: Any, latency_ms: float) -> None:
+        super().record(body, status_code, data, latency_ms)
+        self.latencies_ms.append(latency_ms)
+
+    def report(self) -> Dict[str, Any]:
+        calls = self.llm_calls
+        return {
+            "calls": calls,
+            "http_errors": self.http_errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "avg_prompt_tokens": round(self.prompt_tokens / calls, 1) if calls else 0.0,
+            "avg_completion_tokens": round(self.completion_tokens / calls, 1) if calls else 0.0,
+            "latency_p50_ms": _percentile(self.latencies_ms, 50),
+            "latency_p95_ms": _percentile(self.latencies_ms, 95),
+            "requested_items": self.requested_items,
+            "returned_items": self.returned_items,
+            "item_yield": round(self.returned_items / self.requested_items, 4) if self.requested_items else None,
+        }
+
+
+class _MeasuringTransport(upstream_usage.MeteringTransport):
+    """Attributes usage and latency of each call to the current stage; optionally records the responses."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, record_path: Optional[pathlib.Path] = None):
+        super().__init__(inner)
+        self.record_file = record_path.open("a", encoding="utf-8") if record_path else None
+
+    def latency_ms(self, response: httpx.Response, started: float) -> float:
+        # 回放时使用录制的延迟
+        return float(response.headers.get(_REPLAYED_LATENCY_HEADER) or super().latency_ms(response, started))
+
+    def on_response(self, body: Dict[str, Any], response: httpx.Response, data: Any, latency_ms: float) -> None:
+        if self.record_file is not None:
+            self.record_file.write(json.dumps({"key": _request_key(body), "status": response.status_code,
+                                               "latency_ms": round(latency_ms, 1), "response": data},
+                                              ensure_ascii=False) + "\n")
+            self.record_file.flush()
+
+    async def aclose(self) -> None:
+        if self.record_file is not None:
+            self.record_file.close()
+        await super().aclose()
+
+
+class _ReplayTransport(httpx.AsyncBaseTransport):
+    """Serves responses recorded by --record; identical requests replay their recordings in order."""
+
+    def __init__(self, record_path: pathlib.Path):
+        self.records: Dict[str, List[Dict[str, Any]]] = {}
+        self.positions: Dict[str, int] = {}
+        self.misses = 0
+        with record_path.open(encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.records.setdefault(record["key"], []).append(record)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = _request_key(json.loads(request.content))
+        records = self.records.get(key)
+        if not records:
+            self.misses += 1
+            return httpx.Response(404, json={"error": "No recorded response for this request."}, request=request)
+        position = self.positions.get(key, 0)
+        self.positions[key] = position + 1
+        record = records[position % len(records)]
+        return httpx.Response(record["status"], json=record["response"], request=request,
+                              headers={_REPLAYED_LATENCY_HEADER: str(record.get("latency_ms", 0.0))})
+
+
+async def _measured(stats: _StageStats, awaitable):
+    token = upstream_usage.current_usage.set(stats)
+    try:
+        return await awaitable
+    finally:
+        upstream_usage.current_usage.reset(token)
+
+
+async def _run_document(document: str, template_set: str, stages: Dict[str, _StageStats],
+                        num_profiles: int, num_questions: int) -> None:
+    prompt_sets.current_template_set.set(template_set)
+    summary = await _measured(stages["summary"], llm_service.generate_product_summary(document))
+    stages["summary"].requested_items += 1
+    context = info_for_llm(summary, document)
+    if context is summary:
+        stages["summary"].returned_items += 1
+    else:
+        stages["summary"].parse_failures += 1
+
+    stages["profiles"].requested_items += num_profiles
+    try:
+        profiles = await _measured(stages["profiles"],
+                                   llm_service.generate_customer_profiles_from_llm(context, num_profiles))
+    except Exception as e:
+        print(f"[{template_set}] 画像生成失败: {e}")
+        return
+    profiles = profiles[:num_profiles]
+    stages["profiles"].returned_items += len(profiles)
+
+    num_b2b, num_b2c = split_question_counts(num_questions)
+
+    async def questions(profile, question_type: str, count: int) -> None:
+        stats = stages[f"questions_{question_type.lower()}"]
+        stats.requested_items += count
+        generate = (llm_service.generate_b2b_questions_for_profile if question_type == "B2B"
+                    else llm_service.generate_b2c_questions_for_profile)
+        try:
+            result = await _measured(stats, generate(profile, context, count))
+            stats.returned_items += len(result)
+        except Exception as e:
+            print(f"[{template_set}] {question_type} 问题生成失败: {e}")
+
+    await asyncio.gather(*(questions(profile, question_type, count) for profile in profiles
+                           for question_type, count in (("B2B", num_b2b), ("B2C", num_b2c)) if count > 0))
+
+
+def _parse_outcomes(before: Dict[str, Any], after: Dict[str, Any], kind: str) -> Dict[str, Any]:
+    diff = {outcome: after[kind][outcome] - before[kind][outcome]
+            for outcome in ("validated", "repaired", "failed", "items_skipped")}
+    replies = diff["validated"] + diff["repaired"] + diff["failed"]
+    diff["clean_parse_rate"] = round(diff["validated"] / replies, 4) if replies else None
+    diff["repair_rate"] = round(diff["repaired"] / replies, 4) if replies else None
+    return diff
+
+
+def _logging_overhead(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    records = after["records"] - before["records"]
+    caller_ms = after["caller_time_ms"] - before["caller_time_ms"]
+    return {
+        "mode": after["mode"],
+        "records": records,
+        "suppressed": after["suppressed"] - before["suppressed"],
+        "dropped": after["dropped"] - before["dropped"],
+        "caller_time_ms": round(caller_ms, 3),
+        "avg_caller_us": round(caller_ms * 1000 / records, 2) if records else 0.0,
+    }
+
+
+async def run_benchmark(documents: Dict[str, str], template_sets: List[str], num_profiles: int,
+                        num_questions: int, repeat: int = 1) -> Dict[str, Any]:
+    report: Dict[str, Any] = {"documents": list(documents), "num_profiles": num_profiles,
+                              "num_questions_per_profile": num_questions, "repeat": repeat, "template_sets": {}}
+    for template_set in template_sets:
+        stages = {name: _StageStats() for name in ("summary", "profiles", "questions_b2b", "questions_b2c")}
+        before = structured_output.snapshot()
+        log_before = structured_logging.snapshot()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for document in documents.values():
+                await _run_document(document, template_set, stages, num_profiles, num_questions)
+        after = structured_output.snapshot()
+        log_after = structured_logging.snapshot()
+        stage_reports = {name: stats.report() for name, stats in stages.items()}
+        summary_replies = stages["summary"].requested_items
+        stage_reports["summary"]["clean_parse_rate"] = (
+            round(1 - stages["summary"].parse_failures / summary_replies, 4) if summary_replies else None)
+        stage_reports["profiles"]["parse"] = _parse_outcomes(before, after, "profiles")
+        question_parse = _parse_outcomes(before, after, "questions")
+        report["template_sets"][template_set] = {
+            "wall_time_s": round(time.perf_counter() - started, 2),
+            "prompt_tokens": sum(s.prompt_tokens for s in stages.values()),
+            "completion_tokens": sum(s.completion_tokens for s in stages.values()),
+            "questions_parse": question_parse,
+            "stages": stage_reports,
+            "logging": _logging_overhead(log_before, log_after),
+        }
+    return report
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    header = f"{'template set':<14}{'prompt tok':>11}{'compl tok':>10}{'p50 ms':>9}{'p95 ms':>9}" \
+             f"{'profiles':>10}{'questions':>11}{'clean parse':>13}{'repaired':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, result in report["template_sets"].items():
+        stages = result["stages"]
+        latencies = [s for s in stages.values() if s["latency_p50_ms"] is not None]
+        questions_requested = stages["questions_b2b"]["requested_items"] + stages["questions_b2c"]["requested_items"]
+        questions_returned = stages["questions_b2b"]["returned_items"] + stages["questions_b2c"]["returned_items"]
+        parse = [stages["profiles"]["parse"], result["questions_parse"]]
+        replies = sum(p["validated"] + p["repaired"] + p["failed"] for p in parse)
+        clean = sum(p["validated"] for p in parse) / replies if replies else 0.0
+        repaired = sum(p["repaired"] for p in parse) / replies if replies else 0.0
+        print(f"{name:<14}{result['prompt_tokens']:>11}{result['completion_tokens']:>10}"
+              f"{max((s['latency_p50_ms'] for s in latencies), default=0):>9}"
+              f"{max((s['latency_p95_ms'] for s in latencies), default=0):>9}"
+              f"{stages['profiles']['returned_items']:>5}/{stages['profiles']['requested_items']:<4}"
+              f"{questions_returned:>6}/{questions_requested:<4}{clean:>13.1%}{repaired:>10.1%}")
+    print("p50/p95: slowest stage; profiles/questions: returned/requested; parse rates over profile and question replies.")
+    for name, result in report["template_sets"].items():
+        log = result["logging"]
+        print(f"logging [{name}] ({log['mode']}): {log['records']} records, {log['suppressed']} suppressed, "
+              f"{log['dropped']} dropped, caller time {log['caller_time_ms']} ms ({log['avg_caller_us']} us/record)")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Compare prompt template sets on tokens, latency and parse success.")
+    parser.add_argument("--corpus", default=str(PROJECT_ROOT_DIR / "data" / "Example_product*.txt"),
+                        help="Glob of product documents.")
+    parser.add_argument("--template-sets", default=",".join(prompt_sets.TEMPLATE_SETS),
+                        help="Comma-separated template sets to compare.")
+    parser.add_argument("--profiles", type=int, default=3, help="Profiles requested per document.")
+    parser.add_argument("--questions", type=int, default=6, help="Questions requested per profile.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per document and template set.")
+    parser.add_argument("--backend", choices=["live", "replay"], default="live")
+    parser.add_argument("--api-url", help="OpenAI-compatible endpoint (live backend), e.g. a local vLLM server.")
+    parser.add_argument("--model", help="Model name (defaults to DEFAULT_LLM_MODEL).")
+    parser.add_argument("--record", type=pathlib.Path, help="Append every live call's response to this JSONL file.")
+    parser.add_argument("--replay", type=pathlib.Path, help="JSONL recording to replay (replay backend).")
+    parser.add_argument("--output", type=pathlib.Path, help="Write the full report as JSON.")
+    parser.add_argument("--log-sync", action="store_true",
+                        help="Write log records synchronously in the caller to compare the logging overhead.")
+    parser.add_argument("--log-level", help="Log level during the run (defaults to LOG_LEVEL).")
+    args = parser.parse_args(argv)
+
+    template_sets = [name.strip() for name in args.template_sets.split(",") if name.strip()]
+    for name in template_sets:
+        if name not in prompt_sets.TEMPLATE_SETS:
+            parser.error(f"unknown template set '{name}' (available: {', '.join(prompt_sets.TEMPLATE_SETS)})")
+    documents = {path: pathlib.Path(path).read_text(encoding="utf-8") for path in sorted(glob.glob(args.corpus))}
+    if not documents:
+        parser.error(f"no documents match {args.corpus}")
+
+    # 固定 max_tokens 以便模板集之间可比；不读写 LLM 响应缓存
+    settings.ADAPTIVE_MAX_TOKENS = False
+    settings.LLM_CACHE_TTL_SECONDS = 0
+    if args.model:
+        settings.DEFAULT_LLM_MODEL = args.model
+    if args.backend == "replay":
+        if args.replay is None:
+            parser.error("--backend replay requires --replay FILE")
+        replay = _ReplayTransport(args.replay)
+        transport = _MeasuringTransport(replay)
+        settings.EXTERNAL_API_KEY = settings.EXTERNAL_API_KEY or "replay"
+        # 回放的用量不写入真实的 token 统计与配额
+        settings.SHARED_STATE_PATH = str(pathlib.Path(tempfile.mkdtemp()) / "benchmark_state.sqlite3")
+    else:
+        replay = None
+        if args.api_url:
+            settings.EXTERNAL_API_URL = args.api_url
+        if not settings.EXTERNAL_API_KEY:
+            settings.EXTERNAL_API_KEY = "local"  # 本地 OpenAI 兼容服务通常不校验密钥
+        transport = _MeasuringTransport(httpx.AsyncHTTPTransport(), args.record)
+    llm_service.set_http_transport(transport)
+    if args.log_sync:
+        settings.LOG_ASYNC = False
+    if args.log_level:
+        settings.LOG_LEVEL = args.log_level
+    structured_logging.configure()
+
+    async def _run() -> Dict[str, Any]:
+        try:
+            return await run_benchmark(documents, template_sets, args.profiles, args.questions, args.repeat)
+        finally:
+            await llm_service.close_http_client()
+
+    report = asyncio.run(_run())
+    structured_logging.shutdown()  # 写完队列中的日志再输出报告
+    report["backend"] = args.backend
+    if replay is not None:
+        report["replay_misses"] = replay.misses
+    _print_report(report)
+    if replay is not None and replay.misses:
+        print(f"警告: {replay.misses} 个请求在录制文件中没有对应响应（模板或参数与录制时不同）")
+    if args.output:
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"完整报告已写入: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# app/cancellation.py
+# 客户端断开时取消生成：
+#   - run_unless_disconnected 在等待生成任务的同时定期检查客户端是否已断开（关闭页面、代理超时），
+#     断开后取消整个流水线任务；流水线取消在途阶段，call_llm_api 随之退出，归还调度器槽位，
+#     httpx 关闭被中断的上游连接
+#   - 记录被取消的请求数与 LLM 调用数，以及估算节省的 token（尚未发出的调用）
+# 统计为每个 worker 独立，由 /v1/metrics 输出。
+import asyncio
+import collections
+from typing import Any, Awaitable, Dict
+
+from fastapi import Request
+
+from .config import settings
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+# 调用被取消时所处的阶段：queued = 仍在调度器/配额中排队（未发出，token 全部节省）；
+# in_flight = 请求已发出（非流式请求上游通常仍会计费，只节省了等待）
+_counters: Dict[str, int] = collections.defaultdict(int)
+_tokens_saved_by_stage: Dict[str, int] = collections.defaultdict(int)
+
+
+def record_cancelled_request(partial_saved: bool) -> None:
+    _counters["requests_cancelled"] += 1
+    if partial_saved:
+        _counters["partial_results_saved"] += 1
+
+
+def record_cancelled_call(stage: str, phase: str, estimated_tokens: int) -> None:
+    _counters[f"llm_calls_cancelled_{phase}"] += 1
+    if phase == "queued":
+        _counters["tokens_saved_estimate"] += estimated_tokens
+        _tokens_saved_by_stage[stage or "unknown"] += estimated_tokens
+
+
+async def run_unless_disconnected(request: Request, awaitable: Awaitable[Any]) -> Any:
+    """
+    Await `awaitable` as a task, polling the client connection every CLIENT_DISCONNECT_POLL_SECONDS.
+    On disconnect the task is cancelled (and awaited) and ClientDisconnected is raised.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.CLIENT_DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise ClientDisconnected()
+    except BaseException:
+        # 断开或本协程被取消（服务关闭）时都不能留下仍在调用上游的任务
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        raise
+
+
+def snapshot() -> dict:
+    return {
+        "requests_cancelled": _counters["requests_cancelled"],
+        "partial_results_saved": _counters["partial_results_saved"],
+        "llm_calls_cancelled_queued": _counters["llm_calls_cancelled_queued"],
+        "llm_calls_cancelled_in_flight": _counters["llm_calls_cancelled_in_flight"],
+        "tokens_saved_estimate": _counters["tokens_saved_estimate"],
+        "tokens_saved_by_stage": dict(_tokens_saved_by_stage),
+    }
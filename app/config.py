@@ -1,18 +1,146 @@
 # app/config.py
 import os
+import pathlib
 from dotenv import load_dotenv
 
 # load_dotenv() 会从当前工作目录或 .env 文件的指定路径加载变量。
 # 当通过 run.py 启动时，当前工作目录通常是项目根目录。
 load_dotenv()
 
+PROJECT_ROOT_DIR = pathlib.Path(__file__).resolve().parent.parent
+
+
 class Settings:
     EXTERNAL_API_URL: str = os.getenv("EXTERNAL_API_URL", "https://api.siliconflow.cn/v1/chat/completions")
     EXTERNAL_API_KEY: str | None = os.getenv("EXTERNAL_API_KEY")
     DEFAULT_LLM_MODEL: str = os.getenv("DEFAULT_LLM_MODEL", "Qwen/Qwen3-14B")
     PROJECT_NAME: str = "AI Customer Generator"
 
+    # --- 服务进程配置 (run.py --prod / gunicorn.conf.py) ---
+    SERVER_HOST: str = os.getenv("SERVER_HOST", "0.0.0.0")
+    SERVER_PORT: int = int(os.getenv("SERVER_PORT", "8000"))
+    # 0 表示按 CPU 核心数自动计算 (2 * CPU + 1)
+    SERVER_WORKERS: int = int(os.getenv("SERVER_WORKERS", "0"))
+    SERVER_GRACEFUL_TIMEOUT: int = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+
+    # --- 启动预热 (app/startup.py) ---
+    # 启动时预先建立的 LLM 连接数（连接池上限为 LLM_POOL_MAX_CONNECTIONS）
+    STARTUP_PREWARM_CONNECTIONS: int = int(os.getenv("STARTUP_PREWARM_CONNECTIONS", "2"))
+    STARTUP_WARMUP_TIMEOUT: float = float(os.getenv("STARTUP_WARMUP_TIMEOUT", "10"))
+    LLM_POOL_MAX_CONNECTIONS: int = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "50"))
+
+    # --- 日志 (app/structured_logging.py) ---
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    # json：每行一个 JSON 对象（便于日志采集）；text：便于本地阅读
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")
+    # 在后台线程写出；false 时在调用方同步写出（仅用于对比开销或调试）
+    LOG_ASYNC: bool = os.getenv("LOG_ASYNC", "true").lower() in ("1", "true", "yes")
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # 单个参数（如 LLM 回复）的最大字符数，超出部分截断
+    LOG_MAX_FIELD_CHARS: int = int(os.getenv("LOG_MAX_FIELD_CHARS", "500"))
+    # 同一消息模板每个窗口内最多输出的条数，0 表示不采样
+    LOG_SAMPLE_BURST: int = int(os.getenv("LOG_SAMPLE_BURST", "20"))
+    LOG_SAMPLE_WINDOW_SECONDS: float = float(os.getenv("LOG_SAMPLE_WINDOW_SECONDS", "60"))
+
+    # --- 跨 worker 共享状态 (SQLite WAL) ---
+    SHARED_STATE_PATH: str = os.getenv("SHARED_STATE_PATH", str(PROJECT_ROOT_DIR / "data" / ".runtime" / "shared_state.sqlite3"))
+    # 上游 LLM 配额（所有 worker 合计），0 表示不限制
+    LLM_RATE_LIMIT_RPM: int = int(os.getenv("LLM_RATE_LIMIT_RPM", "0"))
+    LLM_RATE_LIMIT_TPM: int = int(os.getenv("LLM_RATE_LIMIT_TPM", "0"))
+    LLM_RATE_LIMIT_BURST: int = int(os.getenv("LLM_RATE_LIMIT_BURST", "10"))
+    # 画像/问题调用的 response_format：json_object，或 json_schema（按 Pydantic 模型派生的 JSON Schema 约束输出；
+    # 后端拒绝时自动退回 json_object）
+    LLM_RESPONSE_FORMAT: str = os.getenv("LLM_RESPONSE_FORMAT", "json_object")
+    # LLM 响应缓存时间（秒），0 表示不缓存
+    LLM_CACHE_TTL_SECONDS: int = int(os.getenv("LLM_CACHE_TTL_SECONDS", "0"))
+
+    # --- 提示词模板集 (app/prompt_sets.py) ---
+    # default / strict / strict_simple / old，请求体中的 template_set 字段可覆盖
+    PROMPT_TEMPLATE_SET: str = os.getenv("PROMPT_TEMPLATE_SET", "default")
+
+    # --- 生成流水线 (app/generation.py) ---
+    # 开启后画像生成与摘要并行、直接基于原始文档（以少量提示词差异换取更低延迟）
+    PIPELINE_SPECULATIVE_PROFILES: bool = os.getenv("PIPELINE_SPECULATIVE_PROFILES", "false").lower() in ("1", "true", "yes")
+
+    # --- 上游调用调度 (app/scheduler.py，每个 worker 独立) ---
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+    LLM_PER_CLIENT_CONCURRENCY: int = int(os.getenv("LLM_PER_CLIENT_CONCURRENCY", "4"))
+    # 客户端权重，格式 "client-a:2,client-b:0.5"；客户端标识见 main._client_id
+    LLM_CLIENT_WEIGHTS: str = os.getenv("LLM_CLIENT_WEIGHTS", "")
+
+    # --- 自适应 max_tokens (app/token_stats.py) ---
+    ADAPTIVE_MAX_TOKENS: bool = os.getenv("ADAPTIVE_MAX_TOKENS", "true").lower() in ("1", "true", "yes")
+    # 取每条目 completion token 数的该分位值，再乘以 (1 + 余量)
+    ADAPTIVE_MAX_TOKENS_PERCENTILE: float = float(os.getenv("ADAPTIVE_MAX_TOKENS_PERCENTILE", "95"))
+    ADAPTIVE_MAX_TOKENS_MARGIN: float = float(os.getenv("ADAPTIVE_MAX_TOKENS_MARGIN", "0.2"))
+    # 样本数不足时使用固定估算值
+    ADAPTIVE_MAX_TOKENS_MIN_SAMPLES: int = int(os.getenv("ADAPTIVE_MAX_TOKENS_MIN_SAMPLES", "20"))
+    # 每个阶段/模型保留的最近样本数
+    ADAPTIVE_MAX_TOKENS_WINDOW: int = int(os.getenv("ADAPTIVE_MAX_TOKENS_WINDOW", "500"))
+    ADAPTIVE_MAX_TOKENS_FLOOR: int = int(os.getenv("ADAPTIVE_MAX_TOKENS_FLOOR", "64"))
+    ADAPTIVE_MAX_TOKENS_CEILING: int = int(os.getenv("ADAPTIVE_MAX_TOKENS_CEILING", "8192"))
+
+    # --- 会话存储 (app/session_store.py) ---
+    # "directory": data/<date>_<session_id>/*.json；"segment": 追加写入的压缩 JSONL 段文件 + 偏移索引
+    SESSION_STORE_BACKEND: str = os.getenv("SESSION_STORE_BACKEND", "directory")
+    SESSION_SEGMENT_DIR: str = os.getenv("SESSION_SEGMENT_DIR", str(PROJECT_ROOT_DIR / "data" / "segments"))
+    # gzip 或 zstd（zstd 需要 pip install zstandard，未安装时启动报错）；读取时按每条记录的魔数解码，切换后旧段文件仍可读
+    SESSION_SEGMENT_COMPRESSION: str = os.getenv("SESSION_SEGMENT_COMPRESSION", "gzip")
+    SESSION_SEGMENT_MAX_BYTES: int = int(os.getenv("SESSION_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+    # 后台压缩间隔（秒），0 表示不在服务进程内压缩
+    SESSION_COMPACTION_INTERVAL_SECONDS: int = int(os.getenv("SESSION_COMPACTION_INTERVAL_SECONDS", "600"))
+    # 已封存段文件中有效数据占比低于该值时重写
+    SESSION_COMPACTION_MIN_LIVE_RATIO: float = float(os.getenv("SESSION_COMPACTION_MIN_LIVE_RATIO", "0.5"))
+
+    # --- 近似重复检测 (app/diversity.py) ---
+    DEDUP_ENABLED: bool = os.getenv("DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+    # 字符 5-gram 的 Jaccard 相似度阈值，超过即视为近似重复
+    DEDUP_SIMILARITY_THRESHOLD: float = float(os.getenv("DEDUP_SIMILARITY_THRESHOLD", "0.6"))
+    # 针对被标记条目重新请求 LLM 的最大轮数
+    DEDUP_MAX_ROUNDS: int = int(os.getenv("DEDUP_MAX_ROUNDS", "1"))
+
+    # --- 近似重复产品复用 (app/product_index.py) ---
+    # off: 不查找；offer: 只在响应中报告可复用的会话；questions: 复用摘要与画像，只重新生成问题；
+    # full: 参数兼容时直接复用全部结果（不调用 LLM）。请求体中的 reuse 字段可覆盖
+    PRODUCT_REUSE_MODE: str = os.getenv("PRODUCT_REUSE_MODE", "offer")
+    # 产品文档词级 3-gram 的 Jaccard 相似度阈值
+    PRODUCT_REUSE_THRESHOLD: float = float(os.getenv("PRODUCT_REUSE_THRESHOLD", "0.8"))
+
+    # --- 准入控制 (app/admission.py，每个 worker 独立) ---
+    # 同时进行的生成流水线数上限，以及在途估算成本（上游调用次数）上限
+    ADMISSION_MAX_IN_FLIGHT: int = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "8"))
+    ADMISSION_MAX_COST: int = int(os.getenv("ADMISSION_MAX_COST", "64"))
+    # 等待队列长度与最长排队时间（秒），超出即返回 503 + Retry-After
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "16"))
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "30"))
+    # 尚无完成记录时的 Retry-After，以及 Retry-After 的上限（秒）
+    ADMISSION_DEFAULT_RETRY_AFTER: int = int(os.getenv("ADMISSION_DEFAULT_RETRY_AFTER", "10"))
+    ADMISSION_MAX_RETRY_AFTER: int = int(os.getenv("ADMISSION_MAX_RETRY_AFTER", "120"))
+
+    # --- 客户端断开 (app/cancellation.py) ---
+    # 检查客户端连接的间隔（秒）；断开后取消生成流水线
+    CLIENT_DISCONNECT_POLL_SECONDS: float = float(os.getenv("CLIENT_DISCONNECT_POLL_SECONDS", "0.5"))
+    # 断开时是否保存已完成部分（status: cancelled），可通过 GET /v1/sessions/{session_id} 读取
+    PERSIST_PARTIAL_ON_DISCONNECT: bool = os.getenv("PERSIST_PARTIAL_ON_DISCONNECT", "true").lower() in ("1", "true", "yes")
+
+    # --- 幂等键 (app/idempotency.py，Idempotency-Key 请求头，索引在共享状态库中) ---
+    # 已完成的键保留多久（秒），期间用同一个键重试直接返回已保存的结果
+    IDEMPOTENCY_TTL_SECONDS: int = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+    # 重试请求等待进行中的生成的最长时间（秒），超时返回 409 + Retry-After
+    IDEMPOTENCY_WAIT_TIMEOUT_SECONDS: float = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT_SECONDS", "600"))
+    # 进行中的键超过该时间（秒）没有心跳视为已中断（例如 worker 崩溃），允许重新生成；心跳间隔为其 1/3
+    IDEMPOTENCY_STALE_SECONDS: int = int(os.getenv("IDEMPOTENCY_STALE_SECONDS", "900"))
+
+    # --- 大规模生成模式 (app/scale_generation.py) ---
+    # 单个任务同时进行的画像批次数（问题生成另外受 LLM 调度器限制）
+    SCALE_MAX_CONCURRENT_BATCHES: int = int(os.getenv("SCALE_MAX_CONCURRENT_BATCHES", "4"))
+    # 每个 worker 同时运行的大规模生成任务数，超出时返回 503 + Retry-After
+    SCALE_MAX_CONCURRENT_JOBS: int = int(os.getenv("SCALE_MAX_CONCURRENT_JOBS", "2"))
+    # 去重会丢弃部分画像，允许额外请求的批次比例
+    SCALE_EXTRA_BATCH_RATIO: float = float(os.getenv("SCALE_EXTRA_BATCH_RATIO", "0.3"))
+
+
 settings = Settings()
 
 if not settings.EXTERNAL_API_KEY:
-    print(f"警告：EXTERNAL_API_KEY 未在 .env 文件或环境变量中设置。程序可能无法正常调用外部LLM API。")
\ No newline at end of file
+    print(f"警告：EXTERNAL_API_KEY 未在 .env 文件或环境变量中设置。程序可能无法正常调用外部LLM API。")
@@ -0,0 +1,163 @@
+# app/diversity.py
+# 本地近似重复检测：字符 shingle + MinHash + LSH 分桶。
+# 用于在每个生成阶段之后找出近似重复的画像/问题，只针对被标记的条目重新请求 LLM，
+# 并计算返回给前端的多样性得分。
+import hashlib
+import re
+import struct
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_NON_WORD_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    text = _NON_WORD_RE.sub(" ", text.lower())
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def shingles(text: str, k: int = 5, unit: str = "char") -> Set[str]:
+    """
+    Split normalised text into k-shingles. `unit="char"` suits short texts such as questions;
+    `unit="word"` suits long documents.
+    """
+    normalized = normalize_text(text)
+    if unit == "word":
+        tokens = normalized.split(" ")
+        if len(tokens) <= k:
+            return {" ".join(tokens)} if normalized else set()
+        return {" ".join(tokens[i:i + k]) for i in range(len(tokens) - k + 1)}
+    if len(normalized) <= k:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + k] for i in range(len(normalized) - k + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _permutations(num_perm: int) -> List[Tuple[int, int]]:
+    # 固定种子，保证不同进程/重启之间签名可比较（产品索引会持久化签名）
+    perms = []
+    for i in range(num_perm):
+        digest = hashlib.sha256(f"minhash-perm-{i}".encode()).digest()
+        a, b = struct.unpack("<QQ", digest[:16])
+        perms.append((a % (_MERSENNE_PRIME - 1) + 1, b % _MERSENNE_PRIME))
+    return perms
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 64):
+        self.num_perm = num_perm
+        self._perms = _permutations(num_perm)
+
+    def signature(self, shingle_set: Iterable[str]) -> List[int]:
+        sig = [_MAX_HASH] * self.num_perm
+        for sh in shingle_set:
+            h = struct.unpack("<I", hashlib.blake2b(sh.encode("utf-8"), digest_size=4).digest())[0]
+            for i, (a, b) in enumerate(self._perms):
+                v = ((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH
+                if v < sig[i]:
+                    sig[i] = v
+        return sig
+
+
+def estimate_similarity(sig_a: List[int], sig_b: List[int]) -> float:
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+class NearDuplicateIndex:
+    """
+    Incremental MinHash-LSH index. Candidates found through LSH buckets are verified with
+    exact Jaccard similarity on the stored shingle sets (or estimated similarity if `keep_shingles=False`).
+    """
+
+    def __init__(self, threshold: float, num_perm: int = 64, bands: int = 16,
+                 shingle_size: int = 5, unit: str = "char", keep_shingles: bool = True):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be divisible by bands.")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.unit = unit
+        self.keep_shingles = keep_shingles
+        self._hasher = MinHasher(num_perm)
+        self._buckets: List[Dict[Tuple[int, ...], List[Hashable]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[Hashable, List[int]] = {}
+        self._shingles: Dict[Hashable, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _band_keys(self, sig: List[int]) -> List[Tuple[int, ...]]:
+        return [tuple(sig[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+    def prepare(self, text: str) -> Tuple[Set[str], List[int]]:
+        sh = shingles(text, self.shingle_size, self.unit)
+        return sh, self._hasher.signature(sh)
+
+    def query_prepared(self, sh: Set[str], sig: List[int]) -> Optional[Tuple[Hashable, float]]:
+        """Return (key, similarity) of the most similar indexed item at or above threshold, if any."""
+        candidates = set()
+        for band, key in enumerate(self._band_keys(sig)):
+            candidates.update(self._buckets[band].get(key, ()))
+        best: Optional[Tuple[Hashable, float]] = None
+        for cand in candidates:
+            if self.keep_shingles:
+                sim = jaccard(sh, self._shingles[cand])
+            else:
+                sim = estimate_similarity(sig, self._signatures[cand])
+            if sim >= self.threshold and (best is None or sim > best[1]):
+                best = (cand, sim)
+        return best
+
+    def query(self, text: str) -> Optional[Tuple[Hashable, float]]:
+        return self.query_prepared(*self.prepare(text))
+
+    def add_prepared(self, key: Hashable, sh: Set[str], sig: List[int]) -> None:
+        self._signatures[key] = sig
+        if self.keep_shingles:
+            self._shingles[key] = sh
+        for band, band_key in enumerate(self._band_keys(sig)):
+            self._buckets[band].setdefault(band_key, []).append(key)
+
+    def add(self, key: Hashable, text: str) -> None:
+        self.add_prepared(key, *self.prepare(text))
+
+    def check_and_add(self, key: Hashable, text: str) -> Optional[Tuple[Hashable, float]]:
+        """
+        Index `text` unless it is a near-duplicate of an already indexed item.
+        Returns (duplicate_of_key, similarity) when flagged, otherwise None.
+        """
+        sh, sig = self.prepare(text)
+        match = self.query_prepared(sh, sig)
+        if match is None:
+            self.add_prepared(key, sh, sig)
+        return match
+
+
+def find_near_duplicates(items: List[Tuple[Hashable, str]], threshold: float
+                         ) -> Dict[Hashable, Tuple[Hashable, float]]:
+    """
+    Flag later items that nearly duplicate an earlier one.
+    Returns {flagged_key: (duplicate_of_key, similarity)}; the first occurrence is never flagged.
+    """
+    index = NearDuplicateIndex(threshold)
+    flagged: Dict[Hashable, Tuple[Hashable, float]] = {}
+    for key, text in items:
+        match = index.check_and_add(key, text)
+        if match is not None:
+            flagged[key] = match
+    return flagged
+
+
+def diversity_score(total: int, duplicates: int) -> float:
+    """Share of items that are not near-duplicates of another item (1.0 = fully distinct)."""
+    if total <= 0:
+        return 1.0
+    return round((total - duplicates) / total, 4)
@@ -0,0 +1,186 @@
+# app/export.py
+# 会话数据批量导出：逐个会话惰性读取，按“每个问题一行”展开，以 NDJSON 或 CSV 流式输出，可选 gzip。
+# 内存占用只与单个画像（大规模生成会话按画像逐行读取）大小有关，与归档总大小无关。
+#
+# 命令行用法（在项目根目录）:
+#   python -m app.export --format csv --gzip -o questions.csv.gz --date-from 20250101 --product solar
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from . import session_store
+from . import structured_logging
+
+logger = structured_logging.get_logger(__name__)
+
+EXPORT_FORMATS = ("ndjson", "csv")
+
+# 只导出完整的会话：普通会话完成时输出文件没有 status，大规模生成会话的清单为 "completed"；
+# running / failed / cancelled 的会话只有部分结果
+FINISHED_STATUSES = (None, "completed")
+
+EXPORT_FIELDS = [
+    "session_id", "generation_date", "product_title", "product_summary",
+    "profile_id", "profile_name", "country_region", "occupation", "cognitive_level",
+    "main_concerns", "potential_needs",
+    "question_type", "question_index", "question_id", "question_text",
+]
+
+
+def normalize_date(value: Optional[str]) -> Optional[str]:
+    """Accept YYYYMMDD or YYYY-MM-DD, return YYYYMMDD (or None)."""
+    if not value:
+        return None
+    normalized = value.replace("-", "")
+    if len(normalized) != 8 or not normalized.isdigit():
+        raise ValueError(f"Invalid date '{value}', expected YYYYMMDD or YYYY-MM-DD.")
+    return normalized
+
+
+def _product_title(product_document: str) -> str:
+    # 以文档第一行非空文本作为产品标题
+    for line in product_document.splitlines():
+        line = line.strip()
+        if line:
+            return line[:200]
+    return ""
+
+
+def _session_profiles(session_id: str, session_date: str, output_data: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    # 大规模生成的会话把画像逐行追加在单独的 JSONL 文件中，其余会话内嵌在输出文件里
+    profiles_file = output_data.get("customer_profiles_file")
+    if profiles_file:
+        return session_store.iter_json_records(session_id, profiles_file, session_date)
+    return output_data.get("customer_profiles_generated", [])
+
+
+def _session_records(session_id: str, session_date: str, input_data: Dict[str, Any], output_data: Dict[str, Any]
+                     ) -> Iterator[List[Dict[str, Any]]]:
+    """Yield the question records of one session, one list per profile."""
+    base = {
+        "session_id": session_id,
+        "generation_date": output_data.get("generation_date") or input_data.get("generation_date"),
+        "product_title": _product_title(input_data.get("product_document", "")),
+        "product_summary": output_data.get("product_summary_generated"),
+    }
+    for profile in _session_profiles(session_id, session_date, output_data):
+        profile_fields = {
+            "profile_id": profile.get("id"),
+            "profile_name": profile.get("name"),
+            "country_region": profile.get("country_region"),
+            "occupation": profile.get("occupation"),
+            "cognitive_level": profile.get("cognitive_level"),
+            "main_concerns": profile.get("main_concerns") or [],
+            "potential_needs": profile.get("potential_needs"),
+        }
+        records = [
+            {
+                **base,
+                **profile_fields,
+                "question_type": question_type,
+                "question_index": index,
+                "question_id": question.get("id"),
+                "question_text": question.get("text"),
+            }
+            for question_type, key in (("B2B", "b2b_questions"), ("B2C", "b2c_questions"))
+            for index, question in enumerate(profile.get(key, []))
+        ]
+        if records:
+            yield records
+
+
+def iter_question_records(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                          product: Optional[str] = None) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield the flattened question records in small batches (one profile at a time).
+    `product` is a case-insensitive substring matched against the product document and summary.
+    """
+    product_filter = product.lower() if product else None
+    for session_id, session_date in session_store.iter_sessions(normalize_date(date_from), normalize_date(date_to)):
+        try:
+            # 带上 iter_sessions 给出的日期，目录存储直接读取 <date>_<id>/，不再为每个会话扫描 data 目录
+            output_data = session_store.load_json_data(session_id, session_store.OUTPUT_FILENAME, session_date)
+            if not output_data or output_data.get("status") not in FINISHED_STATUSES:
+                continue  # 尚未完成、生成失败或被取消后只保存了部分结果的会话
+            input_data = session_store.load_json_data(session_id, session_store.INPUT_FILENAME, session_date) or {}
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("导出时跳过无法读取的会话 %s: %s", session_id, e)
+            continue
+
+        if product_filter:
+            haystack = f"{input_data.get('product_document', '')}\n{output_data.get('product_summary_generated') or ''}"
+            if product_filter not in haystack.lower():
+                continue
+
+        try:
+            yield from _session_records(session_id, session_date, input_data, output_data)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("导出时会话 %s 读取中断: %s", session_id, e)
+
+
+def iter_ndjson(session_batches: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    for records in session_batches:
+        yield "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+
+
+def iter_csv(session_batches: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    # UTF-8 BOM 方便 Excel 正确识别中文
+    yield b"\xef\xbb\xbf" + buffer.getvalue().encode("utf-8")
+    for records in session_batches:
+        buffer.seek(0)
+        buffer.truncate()
+        for r in records:
+            writer.writerow({**r, "main_concerns": "; ".join(r["main_concerns"])})
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_gzip(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: gzip 容器格式
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_stream(export_format: str = "ndjson", gzip: bool = False, date_from: Optional[str] = None,
+                  date_to: Optional[str] = None, product: Optional[str] = None) -> Iterator[bytes]:
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format '{export_format}', expected one of {EXPORT_FORMATS}.")
+    # 参数在生成器启动前校验，便于 HTTP 接口返回 400 而不是中断的流
+    normalize_date(date_from)
+    normalize_date(date_to)
+    batches = iter_question_records(date_from, date_to, product)
+    chunks = iter_ndjson(batches) if export_format == "ndjson" else iter_csv(batches)
+    return iter_gzip(chunks) if gzip else chunks
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export all stored sessions as one row per generated question.")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--gzip", action="store_true", help="Compress the output with gzip on the fly.")
+    parser.add_argument("--date-from", help="Inclusive start date (YYYYMMDD or YYYY-MM-DD).")
+    parser.add_argument("--date-to", help="Inclusive end date (YYYYMMDD or YYYY-MM-DD).")
+    parser.add_argument("--product", help="Only sessions whose product document/summary contains this text.")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout).")
+    args = parser.parse_args(argv)
+
+    chunks = export_stream(args.format, args.gzip, args.date_from, args.date_to, args.product)
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
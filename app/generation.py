@@ -0,0 +1,472 @@
+# app/generation.py
+# “产品文档 → 摘要 → 画像 → 每个画像的 B2B/B2C 问题” 的生成流程，以 pipeline.Stage 的 DAG 形式定义：
+#
+#   persist_input ───────────────────────────────────────────────┐
+#   summary ──┬─> profiles ─> validate_profiles ─┬─> questions:<i>:B2B ─┐
+#             │   (可推测执行：直接基于原始文档)     └─> questions:<i>:B2C ─┴─> dedupe_questions ─> assemble ─> persist_output
+#             └──────────────────────────────────────────(问题阶段同样依赖 summary)
+#
+# - 保存输入与摘要调用并行
+# - 每个画像通过近似重复检查后立即添加并启动它的问题阶段，无需等待其余画像校验/重新生成
+# - PIPELINE_SPECULATIVE_PROFILES 开启时，画像生成与摘要并行，直接基于原始文档
+# - 产品文档与已保存会话近似重复时（app/product_index.py），把复用的摘要/画像作为已完成阶段传入流水线，
+#   只运行剩下的阶段；参数兼容且 reuse=full 时直接复用全部结果
+# - 摘要、画像、画像校验、各问题阶段与问题去重完成时追加写入会话的 stage_checkpoints.jsonl；
+#   生成失败或被取消后，resume_generation 把已完成的阶段作为预先完成的结果传入流水线，从第一个未完成的阶段继续
+# - 生成期间会话在共享状态中标记为运行中（带心跳），恢复请求不会与原生成或另一个恢复同时写同一会话
+import asyncio
+import contextlib
+import dataclasses
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import settings
+from . import diversity
+from . import llm_service
+from . import product_index
+from . import prompt_sets
+from . import session_store
+from . import shared_state
+from . import structured_logging
+from . import structured_output
+from .admission import estimate_generation_cost
+from .pipeline import PipelineRun, Stage
+from .pydantic_models import AiCustomerDataResponse, CustomerProfile, DiversityReport, GeneratedQuestion, \
+    ProductInfoRequest, ReuseReport
+from .session_store import save_json_data
+
+logger = structured_logging.get_logger(__name__)
+
+CHECKPOINT_FILENAME = "stage_checkpoints.jsonl"
+
+# 运行中标记的心跳间隔；超过 _RUNNING_STALE_SECONDS 没有心跳视为持有者已崩溃
+_RUNNING_HEARTBEAT_SECONDS = 30.0
+_RUNNING_STALE_SECONDS = 120.0
+
+
+class SessionAlreadyRunning(Exception):
+    pass
+
+
+def info_for_llm(product_summary: Optional[str], product_document: str) -> str:
+    # 摘要可用时用摘要作为后续提示的产品信息，否则退回原始文档
+    if product_summary and "malformed" not in product_summary.lower() and "error" not in product_summary.lower():
+        return product_summary
+    return product_document
+
+
+def split_question_counts(num_total_questions_per_profile: int) -> Tuple[int, int]:
+    num_b2b_questions = num_total_questions_per_profile // 2
+    num_b2c_questions = num_total_questions_per_profile - num_b2b_questions
+    if num_total_questions_per_profile == 1 and num_total_questions_per_profile > 0:  # Ensure at least one question type gets one if total is 1
+        num_b2b_questions = 0  # Or your preferred logic for a single question
+        num_b2c_questions = 1
+    return num_b2b_questions, num_b2c_questions
+
+
+def question_stage_name(slot: int, question_type: str) -> str:
+    return f"questions:{slot}:{question_type}"
+
+
+@dataclasses.dataclass
+class GenerationJob:
+    request: ProductInfoRequest
+    session_id: str
+    session_date_str: str
+    persist: bool = True
+    # 已通过校验的画像，按槽位顺序；问题阶段完成后填入各自的问题列表
+    profiles: List[CustomerProfile] = dataclasses.field(default_factory=list)
+    # 执行中的流水线，取消后用于保存部分结果
+    run: Optional[PipelineRun] = None
+    # 近似重复产品的复用情况（查找关闭时为 None）
+    reuse: Optional[ReuseReport] = None
+
+    def input_record(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "generation_date": self.session_date_str,
+            "product_document": self.request.product_document,
+            "requested_profiles": self.request.num_customer_profiles,
+            "requested_questions_total_per_profile": self.request.num_questions_per_profile,
+            "template_set": prompt_sets.resolve(self.request.template_set)
+        }
+
+
+def build_generation_stages(job: GenerationJob) -> List[Stage]:
+    product_document = job.request.product_document
+    num_profiles_req = job.request.num_customer_profiles
+    num_b2b_questions, num_b2c_questions = split_question_counts(job.request.num_questions_per_profile)
+    question_counts = [(t, n) for t, n in (("B2B", num_b2b_questions), ("B2C", num_b2c_questions)) if n > 0]
+
+    def context(run: PipelineRun) -> str:
+        return info_for_llm(run.results["summary"], product_document)
+
+    async def persist_input(run: PipelineRun):
+        if job.persist:
+            await asyncio.to_thread(save_json_data, job.input_record(), session_store.INPUT_FILENAME,
+                                    job.session_id, job.session_date_str)
+
+    async def summary(run: PipelineRun) -> str:
+        return await llm_service.generate_product_summary(product_document)
+
+    async def profiles(run: PipelineRun) -> List[CustomerProfile]:
+        return await llm_service.generate_customer_profiles_from_llm(context(run), num_profiles_req)
+
+    async def profiles_from_document(run: PipelineRun) -> List[CustomerProfile]:
+        # 推测执行：不等摘要，直接基于原始文档生成画像
+        return await llm_service.generate_customer_profiles_from_llm(product_document, num_profiles_req)
+
+    def make_question_stage(slot: int, question_type: str, num_questions: int) -> Stage:
+        async def questions(run: PipelineRun) -> List[GeneratedQuestion]:
+            generate = (llm_service.generate_b2b_questions_for_profile if question_type == "B2B"
+                        else llm_service.generate_b2c_questions_for_profile)
+            return await generate(profile=job.profiles[slot], product_info_or_summary=context(run),
+                                  num_questions=num_questions)
+
+        return Stage(question_stage_name(slot, question_type), questions, deps=("summary",))
+
+    def accept_profile(run: PipelineRun, profile: CustomerProfile) -> None:
+        slot = len(job.profiles)
+        job.profiles.append(profile)
+        for question_type, num_questions in question_counts:
+            run.add_stage(make_question_stage(slot, question_type, num_questions))
+
+    async def validate_profiles(run: PipelineRun) -> Dict[str, int]:
+        """
+        Check profiles one by one; each profile that is not a near-duplicate immediately gets its
+        question stages. Flagged profiles are re-requested (only those), and originals are kept if no
+        distinct replacement comes back.
+        """
+        threshold = settings.DEDUP_SIMILARITY_THRESHOLD
+        index = diversity.NearDuplicateIndex(threshold)
+        flagged_profiles: List[CustomerProfile] = []
+
+        def screen(profiles: List[CustomerProfile], limit: Optional[int] = None) -> List[bool]:
+            # 在工作线程中执行（MinHash 是纯 CPU 计算，不阻塞事件循环）：返回每个画像是否不采用，
+            # 即近似重复，或已经采用了 limit 个
+            accepted, rejected = 0, []
+            for profile in profiles:
+                if limit is not None and accepted >= limit:
+                    rejected.append(True)
+                    continue
+                duplicate = index.check_and_add(len(job.profiles) + accepted,
+                                                llm_service.profile_similarity_text(profile)) is not None
+                accepted += 0 if duplicate else 1
+                rejected.append(duplicate)
+            return rejected
+
+        candidates = run.results["profiles"][:num_profiles_req]
+        rejected = await asyncio.to_thread(screen, candidates) if settings.DEDUP_ENABLED else [False] * len(candidates)
+        for profile, duplicate in zip(candidates, rejected):
+            if duplicate:
+                flagged_profiles.append(profile)
+                continue
+            accept_profile(run, profile)
+
+        report = {"flagged": len(flagged_profiles), "regenerated": 0, "remaining": 0}
+        for _ in range(settings.DEDUP_MAX_ROUNDS):
+            if not flagged_profiles:
+                break
+            avoid = [f"{p.name}: {p.description}" for p in job.profiles]
+            replacements = await llm_service.generate_customer_profiles_from_llm(
+                context(run), len(flagged_profiles), avoid)
+            rejected = await asyncio.to_thread(screen, replacements, len(flagged_profiles))
+            for profile, duplicate in zip(replacements, rejected):
+                if not duplicate:
+                    flagged_profiles.pop(0)
+                    accept_profile(run, profile)
+                    report["regenerated"] += 1
+
+        # 没有拿到足够不同的替换时保留原画像，保证数量
+        report["remaining"] = len(flagged_profiles)
+        for profile in flagged_profiles:
+            accept_profile(run, profile)
+
+        run.add_stage(dedupe_stage())
+        return report
+
+    def dedupe_stage() -> Stage:
+        question_stages = tuple(question_stage_name(slot, question_type)
+                                for slot in range(len(job.profiles)) for question_type, _ in question_counts)
+        return Stage("dedupe_questions", dedupe_questions, deps=("summary",) + question_stages)
+
+    async def dedupe_questions(run: PipelineRun) -> Dict[str, int]:
+        for slot, profile in enumerate(job.profiles):
+            profile.b2b_questions = run.results.get(question_stage_name(slot, "B2B"), [])
+            profile.b2c_questions = run.results.get(question_stage_name(slot, "B2C"), [])
+        total = sum(len(p.b2b_questions) + len(p.b2c_questions) for p in job.profiles)
+        if not settings.DEDUP_ENABLED:
+            return {"flagged": 0, "regenerated": 0, "remaining": 0, "total": total}
+        return await llm_service.regenerate_near_duplicate_questions(job.profiles, context(run))
+
+    async def assemble(run: PipelineRun) -> AiCustomerDataResponse:
+        profile_dedup = run.results["validate_profiles"]
+        question_dedup = run.results["dedupe_questions"]
+        num_profiles = len(job.profiles)
+        total_items = num_profiles + question_dedup["total"]
+        remaining_duplicates = profile_dedup["remaining"] + question_dedup["remaining"]
+        diversity_report = DiversityReport(
+            score=diversity.diversity_score(total_items, remaining_duplicates),
+            profile_score=diversity.diversity_score(num_profiles, profile_dedup["remaining"]),
+            question_score=diversity.diversity_score(question_dedup["total"], question_dedup["remaining"]),
+            duplicates_flagged=profile_dedup["flagged"] + question_dedup["flagged"],
+            duplicates_regenerated=profile_dedup["regenerated"] + question_dedup["regenerated"]
+        )
+        return AiCustomerDataResponse(
+            product_summary=run.results["summary"],
+            customer_profiles=job.profiles,
+            diversity=diversity_report
+        )
+
+    async def persist_output(run: PipelineRun):
+        if job.persist:
+            await save_output(job, run.results["assemble"], run.stage_timings_ms())
+
+    stages = [
+        Stage("persist_input", persist_input),
+        Stage("summary", summary),
+        Stage("profiles", profiles, deps=("summary",), speculative=profiles_from_document),
+        Stage("validate_profiles", validate_profiles, deps=("profiles",)),
+        Stage("assemble", assemble, deps=("validate_profiles", "dedupe_questions")),
+        Stage("persist_output", persist_output, deps=("assemble", "persist_input")),
+    ]
+    if job.profiles:
+        # 从检查点恢复：画像已校验，validate_profiles 不会再运行，由这里登记问题阶段与问题去重
+        stages += [make_question_stage(slot, question_type, num_questions)
+                   for slot in range(len(job.profiles)) for question_type, num_questions in question_counts]
+        stages.append(dedupe_stage())
+    return stages
+
+
+async def save_output(job: GenerationJob, response_data_obj: AiCustomerDataResponse,
+                      stage_timings_ms: Dict[str, Optional[float]]) -> None:
+    output_data_to_save = {
+        "session_id": job.session_id,
+        "generation_date": job.session_date_str,
+        "product_summary_generated": response_data_obj.product_summary,
+        "customer_profiles_generated": [profile.model_dump(exclude_none=True) for profile in
+                                        response_data_obj.customer_profiles],  # Convert Pydantic to dicts
+        "diversity": response_data_obj.diversity.model_dump() if response_data_obj.diversity else None,
+        "stage_timings_ms": stage_timings_ms
+    }
+    if job.reuse is not None and job.reuse.applied != "none":
+        output_data_to_save["reuse"] = job.reuse.model_dump()
+    await asyncio.to_thread(save_json_data, output_data_to_save, session_store.OUTPUT_FILENAME,
+                            job.session_id, job.session_date_str)
+    try:
+        await asyncio.to_thread(product_index.add_document, job.session_id, job.session_date_str,
+                                job.request.product_document)
+    except Exception as e:
+        logger.warning("产品索引更新失败（会话 %s）: %s", job.session_id, e)
+
+
+async def prepare_reuse(job: GenerationJob) -> Tuple[Dict[str, Any], Optional[product_index.ReuseCandidate]]:
+    """
+    Look up a stored session with a near-duplicate product document and decide what to reuse.
+    Returns the pipeline results to preresolve and the candidate; sets `job.reuse`.
+    """
+    request = job.request
+    mode = request.reuse or settings.PRODUCT_REUSE_MODE
+    if mode == "off":
+        return {}, None
+    job.reuse = ReuseReport(mode=mode)
+    try:
+        candidate = await asyncio.to_thread(product_index.find_similar, request.product_document,
+                                            settings.PRODUCT_REUSE_THRESHOLD)
+    except Exception as e:
+        logger.warning("产品复用索引查询失败: %s", e)
+        return {}, None
+    if candidate is None:
+        return {}, None
+    job.reuse.source_session_id = candidate.session_id
+    job.reuse.similarity = candidate.similarity
+    summary = candidate.output_data.get("product_summary_generated")
+    if mode == "offer" or not summary:
+        return {}, candidate
+
+    # 复用摘要；已保存的画像足够时连同画像一起复用（作为新画像：新的 id，问题重新生成）
+    preresolved: Dict[str, Any] = {"summary": summary}
+    job.reuse.applied = "summary"
+    job.reuse.llm_calls_saved = 1
+    stored_profiles = candidate.output_data.get("customer_profiles_generated", [])
+    if len(stored_profiles) >= request.num_customer_profiles:
+        stored_profiles = stored_profiles[:request.num_customer_profiles]
+        preresolved["profiles"] = structured_output.fresh_profiles(stored_profiles)
+        job.reuse.applied = "profiles"
+        job.reuse.reused_profiles = request.num_customer_profiles
+        job.reuse.llm_calls_saved = 2
+        same_question_count = (candidate.input_data.get("requested_questions_total_per_profile")
+                               == request.num_questions_per_profile)
+        if mode == "full" and same_question_count:
+            job.reuse.applied = "all"
+            job.reuse.reused_questions = sum(len(p.get("b2b_questions", [])) + len(p.get("b2c_questions", []))
+                                             for p in stored_profiles)
+            job.reuse.llm_calls_saved = estimate_generation_cost(request.num_customer_profiles,
+                                                                 request.num_questions_per_profile)
+    return preresolved, candidate
+
+
+def response_from_output(output_data: Dict[str, Any], max_profiles: Optional[int] = None) -> AiCustomerDataResponse:
+    """Rebuild the API response from a stored generated_customer_data.json."""
+    stored_diversity = output_data.get("diversity")
+    stored_reuse = output_data.get("reuse")
+    return AiCustomerDataResponse(
+        product_summary=output_data.get("product_summary_generated"),
+        customer_profiles=[CustomerProfile.model_validate(p)
+                           for p in output_data.get("customer_profiles_generated", [])[:max_profiles]],
+        diversity=DiversityReport.model_validate(stored_diversity) if stored_diversity else None,
+        stage_timings_ms=output_data.get("stage_timings_ms"),
+        reuse=ReuseReport.model_validate(stored_reuse) if stored_reuse else None
+    )
+
+
+async def reuse_all(job: GenerationJob, candidate: product_index.ReuseCandidate) -> AiCustomerDataResponse:
+    """Build (and persist as a new session) a response entirely from the candidate session, without LLM calls."""
+    response_data_obj = response_from_output(candidate.output_data, job.request.num_customer_profiles).model_copy(
+        update={"stage_timings_ms": {}, "reuse": job.reuse})
+    if job.persist:
+        await asyncio.to_thread(save_json_data, job.input_record(), session_store.INPUT_FILENAME,
+                                job.session_id, job.session_date_str)
+        await save_output(job, response_data_obj, {})
+    return response_data_obj
+
+
+def partial_output_record(job: GenerationJob, status: str = "cancelled") -> Dict[str, Any]:
+    """Output record built from whatever stages finished before the run was cancelled."""
+    results = job.run.results if job.run is not None else {}
+    profiles = []
+    for slot, profile in enumerate(job.profiles):
+        if "dedupe_questions" not in results:
+            # 问题还未回填到画像上，取已完成的问题阶段结果
+            profile = profile.model_copy(update={
+                "b2b_questions": results.get(question_stage_name(slot, "B2B"), []),
+                "b2c_questions": results.get(question_stage_name(slot, "B2C"), []),
+            })
+        profiles.append(profile.model_dump(exclude_none=True))
+    return {
+        "session_id": job.session_id,
+        "generation_date": job.session_date_str,
+        "status": status,
+        "product_summary_generated": results.get("summary"),
+        "customer_profiles_generated": profiles,
+        "stage_timings_ms": job.run.stage_timings_ms() if job.run is not None else {},
+    }
+
+
+async def save_partial_output(job: GenerationJob, status: str = "cancelled") -> None:
+    await asyncio.to_thread(save_json_data, job.input_record(), session_store.INPUT_FILENAME,
+                            job.session_id, job.session_date_str)
+    await asyncio.to_thread(save_json_data, partial_output_record(job, status), session_store.OUTPUT_FILENAME,
+                            job.session_id, job.session_date_str)
+
+
+def _is_checkpointed(stage: str) -> bool:
+    return stage in ("summary", "profiles", "validate_profiles", "dedupe_questions") or stage.startswith("questions:")
+
+
+def _checkpoint_result(job: GenerationJob, stage: str, result: Any) -> Any:
+    if stage in ("validate_profiles", "dedupe_questions"):
+        # 这两个阶段返回的是报告，画像（及回填的问题）在 job.profiles 中
+        return {"report": result, "profiles": [p.model_dump(exclude_none=True) for p in job.profiles]}
+    if stage == "summary":
+        return result
+    return [item.model_dump(exclude_none=True) for item in result]
+
+
+async def checkpoint_stage(job: GenerationJob, stage: str, result: Any) -> None:
+    """Append a finished stage's result to the session's checkpoint file (pipeline on_stage_complete hook)."""
+    if not job.persist or not _is_checkpointed(stage):
+        return
+    record = {"stage": stage, "result": _checkpoint_result(job, stage, result)}
+    try:
+        await asyncio.to_thread(session_store.append_json_record, record, CHECKPOINT_FILENAME,
+                                job.session_id, job.session_date_str)
+    except Exception as e:
+        logger.warning("阶段 %s 的检查点保存失败: %s", stage, e)
+
+
+def restore_checkpoints(job: GenerationJob, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Pipeline results to preresolve from checkpoint records (later records win). A stage is only restored
+    together with the stages it depends on; restoring validate_profiles also refills `job.profiles`.
+    """
+    latest = {record["stage"]: record["result"] for record in records}
+    preresolved: Dict[str, Any] = {}
+    if latest.get("summary") is None:
+        return preresolved
+    preresolved["summary"] = latest["summary"]
+    if "profiles" not in latest:
+        return preresolved
+    preresolved["profiles"] = [CustomerProfile.model_validate(p) for p in latest["profiles"]]
+    if "validate_profiles" not in latest:
+        return preresolved
+
+    deduped = latest.get("dedupe_questions")
+    job.profiles = [CustomerProfile.model_validate(p) for p in (deduped or latest["validate_profiles"])["profiles"]]
+    preresolved["validate_profiles"] = latest["validate_profiles"]["report"]
+    num_b2b_questions, num_b2c_questions = split_question_counts(job.request.num_questions_per_profile)
+    for slot, profile in enumerate(job.profiles):
+        for question_type, num_questions in (("B2B", num_b2b_questions), ("B2C", num_b2c_questions)):
+            name = question_stage_name(slot, question_type)
+            if num_questions <= 0:
+                continue
+            if deduped is not None:
+                preresolved[name] = profile.b2b_questions if question_type == "B2B" else profile.b2c_questions
+            elif name in latest:
+                preresolved[name] = [GeneratedQuestion.model_validate(q) for q in latest[name]]
+    if deduped is not None:
+        preresolved["dedupe_questions"] = deduped["report"]
+    return preresolved
+
+
+async def _execute(job: GenerationJob, preresolved: Dict[str, Any]
+                   ) -> Tuple[AiCustomerDataResponse, Optional[PipelineRun]]:
+    job.run = PipelineRun(build_generation_stages(job), preresolved=preresolved,
+                          on_stage_complete=lambda stage, result: checkpoint_stage(job, stage, result),
+                          enable_speculation=settings.PIPELINE_SPECULATIVE_PROFILES)
+    run = await job.run.execute()
+    response_data_obj: AiCustomerDataResponse = run.results["assemble"]
+    response_data_obj.stage_timings_ms = run.stage_timings_ms()
+    response_data_obj.reuse = job.reuse
+    return response_data_obj, run
+
+
+async def _running_heartbeat(session_id: str) -> None:
+    while True:
+        await asyncio.sleep(_RUNNING_HEARTBEAT_SECONDS)
+        try:
+            await asyncio.to_thread(shared_state.touch_running_session, session_id)
+        except Exception as e:
+            logger.warning("会话 %s 运行中标记的心跳更新失败: %s", session_id, e)
+
+
+@contextlib.asynccontextmanager
+async def running_session(session_id: str):
+    """Hold the session's running mark for the duration of a generation; raises SessionAlreadyRunning if taken."""
+    claimed = await asyncio.to_thread(shared_state.claim_running_session, session_id, _RUNNING_STALE_SECONDS)
+    if not claimed:
+        raise SessionAlreadyRunning(f"Session '{session_id}' is still being generated.")
+    heartbeat = asyncio.create_task(_running_heartbeat(session_id))
+    try:
+        yield
+    finally:
+        heartbeat.cancel()
+        await asyncio.shield(asyncio.to_thread(shared_state.release_running_session, session_id))
+
+
+async def run_generation(job: GenerationJob) -> Tuple[AiCustomerDataResponse, Optional[PipelineRun]]:
+    preresolved, candidate = await prepare_reuse(job)
+    if candidate is not None and job.reuse.applied == "all":
+        return await reuse_all(job, candidate), None
+    for stage, result in preresolved.items():
+        await checkpoint_stage(job, stage, result)  # 复用的摘要/画像同样写入检查点，恢复时保持一致
+    return await _execute(job, preresolved)
+
+
+async def resume_generation(job: GenerationJob) -> Tuple[AiCustomerDataResponse, Optional[PipelineRun]]:
+    """Continue a failed or cancelled generation from the first stage without a checkpoint."""
+    records = await asyncio.to_thread(
+        lambda: list(session_store.iter_json_records(job.session_id, CHECKPOINT_FILENAME, job.session_date_str)))
+    preresolved = restore_checkpoints(job, records)
+    logger.info("从检查点恢复生成，已完成的阶段: %s", sorted(preresolved))
+    preresolved["persist_input"] = None  # 输入在首次生成时已保存
+    return await _execute(job, preresolved)
@@ -0,0 +1,188 @@
+# app/idempotency.py
+# 生成请求的幂等键（Idempotency-Key 请求头）：API 客户端或代理超时重试时不再重复生成、重复付费。
+# 键的索引保存在共享状态库的 idempotency_keys 表中（所有 worker 共用，按主键查找，不扫描会话目录）：
+#   键（客户端标识 + 请求头的值）-> 请求指纹、会话 ID 与日期、状态（in_progress / completed）、过期时间
+#   （记录会话日期，重放时直接定位 data/<日期>_<会话 ID>/，不搜索数据目录）
+#   - completed：直接返回该会话已保存的 generated_customer_data.json
+#   - in_progress：同一 worker 内直接等待正在执行的生成任务；在其他 worker 上执行的则轮询索引直到完成
+#   - 同一个键携带不同的请求参数：拒绝（422）
+#   - 生成失败时删除键，客户端可以用同一个键重试
+#   - 进行中的生成定期刷新 updated_at（心跳）；超过 IDEMPOTENCY_STALE_SECONDS 没有心跳的 in_progress 视为已中断
+#   - 过期的键与中断的键在认领时顺带清理（每个 worker 最多每 _PURGE_INTERVAL_SECONDS 秒一次），表不会无限增长
+# 带幂等键的生成不随客户端断开而取消（重试需要附着到它上面）。
+import asyncio
+import dataclasses
+import hashlib
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+from .config import settings
+from . import shared_state
+from . import structured_logging
+from .pydantic_models import ProductInfoRequest
+
+logger = structured_logging.get_logger(__name__)
+
+_POLL_INTERVAL_SECONDS = 0.5
+_PURGE_INTERVAL_SECONDS = 60.0
+
+_last_purge = 0.0
+
+# 本 worker 中正在执行的带键生成任务
+_local_tasks: Dict[str, asyncio.Task] = {}
+
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class KeyState:
+    status: str  # new / in_progress / completed
+    session_id: str
+    session_date: Optional[str] = None  # 旧版本写入的键没有日期
+
+
+def scoped_key(client_id: str, header_value: str) -> str:
+    # 按客户端隔离，不同客户端使用相同的键不会互相返回对方的结果
+    return f"{client_id}:{header_value.strip()[:200]}"
+
+
+def fingerprint(request_data: ProductInfoRequest) -> str:
+    return hashlib.sha256(request_data.model_dump_json().encode("utf-8")).hexdigest()
+
+
+def claim(key: str, request_fingerprint: str, session_id: str, session_date: str) -> KeyState:
+    """
+    Atomically look up `key`; when it is absent, expired or stale, register it as in_progress for `session_id`
+    of `session_date` (status "new"). Raises IdempotencyConflict when the key was used with different request
+    parameters.
+    """
+    global _last_purge
+    now = time.time()
+    if now - _last_purge >= _PURGE_INTERVAL_SECONDS:
+        _last_purge = now
+        purge_expired()
+    conn = shared_state.get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND (expires_at < ? OR "
+                     "(status = 'in_progress' AND updated_at < ?))",
+                     (key, now, now - settings.IDEMPOTENCY_STALE_SECONDS))
+        row = conn.execute("SELECT fingerprint, session_id, session_date, status FROM idempotency_keys WHERE key = ?",
+                           (key,)).fetchone()
+        if row is None:
+            conn.execute("INSERT INTO idempotency_keys (key, fingerprint, session_id, session_date, status, "
+                         "updated_at, expires_at) VALUES (?, ?, ?, ?, 'in_progress', ?, ?)",
+                         (key, request_fingerprint, session_id, session_date, now,
+                          now + settings.IDEMPOTENCY_TTL_SECONDS))
+            state = KeyState("new", session_id, session_date)
+        else:
+            state = KeyState(row[3], row[1], row[2]) if row[0] == request_fingerprint else None
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if state is None:
+        raise IdempotencyConflict("Idempotency-Key was already used with different request parameters.")
+    return state
+
+
+def lookup(key: str) -> Optional[KeyState]:
+    row = shared_state.get_connection().execute(
+        "SELECT session_id, session_date, status FROM idempotency_keys WHERE key = ? AND expires_at >= ?",
+        (key, time.time())).fetchone()
+    return KeyState(row[2], row[0], row[1]) if row else None
+
+
+def complete(key: str) -> None:
+    now = time.time()
+    shared_state.get_connection().execute(
+        "UPDATE idempotency_keys SET status = 'completed', updated_at = ?, expires_at = ? WHERE key = ?",
+        (now, now + settings.IDEMPOTENCY_TTL_SECONDS, key))
+
+
+def touch(key: str) -> None:
+    shared_state.get_connection().execute(
+        "UPDATE idempotency_keys SET updated_at = ? WHERE key = ? AND status = 'in_progress'", (time.time(), key))
+
+
+def release(key: str) -> None:
+    shared_state.get_connection().execute("DELETE FROM idempotency_keys WHERE key = ?", (key,))
+
+
+def purge_expired() -> int:
+    """Delete expired keys and in-progress keys whose generation stopped sending heartbeats."""
+    now = time.time()
+    return shared_state.get_connection().execute(
+        "DELETE FROM idempotency_keys WHERE expires_at < ? OR (status = 'in_progress' AND updated_at < ?)",
+        (now, now - settings.IDEMPOTENCY_STALE_SECONDS)).rowcount
+
+
+async def _heartbeat(key: str) -> None:
+    interval = max(1.0, settings.IDEMPOTENCY_STALE_SECONDS / 3)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(touch, key)
+        except Exception as e:
+            logger.warning("幂等键 %s 心跳更新失败: %s", key, e)
+
+
+async def _run_and_settle(key: str, awaitable: Awaitable[Any]) -> Any:
+    # 运行期间持续刷新 updated_at，长时间的生成不会被重试请求当作已中断而重复执行
+    heartbeat = asyncio.create_task(_heartbeat(key))
+    try:
+        result = await awaitable
+    except BaseException:
+        await asyncio.to_thread(release, key)  # 失败或被取消：允许用同一个键重试
+        raise
+    finally:
+        heartbeat.cancel()
+    await asyncio.to_thread(complete, key)
+    return result
+
+
+def _forget(key: str, task: asyncio.Task) -> None:
+    if _local_tasks.get(key) is task:
+        del _local_tasks[key]
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("幂等键 %s 的生成失败: %s", key, task.exception())
+
+
+def start(key: str, awaitable: Awaitable[Any]) -> asyncio.Task:
+    """Run the generation for a newly claimed key as a task that outlives the request that started it."""
+    task = asyncio.create_task(_run_and_settle(key, awaitable))
+    _local_tasks[key] = task
+    task.add_done_callback(lambda t: _forget(key, t))
+    return task
+
+
+def local_task(key: str) -> Optional[asyncio.Task]:
+    return _local_tasks.get(key)
+
+
+async def wait_until_settled(key: str, timeout: float) -> Optional[KeyState]:
+    """
+    Poll the index until the key is completed or released (None), for generations running on another worker.
+    Raises asyncio.TimeoutError when it is still in progress after `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        state = await asyncio.to_thread(lookup, key)
+        if state is None or state.status != "in_progress":
+            return state
+        if time.monotonic() >= deadline:
+            raise asyncio.TimeoutError()
+        await asyncio.sleep(_POLL_INTERVAL_SECONDS)
+
+
+def snapshot() -> dict:
+    conn = shared_state.get_connection()
+    counts = dict(conn.execute("SELECT status, COUNT(*) FROM idempotency_keys WHERE expires_at >= ? "
+                               "GROUP BY status", (time.time(),)).fetchall())
+    return {
+        "in_progress": counts.get("in_progress", 0),
+        "completed": counts.get("completed", 0),
+        "local_tasks": len(_local_tasks),
+    }
@@ -1,12 +1,98 @@
 # app/llm_service.py
+import asyncio
 import httpx
 import json
 from typing import List, Dict, Optional, Any
 from fastapi import HTTPException
 
 from .config import settings
-from . import prompt_templates
-from .pydantic_models import CustomerProfile  # 仅导入 CustomerProfile，因为 GeneratedQuestion 主要在 main 中使用
+from . import prompt_sets
+from . import shared_state
+from . import diversity
+from . import token_stats
+from . import cancellation
+from . import structured_logging
+from . import structured_output
+from .scheduler import scheduler
+from .pydantic_models import CustomerProfile, GeneratedQuestion
+
+logger = structured_logging.get_logger(__name__)
+
+
+# --- 共享连接池 ---
+# 所有 LLM 调用复用同一个 AsyncClient（keep-alive + TLS 会话复用），由 main 的 lifespan 预热和关闭。
+_http_client: Optional[httpx.AsyncClient] = None
+_http_client_loop: Optional[asyncio.AbstractEventLoop] = None
+# 替换上游传输层（基准测试的录制/回放），None 表示使用 httpx 默认的网络传输
+_http_transport: Optional[httpx.AsyncBaseTransport] = None
+
+
+def set_http_transport(transport: Optional[httpx.AsyncBaseTransport]) -> None:
+    global _http_transport, _http_client
+    _http_transport = transport
+    _http_client = None  # 下次调用时用新的传输层重建客户端
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client, _http_client_loop
+    loop = asyncio.get_running_loop()
+    # AsyncClient 绑定事件循环；命令行工具等场景可能在新的事件循环中调用
+    if _http_client is None or _http_client.is_closed or _http_client_loop is not loop:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(20.0, read=120.0),
+            limits=httpx.Limits(max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+                                max_keepalive_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+                                keepalive_expiry=60.0),
+            transport=_http_transport
+        )
+        _http_client_loop = loop
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
+
+async def prewarm_connections(num_connections: int) -> int:
+    """
+    Open `num_connections` pooled connections (DNS + TCP + TLS) to the LLM endpoint ahead of the first request.
+    Any HTTP status counts as success: only the established keep-alive connection matters.
+    Returns the number of connections opened.
+    """
+    if not settings.EXTERNAL_API_URL or not settings.EXTERNAL_API_KEY or num_connections <= 0:
+        return 0
+    client = get_http_client()
+
+    async def _open_one() -> bool:
+        try:
+            await client.head(settings.EXTERNAL_API_URL)
+            return True
+        except httpx.HTTPError as e:
+            logger.warning("LLM 连接预热失败: %s", e)
+            return False
+
+    results = await asyncio.gather(*(_open_one() for _ in range(num_connections)))
+    return sum(results)
+
+
+def estimate_request_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    # 按 提示词字符数/4 + max_tokens 粗略估算一次调用的 token 数
+    return sum(len(m.get("content", "")) for m in messages) // 4 + max_tokens
+
+
+async def _acquire_upstream_budget(messages: List[Dict[str, str]], max_tokens: int) -> None:
+    """
+    在调用上游 LLM 前，从跨 worker 共享的令牌桶中申请配额（RPM / TPM）。
+    """
+    if settings.LLM_RATE_LIMIT_RPM > 0:
+        await shared_state.acquire_tokens("llm_rpm", 1, settings.LLM_RATE_LIMIT_RPM, settings.LLM_RATE_LIMIT_BURST)
+    if settings.LLM_RATE_LIMIT_TPM > 0:
+        estimated_tokens = estimate_request_tokens(messages, max_tokens)
+        await shared_state.acquire_tokens("llm_tpm", estimated_tokens, settings.LLM_RATE_LIMIT_TPM,
+                                          settings.LLM_RATE_LIMIT_TPM)
 
 
 # call_llm_api 函数保持不变 (请确保它在您的文件中是最新的)
@@ -14,12 +100,20 @@ async def call_llm_api(
         messages: List[Dict[str, str]],
         model: Optional[str] = None,
         temperature: float = 0.7,
-        max_tokens: int = 2048
+        max_tokens: int = 2048,
+        stage: Optional[str] = None,
+        num_items: int = 1,
+        response_schema: Optional[Dict[str, Any]] = None
 ) -> str:
+    """
+    `stage` / `num_items` identify the pipeline stage and how many items the call should produce; when given,
+    `max_tokens` is only the fallback and the actual budget comes from observed usage (see token_stats).
+    `response_schema` is sent as a json_schema response format when LLM_RESPONSE_FORMAT enables it.
+    """
     llm_model_to_use = model if model else settings.DEFAULT_LLM_MODEL
 
     if not settings.EXTERNAL_API_URL or not settings.EXTERNAL_API_KEY:
-        print("警告: 外部API URL或密钥未正确配置。将返回模拟数据。")
+        logger.warning("外部API URL或密钥未正确配置。将返回模拟数据。")
         # 简化模拟数据返回
         mock_question = [{"text": "Mock question: LLM not configured."}]
         if "customer profiles" in messages[-1]["content"].lower():
@@ -29,6 +123,9 @@ async def call_llm_api(
             return json.dumps(mock_question * 2)  # 返回几个模拟问题
         return json.dumps({"error": "LLM API Key not configured."})
 
+    if stage:
+        max_tokens = await token_stats.recommend_max_tokens_async(stage, llm_model_to_use, num_items, max_tokens)
+
     headers = {
         "Authorization": f"Bearer {settings.EXTERNAL_API_KEY}",
         "Content-Type": "application/json"
@@ -39,50 +136,87 @@ async def call_llm_api(
         "temperature": temperature,
         "max_tokens": max_tokens,
         "stream": False,
-        "response_format": {"type": "json_object"}
+        "response_format": structured_output.response_format(response_schema)
     }
-    timeout_settings = httpx.Timeout(20.0, read=120.0)
 
-    async with httpx.AsyncClient(timeout=timeout_settings) as client:
+    cache_key = None
+    if settings.LLM_CACHE_TTL_SECONDS > 0:
+        # max_tokens 由自适应预算调整，会随用量统计变化，不计入缓存键，否则相同请求几乎不会命中
+        cache_key = shared_state.make_cache_key("llm", {k: v for k, v in payload.items() if k != "max_tokens"})
+        cached_content = await shared_state.cache_get_async(cache_key)
+        if cached_content is not None:
+            return cached_content
+
+    # 先经调度器排队（优先级 + 按客户端公平），再申请跨 worker 的上游配额
+    # 被取消（客户端断开）时 async with 归还调度器槽位，httpx 关闭被中断的连接
+    phase = "queued"
+    try:
+        async with scheduler.slot(stage):
+            await _acquire_upstream_budget(messages, max_tokens)
+            phase = "in_flight"
+            return await _post_llm_request(payload, headers, stage, llm_model_to_use, num_items, max_tokens,
+                                           cache_key)
+    except asyncio.CancelledError:
+        cancellation.record_cancelled_call(stage, phase, estimate_request_tokens(messages, max_tokens))
+        raise
+
+
+async def _post_llm_request(payload: Dict[str, Any], headers: Dict[str, str], stage: Optional[str],
+                            llm_model_to_use: str, num_items: int, max_tokens: int, cache_key: Optional[str]) -> str:
+    client = get_http_client()
+    try:
+        logger.debug("Calling LLM %s with model %s (stage %s)", settings.EXTERNAL_API_URL, llm_model_to_use, stage)
+        response = await client.post(settings.EXTERNAL_API_URL, json=payload, headers=headers)
+        response.raise_for_status()
+        response_json = response.json()
+        if "choices" not in response_json or not response_json["choices"]:
+            raise HTTPException(status_code=500, detail="LLM response missing 'choices' field.")
+        if "message" not in response_json["choices"][0] or "content" not in response_json["choices"][0]["message"]:
+            raise HTTPException(status_code=500, detail="LLM response missing 'content' in message.")
+        content_str = response_json["choices"][0]["message"]["content"]
+        finish_reason = response_json["choices"][0].get("finish_reason")
+        if stage:
+            await token_stats.record_usage_async(
+                stage, llm_model_to_use, num_items, response_json.get("usage") or {}, finish_reason, max_tokens)
+        # 被 max_tokens 截断的响应不缓存，下次以调整后的预算重新请求
+        if cache_key and finish_reason != "length":
+            await shared_state.cache_set_async(cache_key, content_str, settings.LLM_CACHE_TTL_SECONDS)
+        return content_str
+    except httpx.HTTPStatusError as e:
+        if payload["response_format"]["type"] == "json_schema" and structured_output.is_schema_rejection(
+                e.response.status_code, e.response.text):
+            structured_output.mark_schema_unsupported(e.response.text)
+            payload = {**payload, "response_format": structured_output.response_format(None)}
+            return await _post_llm_request(payload, headers, stage, llm_model_to_use, num_items, max_tokens,
+                                           cache_key)
+        error_detail = {"error": f"LLM API HTTP Status Error: {e.response.status_code}"}
         try:
-            # print(f"Calling LLM: {settings.EXTERNAL_API_URL} with model {llm_model_to_use}")
-            # print(f"LLM Payload Messages: {json.dumps(messages, indent=2, ensure_ascii=False)}")
-            response = await client.post(settings.EXTERNAL_API_URL, json=payload, headers=headers)
-            response.raise_for_status()
-            response_json = response.json()
-            if "choices" not in response_json or not response_json["choices"]:
-                raise HTTPException(status_code=500, detail="LLM response missing 'choices' field.")
-            if "message" not in response_json["choices"][0] or "content" not in response_json["choices"][0]["message"]:
-                raise HTTPException(status_code=500, detail="LLM response missing 'content' in message.")
-            content_str = response_json["choices"][0]["message"]["content"]
-            return content_str
-        except httpx.HTTPStatusError as e:
-            error_detail = {"error": f"LLM API HTTP Status Error: {e.response.status_code}"}
-            try:
-                error_detail_msg = e.response.json();
-                if isinstance(error_detail_msg, dict):
-                    error_detail.update(error_detail_msg)
-                else:
-                    error_detail["raw_response_text"] = str(error_detail_msg)
-            except json.JSONDecodeError:
-                error_detail["raw_response_text"] = e.response.text
-            print(f"LLM API HTTPStatusError: {error_detail}")
-            raise HTTPException(status_code=e.response.status_code, detail=error_detail)
-        except httpx.RequestError as e:
-            print(f"LLM API RequestError: {str(e)}")
-            raise HTTPException(status_code=503, detail=f"Service Unavailable: {str(e)}")
-        except Exception as e:
-            print(f"Unexpected error calling LLM: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Internal Server Error while calling LLM: {str(e)}")
+            error_detail_msg = e.response.json();
+            if isinstance(error_detail_msg, dict):
+                error_detail.update(error_detail_msg)
+            else:
+                error_detail["raw_response_text"] = str(error_detail_msg)
+        except json.JSONDecodeError:
+            error_detail["raw_response_text"] = e.response.text
+        logger.error("LLM API HTTPStatusError: %s", error_detail,
+                     extra={"data": {"stage": stage, "status_code": e.response.status_code}})
+        raise HTTPException(status_code=e.response.status_code, detail=error_detail)
+    except httpx.RequestError as e:
+        logger.error("LLM API RequestError: %s", e, extra={"data": {"stage": stage}})
+        raise HTTPException(status_code=503, detail=f"Service Unavailable: {str(e)}")
+    except Exception as e:
+        logger.exception("Unexpected error calling LLM: %s", e, extra={"data": {"stage": stage}})
+        raise HTTPException(status_code=500, detail=f"Internal Server Error while calling LLM: {str(e)}")
 
 
 # generate_product_summary 和 generate_customer_profiles_from_llm 函数保持不变
 async def generate_product_summary(product_document: str) -> str:
+    prompt_templates = prompt_sets.get_templates()
     messages = [
         {"role": "system", "content": prompt_templates.PRODUCT_ANALYST_SYSTEM_PROMPT},
         {"role": "user", "content": prompt_templates.get_product_summary_user_prompt(product_document)}
     ]
-    summary_json_str = await call_llm_api(messages, max_tokens=500)
+    summary_json_str = await call_llm_api(messages, max_tokens=500, stage="summary")
     try:
         summary_data = json.loads(summary_json_str)
         raw_summary = summary_data.get("product_summary")
@@ -100,29 +234,41 @@ async def generate_product_summary(product_document: str) -> str:
         return f"Error processing product summary: {str(e)}"
 
 
+def _with_avoid_list(user_prompt: str, avoid_texts: Optional[List[str]], item_label: str) -> str:
+    """在用户提示末尾追加“避免与以下已有条目相似”的约束，用于只重新生成近似重复的条目。"""
+    if not avoid_texts:
+        return user_prompt
+    avoid_lines = "\n".join(f"- {text}" for text in avoid_texts)
+    return (f"{user_prompt}\n"
+            f"The following {item_label} already exist. Every new {item_label[:-1]} MUST be clearly different "
+            f"from all of them (different angle, wording and focus):\n{avoid_lines}\n")
+
+
 async def generate_customer_profiles_from_llm(
-        product_info_or_summary: str, num_profiles: int
-) -> List[Dict[str, Any]]:
+        product_info_or_summary: str, num_profiles: int, avoid_texts: Optional[List[str]] = None,
+        focus: Optional[str] = None, stage: str = "profiles"
+) -> List[CustomerProfile]:
+    """
+    Returns validated profiles with empty question lists (invalid items are dropped).
+    `focus` narrows the batch to one customer segment (used by large-scale generation to keep batches diverse).
+    """
+    prompt_templates = prompt_sets.get_templates()
     user_prompt = prompt_templates.get_profile_generation_user_prompt(product_info_or_summary, num_profiles)
+    if focus:
+        user_prompt += f"\nFor this batch, ALL profiles MUST focus on: {focus}.\n"
+    user_prompt = _with_avoid_list(user_prompt, avoid_texts, "profiles") + structured_output.envelope_hint("profiles")
     messages = [
         {"role": "system", "content": prompt_templates.MARKET_ANALYSIS_EXPERT_SYSTEM_PROMPT},
         {"role": "user", "content": user_prompt}
     ]
     profiles_json_str = await call_llm_api(messages, temperature=0.8,
-                                           max_tokens=num_profiles * 400)  # 估算 token，例如每个画像400 tokens
+                                           max_tokens=num_profiles * 400,  # 初始估算，例如每个画像400 tokens
+                                           stage=stage, num_items=num_profiles,
+                                           response_schema=structured_output.PROFILES_SCHEMA)
     try:
-        profiles_data = json.loads(profiles_json_str)
-        if not isinstance(profiles_data, list):
-            print(f"LLM did not return a list of profiles: {profiles_data}")
-            # 尝试从可能存在的 "profiles" 键中提取，某些模型可能会包裹一层
-            if isinstance(profiles_data, dict) and "profiles" in profiles_data and isinstance(profiles_data["profiles"],
-                                                                                              list):
-                profiles_data = profiles_data["profiles"]
-            else:
-                raise HTTPException(status_code=500, detail="AI failed to generate profiles in list format.")
-        return profiles_data
-    except json.JSONDecodeError as e:
-        print(f"Failed to parse profiles JSON: {profiles_json_str}. Error: {e}")
+        return structured_output.parse_profiles(profiles_json_str)
+    except structured_output.StructuredOutputError as e:
+        logger.warning("%s. Received: %s", e, profiles_json_str)
         raise HTTPException(status_code=500, detail="AI returned invalid JSON for customer profiles.")
 
 
@@ -130,11 +276,13 @@ async def _generate_questions_for_type(
         profile: CustomerProfile,
         product_info_or_summary: str,
         num_questions: int,
-        question_type: str  # "B2B" or "B2C"
-) -> List[Dict[str, str]]:
+        question_type: str,  # "B2B" or "B2C"
+        avoid_texts: Optional[List[str]] = None
+) -> List[GeneratedQuestion]:
     if num_questions <= 0:
         return []
 
+    prompt_templates = prompt_sets.get_templates()
     if question_type == "B2B":
         system_prompt = prompt_templates.B2B_QUESTION_GENERATION_SYSTEM_PROMPT
         user_prompt_func = prompt_templates.get_b2b_question_generation_user_prompt
@@ -151,39 +299,101 @@ async def _generate_questions_for_type(
         product_info_or_summary=product_info_or_summary,
         num_questions=num_questions
     )
+    user_prompt = _with_avoid_list(user_prompt, avoid_texts, "questions") + structured_output.envelope_hint("questions")
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
     questions_json_str = await call_llm_api(messages, temperature=0.7,
-                                            max_tokens=num_questions * 100)  # 估算，每个问题100 tokens
+                                            max_tokens=num_questions * 100,  # 初始估算，每个问题100 tokens
+                                            stage=f"questions_{question_type.lower()}", num_items=num_questions,
+                                            response_schema=structured_output.QUESTIONS_SCHEMA)
     try:
-        questions_data = json.loads(questions_json_str)
-        if not isinstance(questions_data, list):
-            print(
-                f"LLM did not return a list of {question_type} questions for profile {profile.name}: {questions_data}")
-            return []
-
-        valid_questions: List[Dict[str, str]] = []
-        for q_data in questions_data:
-            if isinstance(q_data, dict) and "text" in q_data and isinstance(q_data["text"], str):
-                valid_questions.append({"text": q_data["text"]})
-            else:
-                print(f"Skipping invalid {question_type} question data for profile {profile.name}: {q_data}")
-        return valid_questions
-    except json.JSONDecodeError as e:
-        print(
-            f"Failed to parse {question_type} questions JSON for profile {profile.name}: {questions_json_str}. Error: {e}")
+        return structured_output.parse_questions(questions_json_str)[:num_questions]
+    except structured_output.StructuredOutputError as e:
+        logger.warning("%s (%s, profile %s). Received: %s", e, question_type, profile.name, questions_json_str)
         return []
 
 
 async def generate_b2b_questions_for_profile(
-        profile: CustomerProfile, product_info_or_summary: str, num_questions: int
-) -> List[Dict[str, str]]:
-    return await _generate_questions_for_type(profile, product_info_or_summary, num_questions, "B2B")
+        profile: CustomerProfile, product_info_or_summary: str, num_questions: int,
+        avoid_texts: Optional[List[str]] = None
+) -> List[GeneratedQuestion]:
+    return await _generate_questions_for_type(profile, product_info_or_summary, num_questions, "B2B", avoid_texts)
 
 
 async def generate_b2c_questions_for_profile(
-        profile: CustomerProfile, product_info_or_summary: str, num_questions: int
-) -> List[Dict[str, str]]:
-    return await _generate_questions_for_type(profile, product_info_or_summary, num_questions, "B2C")
\ No newline at end of file
+        profile: CustomerProfile, product_info_or_summary: str, num_questions: int,
+        avoid_texts: Optional[List[str]] = None
+) -> List[GeneratedQuestion]:
+    return await _generate_questions_for_type(profile, product_info_or_summary, num_questions, "B2C", avoid_texts)
+
+
+# --- 近似重复检测后的定向重新生成 ---
+
+def profile_similarity_text(profile: CustomerProfile) -> str:
+    return " ".join(filter(None, [profile.name, profile.occupation, profile.country_region,
+                                  profile.cognitive_level, profile.description]))
+
+
+async def regenerate_near_duplicate_questions(
+        profiles: List[CustomerProfile], product_info_or_summary: str
+) -> Dict[str, int]:
+    """
+    Flag near-duplicate questions across all profiles and both B2B/B2C lists, then re-request only the
+    flagged questions for the affected (profile, type) pairs, replacing them in place.
+    Returns {"flagged": ..., "regenerated": ..., "remaining": ..., "total": ...}.
+    """
+    threshold = settings.DEDUP_SIMILARITY_THRESHOLD
+
+    def question_items():
+        for p_idx, p in enumerate(profiles):
+            for q_type, questions in (("B2B", p.b2b_questions), ("B2C", p.b2c_questions)):
+                for q_idx, q in enumerate(questions):
+                    yield (p_idx, q_type, q_idx), q.text
+
+    def build_index() -> diversity.NearDuplicateIndex:
+        index = diversity.NearDuplicateIndex(threshold)
+        for key, text in question_items():
+            if key not in flagged:
+                index.add(key, text)
+        return index
+
+    def place(index: diversity.NearDuplicateIndex, p_idx: int, q_type: str, q_indices: List[int],
+              new_questions: List[GeneratedQuestion]) -> List[tuple]:
+        # 依次为每个被标记的位置取第一个不重复的新问题
+        placed = []
+        for q_idx in sorted(q_indices):
+            while new_questions:
+                question = new_questions.pop(0)
+                if index.check_and_add((p_idx, q_type, q_idx), question.text) is None:
+                    placed.append((q_idx, question))
+                    break
+        return placed
+
+    # MinHash 签名与 LSH 查找是纯 CPU 计算，放到工作线程中执行，不阻塞其他请求
+    flagged = await asyncio.to_thread(diversity.find_near_duplicates, list(question_items()), threshold)
+    total = sum(len(p.b2b_questions) + len(p.b2c_questions) for p in profiles)
+    report = {"flagged": len(flagged), "regenerated": 0, "remaining": len(flagged), "total": total}
+
+    for _ in range(settings.DEDUP_MAX_ROUNDS):
+        if not flagged:
+            break
+        index = await asyncio.to_thread(build_index)
+
+        by_target: Dict[tuple, List[int]] = {}
+        for p_idx, q_type, q_idx in flagged:
+            by_target.setdefault((p_idx, q_type), []).append(q_idx)
+
+        for (p_idx, q_type), q_indices in by_target.items():
+            profile = profiles[p_idx]
+            questions = profile.b2b_questions if q_type == "B2B" else profile.b2c_questions
+            avoid = [q.text for q in questions]
+            new_questions = await _generate_questions_for_type(
+                profile, product_info_or_summary, len(q_indices), q_type, avoid)
+            for q_idx, question in await asyncio.to_thread(place, index, p_idx, q_type, q_indices, new_questions):
+                questions[q_idx] = question
+                del flagged[(p_idx, q_type, q_idx)]
+                report["regenerated"] += 1
+    report["remaining"] = len(flagged)
+    return report
\ No newline at end of file
@@ -1,170 +1,414 @@
 # app/main.py
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from . import startup  # 最先导入，记录进程导入阶段的起始时间
+from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-import json
+import asyncio
+import contextlib
+import hashlib
 import pathlib
 import datetime  # For timestamped directory and filenames
 import uuid  # For unique session ID
-from typing import List, Any
+from typing import Dict, List, Optional
 
 # 使用相对导入
 from .pydantic_models import (
     ProductInfoRequest,
     AiCustomerDataResponse,
     CustomerProfile,
-    GeneratedQuestion
+    GeneratedQuestion,
+    RegenerateQuestionsRequest,
+    ScaleGenerationRequest
 )
 from . import llm_service
+from . import generation
+from . import scale_generation
+from . import session_store
+from . import static_assets
+from . import token_stats
+from .admission import admission, AdmissionRejected, estimate_generation_cost
+from . import cancellation
+from . import idempotency
+from . import prompt_sets
+from . import structured_logging
+from . import structured_output
+from .scheduler import scheduler, current_client_id
+from .pipeline import PipelineError
+from .session_store import save_json_data
 from .config import settings
 
-app = FastAPI(title=settings.PROJECT_NAME)
+logger = structured_logging.get_logger(__name__)
+
+async def _session_compaction_loop(store: session_store.SegmentSessionStore):
+    while True:
+        await asyncio.sleep(settings.SESSION_COMPACTION_INTERVAL_SECONDS)
+        try:
+            report = await asyncio.to_thread(store.compact)
+            if report["segments_compacted"]:
+                logger.info("会话段文件压缩完成: %s", report)
+        except Exception as e:
+            logger.exception("会话段文件压缩失败: %s", e)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    structured_logging.configure()  # 每个 worker 各自启动日志写出线程
+    # 预热在后台进行，服务立即开始监听；预热完成前 /readyz 返回 503
+    background_tasks = [asyncio.create_task(startup.warm_up(templates, pages=(homepage,)))]
+    store = session_store.get_store()
+    if isinstance(store, session_store.SegmentSessionStore) and settings.SESSION_COMPACTION_INTERVAL_SECONDS > 0:
+        background_tasks.append(asyncio.create_task(_session_compaction_loop(store)))
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await llm_service.close_http_client()
+    structured_logging.shutdown()
+
+
+app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
 
 PROJECT_ROOT_DIR = pathlib.Path(__file__).resolve().parent.parent
-DATA_BASE_DIR = PROJECT_ROOT_DIR / "data"  # Base directory for all session data
-DATA_BASE_DIR.mkdir(parents=True, exist_ok=True)  # 创建基础 data 目录
 
-app.mount("/static", StaticFiles(directory=PROJECT_ROOT_DIR / "static"), name="static")
+# 预压缩变体与缓存头见 app/static_assets.py；先执行 python -m app.static_assets build 才有带哈希的文件
+app.mount("/static", static_assets.PrecompressedStaticFiles(directory=PROJECT_ROOT_DIR / "static"), name="static")
 templates = Jinja2Templates(directory=PROJECT_ROOT_DIR / "templates")
+templates.env.globals["asset_url"] = static_assets.asset_url
+homepage = static_assets.HomepageCache(templates, "ai_customer_generator.html")
 
 
-def save_json_data(data_to_save: Any, filename: str, session_id: str, session_date_str: str):
+def _client_id(request: Request) -> str:
     """
-    Helper function to save data to a JSON file within a session-specific directory.
-    The directory will be named <session_date_str>_<session_id>.
-    The file will be named <filename> inside this directory.
+    调度器使用的客户端标识：优先 X-Client-Id 头；其次 API key（X-API-Key 或 Authorization）的哈希；
+    最后退回客户端 IP。LLM_CLIENT_WEIGHTS 中按该标识配置权重。
     """
-    session_dir_name = f"{session_date_str}_{session_id}"
-    session_path = DATA_BASE_DIR / session_dir_name
-    session_path.mkdir(parents=True, exist_ok=True)  # Create session-specific directory
+    explicit = request.headers.get("x-client-id")
+    if explicit:
+        return explicit[:64]
+    api_key = request.headers.get("x-api-key") or request.headers.get("authorization")
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+async def _admitted_generation(job: generation.GenerationJob, resume: bool = False) -> AiCustomerDataResponse:
+    cost = estimate_generation_cost(job.request.num_customer_profiles, job.request.num_questions_per_profile)
+    # 在排队等待准入之前标记会话运行中，排队期间的重复恢复请求同样返回 409
+    async with generation.running_session(job.session_id), admission.admit(cost):
+        run_generation = generation.resume_generation if resume else generation.run_generation
+        response_data_obj, _ = await run_generation(job)
+    return response_data_obj
 
-    filepath = session_path / filename  # e.g., data/20230509_abcdef12/input_product_info.json
 
+async def _handle_generation_errors(job: generation.GenerationJob, awaitable):
+    """把生成过程中的准入拒绝、客户端断开与阶段失败映射为 HTTP 响应；断开或失败时保存已完成的部分。"""
     try:
-        # 如果 data_to_save 是 Pydantic 模型实例，先用 .model_dump_json()
-        if hasattr(data_to_save, 'model_dump_json') and callable(data_to_save.model_dump_json):
-            json_str = data_to_save.model_dump_json(indent=4, exclude_none=True)  # exclude_none for cleaner JSON
-            with open(filepath, "w", encoding="utf-8") as f:
-                f.write(json_str)
-        elif hasattr(data_to_save, 'dict') and callable(
-                data_to_save.dict):  # Fallback for Pydantic v1 or other dict-like
-            dict_data = data_to_save.dict(exclude_none=True)
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(dict_data, f, ensure_ascii=False, indent=4)
-        else:  # 假设已经是字典或列表了
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(data_to_save, f, ensure_ascii=False, indent=4)
-        print(f"数据已保存到: {filepath}")
-    except Exception as e:
-        print(f"保存数据到 {filepath} 时出错: {e}")
+        return await awaitable
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except cancellation.ClientDisconnected:
+        partial_saved = settings.PERSIST_PARTIAL_ON_DISCONNECT and job.run is not None
+        if partial_saved:
+            # 以 status: "cancelled" 保存，可通过 GET /v1/sessions/{id} 读取或恢复，但不会被 /v1/export 导出
+            await generation.save_partial_output(job)
+        cancellation.record_cancelled_request(partial_saved)
+        logger.info("客户端已断开，生成已取消%s", "，部分结果已保存" if partial_saved else "")
+        return JSONResponse(status_code=499, content={"detail": "Client disconnected.", "session_id": job.session_id})
+    except PipelineError as e:
+        if job.run is not None and job.persist:
+            # 已完成的阶段已写入检查点，可通过 POST /v1/sessions/{session_id}/resume 继续
+            await generation.save_partial_output(job, status="failed")
+        if isinstance(e.error, HTTPException):
+            raise e.error
+        logger.error("生成流水线阶段 %s 出错: %s", e.stage, e.error)
+        raise HTTPException(status_code=500, detail=f"Generation failed at stage '{e.stage}': {e.error}")
 
 
-@app.post("/v1/generate_ai_customer_data", response_model=AiCustomerDataResponse)
-async def generate_ai_customer_data_endpoint(request_data: ProductInfoRequest):
-    product_document = request_data.product_document
-    num_profiles_req = request_data.num_customer_profiles
-    num_total_questions_per_profile = request_data.num_questions_per_profile
+def _replayed(response_data_obj: AiCustomerDataResponse) -> JSONResponse:
+    return JSONResponse(content=response_data_obj.model_dump(mode="json"), headers={"Idempotent-Replayed": "true"})
+
+
+async def _idempotent_generation(request: Request, job: generation.GenerationJob, key: str):
+    """
+    带 Idempotency-Key 的生成：新键启动一个不随客户端断开而取消的生成任务；重复的键返回已保存的结果，
+    或等待进行中的生成（本 worker 内直接等待任务，其他 worker 上的则轮询键索引）。
+    """
+    request_fingerprint = idempotency.fingerprint(job.request)
+    while True:
+        state = await asyncio.to_thread(idempotency.claim, key, request_fingerprint, job.session_id,
+                                        job.session_date_str)
+        if state.status == "new":
+            task = idempotency.start(key, _admitted_generation(job))
+        else:
+            structured_logging.current_session_id.set(state.session_id)
+            task = idempotency.local_task(key) if state.status == "in_progress" else None
+        try:
+            if task is not None:
+                # shield：客户端断开只停止等待，生成继续，重试时可取回结果
+                response_data_obj = await cancellation.run_unless_disconnected(request, asyncio.shield(task))
+                return response_data_obj if state.status == "new" else _replayed(response_data_obj)
+            if state.status == "in_progress":
+                state = await cancellation.run_unless_disconnected(
+                    request, idempotency.wait_until_settled(key, settings.IDEMPOTENCY_WAIT_TIMEOUT_SECONDS))
+                if state is None:
+                    continue  # 原请求的生成失败，键已释放：重新认领
+        except cancellation.ClientDisconnected:
+            logger.info("客户端已断开，带幂等键的生成继续进行")
+            return JSONResponse(status_code=499, content={"detail": "Client disconnected.",
+                                                          "session_id": state.session_id})
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress.",
+                                headers={"Retry-After": str(settings.ADMISSION_DEFAULT_RETRY_AFTER)})
+        output_data = await asyncio.to_thread(session_store.load_json_data, state.session_id,
+                                              session_store.OUTPUT_FILENAME, state.session_date)
+        if output_data is None:
+            # 会话已被删除：释放键，重新生成
+            await asyncio.to_thread(idempotency.release, key)
+            continue
+        return _replayed(generation.response_from_output(output_data))
+
 
+@app.post("/v1/generate_ai_customer_data", response_model=AiCustomerDataResponse)
+async def generate_ai_customer_data_endpoint(request_data: ProductInfoRequest, request: Request):
+    client_id = _client_id(request)
+    current_client_id.set(client_id)
+    prompt_sets.current_template_set.set(request_data.template_set)
     # 为本次生成创建一个唯一的会话ID和日期字符串
     session_id = uuid.uuid4().hex[:8]  # Shorter UUID for directory name
     session_date_str = datetime.date.today().strftime("%Y%m%d")  # Current date as YYYYMMDD
+    structured_logging.current_session_id.set(session_id)
 
-    # 1. 保存输入的产品信息
-    input_data_to_save = {
-        "session_id": session_id,
-        "generation_date": session_date_str,
-        "product_document": product_document,
-        "requested_profiles": num_profiles_req,
-        "requested_questions_total_per_profile": num_total_questions_per_profile
-    }
-    save_json_data(input_data_to_save,
-                   filename="input_product_info.json",  # Fixed filename within session dir
-                   session_id=session_id,
-                   session_date_str=session_date_str)
-
-    # 2. 生成产品摘要
-    product_summary = await llm_service.generate_product_summary(product_document)
-    info_for_llm = product_summary if product_summary and "malformed" not in product_summary.lower() and "error" not in product_summary.lower() else product_document
-
-    # 3. 生成客户画像 (原始字典列表)
-    raw_profiles_data = await llm_service.generate_customer_profiles_from_llm(
-        info_for_llm,
-        num_profiles_req
-    )
+    job = generation.GenerationJob(request=request_data, session_id=session_id, session_date_str=session_date_str)
+    idempotency_key = request.headers.get("idempotency-key")
+    try:
+        if idempotency_key:
+            return await _handle_generation_errors(
+                job, _idempotent_generation(request, job, idempotency.scoped_key(client_id, idempotency_key)))
+        # 客户端断开时取消流水线，剩余的 LLM 调用不再发出
+        return await _handle_generation_errors(
+            job, cancellation.run_unless_disconnected(request, _admitted_generation(job)))
+    except idempotency.IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
-    # 4. 为每个画像生成两组问题并构建完整的CustomerProfile对象列表
-    customer_profiles_list: List[CustomerProfile] = []
 
-    num_b2b_questions = num_total_questions_per_profile // 2
-    num_b2c_questions = num_total_questions_per_profile - num_b2b_questions
-    if num_total_questions_per_profile == 1 and num_total_questions_per_profile > 0:  # Ensure at least one question type gets one if total is 1
-        num_b2b_questions = 0  # Or your preferred logic for a single question
-        num_b2c_questions = 1
+@app.post("/v1/generate_ai_customer_data/scale", status_code=202)
+async def generate_ai_customer_data_scale_endpoint(request_data: ScaleGenerationRequest, request: Request):
+    """
+    大规模生成：立即返回会话 ID，画像在后台按批次生成并逐个追加到会话的 generated_profiles.jsonl。
+    通过 GET /v1/scale_jobs/{session_id} 查询进度，完成后可用 /v1/export 导出。
+    """
+    # 后台任务继承当前上下文中的客户端标识、模板集与会话 ID
+    current_client_id.set(_client_id(request))
+    prompt_sets.current_template_set.set(request_data.template_set)
+    session_id = uuid.uuid4().hex[:8]
+    session_date_str = datetime.date.today().strftime("%Y%m%d")
+    structured_logging.current_session_id.set(session_id)
+    try:
+        scale_generation.start_scale_job(request_data, session_id, session_date_str)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    # status_url 带上会话日期，其他 worker 查询时直接读取 data/<日期>_<会话 ID>/，不扫描数据目录
+    return {"session_id": session_id, "status": "running",
+            "status_url": f"/v1/scale_jobs/{session_id}?date={session_date_str}"}
+
+
+@app.get("/v1/scale_jobs/{session_id}")
+async def scale_job_status_endpoint(session_id: str, date: Optional[str] = Query(None, pattern=r"^\d{8}$")):
+    status = await asyncio.to_thread(scale_generation.job_status, session_id, date)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Scale job '{session_id}' not found.")
+    return status
+
+
+# 同一 worker 内对同一会话文件的读-改-写串行化；条目为 [锁, 持有或等待的请求数]，无人使用时删除
+_session_locks: Dict[str, list] = {}
+
+
+@contextlib.asynccontextmanager
+async def _session_lock(session_id: str):
+    entry = _session_locks.setdefault(session_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _session_locks[session_id]
 
-    for profile_dict in raw_profiles_data[:num_profiles_req]:
-        if not isinstance(profile_dict, dict):
-            print(f"Skipping invalid raw profile data: {profile_dict}")
-            continue
 
-        current_profile_obj = CustomerProfile(
-            name=profile_dict.get("name", "Unnamed Profile"),
-            description=profile_dict.get("description", "No description provided."),
-            country_region=profile_dict.get("country_region"),
-            occupation=profile_dict.get("occupation"),
-            cognitive_level=profile_dict.get("cognitive_level"),
-            main_concerns=profile_dict.get("main_concerns", []),
-            potential_needs=profile_dict.get("potential_needs"),
-            cultural_background_summary=profile_dict.get("cultural_background_summary"),
-            b2b_questions=[],
-            b2c_questions=[]
-        )
-
-        if num_b2b_questions > 0:
-            raw_b2b_q_data = await llm_service.generate_b2b_questions_for_profile(
-                profile=current_profile_obj,
-                product_info_or_summary=info_for_llm,
-                num_questions=num_b2b_questions
-            )
-            for q_dict in raw_b2b_q_data[:num_b2b_questions]:
-                if isinstance(q_dict, dict) and "text" in q_dict:
-                    current_profile_obj.b2b_questions.append(GeneratedQuestion(text=q_dict["text"]))
-
-        if num_b2c_questions > 0:
-            raw_b2c_q_data = await llm_service.generate_b2c_questions_for_profile(
-                profile=current_profile_obj,
-                product_info_or_summary=info_for_llm,
-                num_questions=num_b2c_questions
-            )
-            for q_dict in raw_b2c_q_data[:num_b2c_questions]:
-                if isinstance(q_dict, dict) and "text" in q_dict:
-                    current_profile_obj.b2c_questions.append(GeneratedQuestion(text=q_dict["text"]))
-
-        customer_profiles_list.append(current_profile_obj)
-
-    response_data_obj = AiCustomerDataResponse(
-        product_summary=product_summary,
-        customer_profiles=customer_profiles_list
+@app.get("/v1/sessions/{session_id}")
+async def get_session_endpoint(session_id: str):
+    """读取已保存会话的生成结果（包括客户端断开或生成失败后保存的部分结果，status 为 cancelled / failed）。"""
+    output_data = await asyncio.to_thread(session_store.load_json_data, session_id, session_store.OUTPUT_FILENAME)
+    if output_data is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found.")
+    return output_data
+
+
+@app.post("/v1/sessions/{session_id}/resume", response_model=AiCustomerDataResponse)
+async def resume_session_endpoint(session_id: str, request: Request):
+    """
+    继续失败或被取消的生成：已完成的阶段（摘要、画像、问题）从会话的 stage_checkpoints.jsonl 读取，
+    从第一个未完成的阶段开始运行，不再为已成功的调用付费。已完成的会话直接返回保存的结果。
+    """
+    input_data = await asyncio.to_thread(session_store.load_json_data, session_id, session_store.INPUT_FILENAME)
+    if input_data is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found.")
+    if input_data.get("mode") == "scale":
+        raise HTTPException(status_code=400, detail="Large-scale generation sessions cannot be resumed.")
+    output_data = await asyncio.to_thread(session_store.load_json_data, session_id, session_store.OUTPUT_FILENAME)
+    if output_data is not None and output_data.get("status") is None:
+        return generation.response_from_output(output_data)
+
+    stored_template_set = input_data.get("template_set")
+    request_data = ProductInfoRequest(
+        product_document=input_data["product_document"],
+        num_customer_profiles=input_data["requested_profiles"],
+        num_questions_per_profile=input_data["requested_questions_total_per_profile"],
+        reuse="off",
+        template_set=stored_template_set if stored_template_set in prompt_sets.TEMPLATE_SETS else None
     )
+    current_client_id.set(_client_id(request))
+    prompt_sets.current_template_set.set(request_data.template_set)
+    structured_logging.current_session_id.set(session_id)
+    job = generation.GenerationJob(request=request_data, session_id=session_id,
+                                   session_date_str=input_data["generation_date"])
+    try:
+        return await _handle_generation_errors(
+            job, cancellation.run_unless_disconnected(request, _admitted_generation(job, resume=True)))
+    except generation.SessionAlreadyRunning as e:
+        # 原生成或另一个恢复请求仍在运行（可能在其他 worker 上）
+        raise HTTPException(status_code=409, detail=str(e),
+                            headers={"Retry-After": str(settings.ADMISSION_DEFAULT_RETRY_AFTER)})
+
+
+@app.post("/v1/sessions/{session_id}/profiles/{profile_id}/regenerate", response_model=CustomerProfile)
+async def regenerate_profile_questions_endpoint(session_id: str, profile_id: str,
+                                                request_data: RegenerateQuestionsRequest, request: Request):
+    """
+    只为已保存会话中的某一个画像重新生成 B2B 和/或 B2C 问题（1~2 次 LLM 调用），
+    并原子地更新 generated_customer_data.json。
+    """
+    current_client_id.set(_client_id(request))
+    structured_logging.current_session_id.set(session_id)
+    input_data = await asyncio.to_thread(session_store.load_json_data, session_id, session_store.INPUT_FILENAME)
+    output_data = await asyncio.to_thread(session_store.load_json_data, session_id, session_store.OUTPUT_FILENAME,
+                                          input_data.get("generation_date") if input_data else None)
+    if input_data is None or output_data is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found.")
+
+    stored_profile = next((p for p in output_data.get("customer_profiles_generated", [])
+                           if p.get("id") == profile_id), None)
+    if stored_profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found in session '{session_id}'.")
+    profile = CustomerProfile.model_validate(stored_profile)
+    # 沿用会话生成时的模板集（旧会话没有记录时使用 PROMPT_TEMPLATE_SET）
+    if input_data.get("template_set") in prompt_sets.TEMPLATE_SETS:
+        prompt_sets.current_template_set.set(input_data["template_set"])
+
+    info_for_llm = generation.info_for_llm(output_data.get("product_summary_generated"),
+                                           input_data.get("product_document", ""))
+    default_b2b, default_b2c = generation.split_question_counts(
+        input_data.get("requested_questions_total_per_profile", 6))
+
+    async def regenerate(question_type: str) -> List[GeneratedQuestion]:
+        current = profile.b2b_questions if question_type == "B2B" else profile.b2c_questions
+        num_questions = request_data.num_questions or len(current) or (
+            default_b2b if question_type == "B2B" else default_b2c)
+        generate = (llm_service.generate_b2b_questions_for_profile if question_type == "B2B"
+                    else llm_service.generate_b2c_questions_for_profile)
+        return await generate(profile=profile, product_info_or_summary=info_for_llm,
+                              num_questions=num_questions, avoid_texts=[q.text for q in current])
+
+    question_types = list(dict.fromkeys(request_data.question_types))
+    try:
+        async with admission.admit(len(question_types)):
+            results = await asyncio.gather(*(regenerate(t) for t in question_types))
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    for question_type, questions in zip(question_types, results):
+        if question_type == "B2B":
+            profile.b2b_questions = questions
+        else:
+            profile.b2c_questions = questions
 
-    # 5. 保存生成的画像和问题数据
-    output_data_to_save = {
-        "session_id": session_id,
-        "generation_date": session_date_str,
-        "product_summary_generated": response_data_obj.product_summary,
-        "customer_profiles_generated": [profile.model_dump(exclude_none=True) for profile in
-                                        response_data_obj.customer_profiles]  # Convert Pydantic to dicts
+    async with _session_lock(session_id):
+        # LLM 调用期间文件可能已被其他请求更新（或会话已被删除），写入前重新读取
+        output_data = await asyncio.to_thread(session_store.load_json_data, session_id,
+                                              session_store.OUTPUT_FILENAME, input_data.get("generation_date"))
+        if output_data is None:
+            raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found.")
+        profiles = output_data.get("customer_profiles_generated", [])
+        for i, p in enumerate(profiles):
+            if p.get("id") == profile_id:
+                profiles[i] = profile.model_dump(exclude_none=True)
+        try:
+            await asyncio.to_thread(save_json_data, output_data, session_store.OUTPUT_FILENAME, session_id,
+                                    output_data.get("generation_date", input_data.get("generation_date")),
+                                    raise_errors=True)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to save regenerated questions: {e}")
+
+    return profile
+
+
+@app.get("/v1/export")
+async def export_sessions_endpoint(
+        export_format: str = Query("ndjson", alias="format", description="ndjson or csv"),
+        gzip: bool = Query(False, description="Compress the stream with gzip on the fly."),
+        date_from: str | None = Query(None, description="Inclusive start date, YYYYMMDD or YYYY-MM-DD."),
+        date_to: str | None = Query(None, description="Inclusive end date, YYYYMMDD or YYYY-MM-DD."),
+        product: str | None = Query(None, description="Case-insensitive substring of the product document/summary.")
+):
+    """
+    流式导出所有已保存会话：每个问题一行，附带画像与产品字段。
+    逐个会话读取，内存占用恒定，适合多 GB 的归档。
+    """
+    from . import export  # 非核心路径，按需导入以缩短 worker 启动时间
+
+    try:
+        chunks = export.export_stream(export_format, gzip, date_from, date_to, product)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filename = f"customer_questions_{datetime.date.today().strftime('%Y%m%d')}.{export_format}"
+    media_type = "application/x-ndjson" if export_format == "ndjson" else "text/csv; charset=utf-8"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(chunks, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@app.get("/v1/metrics")
+async def metrics_endpoint():
+    """运行指标（各 worker 共享的统计来自共享状态库）。"""
+    return {
+        "token_budgets": await asyncio.to_thread(token_stats.snapshot),
+        "llm_scheduler": scheduler.snapshot(),
+        "admission": admission.snapshot(),
+        "cancellation": cancellation.snapshot(),
+        "idempotency": await asyncio.to_thread(idempotency.snapshot),
+        "structured_output": structured_output.snapshot(),
+        "logging": structured_logging.snapshot(),
     }
-    save_json_data(output_data_to_save,
-                   filename="generated_customer_data.json",  # Fixed filename
-                   session_id=session_id,
-                   session_date_str=session_date_str)
 
-    return response_data_obj
+
+@app.get("/healthz")
+async def liveness_endpoint():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readiness_endpoint():
+    """启动预热完成后才返回 200，负载均衡器据此决定是否向该 worker 转发流量。"""
+    return JSONResponse(status_code=200 if startup.startup_report["ready"] else 503,
+                        content=startup.startup_report)
 
 
 @app.get("/", response_class=HTMLResponse)
 async def serve_homepage(request: Request):
-    return templates.TemplateResponse("ai_customer_generator.html", {"request": request})
+    # 首页不依赖请求内容，渲染结果缓存在内存中（模板或资源清单变化时重新渲染）
+    return homepage.response(request)
 
 # if __name__ == "__main__": ... (remains the same, usually in run.py now)
\ No newline at end of file
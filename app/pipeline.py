@@ -0,0 +1,172 @@
+# app/pipeline.py
+# 依赖驱动的小型流水线引擎：
+#   - 每个 Stage 声明依赖（deps），依赖全部完成后立即启动，互不依赖的阶段并发执行
+#   - 运行中的阶段可以动态添加新阶段（例如每校验完一个画像就添加它的问题生成阶段）
+#   - 可选推测执行：speculative 在流水线启动时就开始运行（不等依赖），依赖完成后由
+#     accept_speculative 决定采用推测结果还是取消它并正常执行 func；推测执行失败时自动退回 func
+#   - 记录每个阶段的开始/结束时间与耗时
+import asyncio
+import dataclasses
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+StageFunc = Callable[["PipelineRun"], Awaitable[Any]]
+
+
+@dataclasses.dataclass
+class Stage:
+    name: str
+    func: StageFunc
+    deps: Tuple[str, ...] = ()
+    speculative: Optional[StageFunc] = None
+    accept_speculative: Optional[Callable[["PipelineRun"], bool]] = None
+
+
+@dataclasses.dataclass
+class StageTiming:
+    started_ms: float
+    finished_ms: Optional[float] = None
+    duration_ms: Optional[float] = None
+    speculative: Optional[str] = None  # "used" / "discarded" / "failed"
+    status: str = "running"  # running / done / failed / cancelled / preresolved
+
+
+class PipelineError(Exception):
+    def __init__(self, stage: str, error: BaseException):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class PipelineRun:
+    """Execution state of one pipeline run; passed to every stage function."""
+
+    def __init__(self, stages: List[Stage], preresolved: Optional[Dict[str, Any]] = None,
+                 on_stage_complete: Optional[Callable[[str, Any], Awaitable[None]]] = None,
+                 enable_speculation: bool = True):
+        self._stages: Dict[str, Stage] = {}
+        self._order: List[str] = []
+        self.results: Dict[str, Any] = dict(preresolved or {})
+        self.timings: Dict[str, StageTiming] = {}
+        self.on_stage_complete = on_stage_complete
+        self.enable_speculation = enable_speculation
+        self._started_at = time.perf_counter()
+        self._changed = asyncio.Event()
+        self._speculative_tasks: Dict[str, asyncio.Task] = {}
+        for name in self.results:
+            self.timings[name] = StageTiming(started_ms=0.0, finished_ms=0.0, duration_ms=0.0, status="preresolved")
+        for stage in stages:
+            self.add_stage(stage)
+
+    def _now_ms(self) -> float:
+        return round((time.perf_counter() - self._started_at) * 1000, 1)
+
+    def add_stage(self, stage: Stage) -> None:
+        """Register a stage; allowed while the pipeline is running (dynamic fan-out)."""
+        if stage.name in self._stages:
+            raise ValueError(f"Duplicate pipeline stage '{stage.name}'.")
+        self._stages[stage.name] = stage
+        self._order.append(stage.name)
+        self._changed.set()
+
+    def has_stage(self, name: str) -> bool:
+        return name in self._stages or name in self.results
+
+    def stage_timings_ms(self) -> Dict[str, Optional[float]]:
+        return {name: timing.duration_ms for name, timing in self.timings.items()}
+
+    async def _run_stage(self, stage: Stage) -> Any:
+        spec_task = self._speculative_tasks.pop(stage.name, None)
+        if spec_task is not None:
+            accept = stage.accept_speculative(self) if stage.accept_speculative else True
+            if accept:
+                try:
+                    result = await spec_task
+                    self.timings[stage.name].speculative = "used"
+                    return result
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self.timings[stage.name].speculative = "failed"
+            else:
+                spec_task.cancel()
+                self.timings[stage.name].speculative = "discarded"
+        return await stage.func(self)
+
+    def _start_speculation(self) -> None:
+        if not self.enable_speculation:
+            return
+        for name in self._order:
+            stage = self._stages[name]
+            if stage.speculative is not None and name not in self.results and name not in self._speculative_tasks:
+                self._speculative_tasks[name] = asyncio.create_task(stage.speculative(self))
+
+    async def _cancel_all(self, tasks) -> None:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        if tasks:
+            # 同时取走已结束任务的异常，避免 "Task exception was never retrieved"
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def execute(self) -> "PipelineRun":
+        started: Dict[str, asyncio.Task] = {}
+        running: Dict[asyncio.Task, str] = {}
+        changed_waiter: Optional[asyncio.Task] = None
+        self._start_speculation()
+        try:
+            while True:
+                self._changed.clear()
+                for name in self._order:
+                    if name in started or name in self.results:
+                        continue
+                    stage = self._stages[name]
+                    if all(dep in self.results for dep in stage.deps):
+                        self.timings[name] = StageTiming(started_ms=self._now_ms())
+                        task = asyncio.create_task(self._run_stage(stage))
+                        started[name] = task
+                        running[task] = name
+
+                if not running:
+                    unresolved = [n for n in self._order if n not in self.results]
+                    if unresolved:
+                        raise RuntimeError(f"Pipeline stages with unresolvable dependencies: {unresolved}")
+                    return self
+
+                changed_waiter = asyncio.create_task(self._changed.wait())
+                done, _ = await asyncio.wait([*running, changed_waiter], return_when=asyncio.FIRST_COMPLETED)
+                if changed_waiter not in done:
+                    changed_waiter.cancel()
+
+                for task in done:
+                    if task is changed_waiter:
+                        continue
+                    name = running.pop(task)
+                    timing = self.timings[name]
+                    timing.finished_ms = self._now_ms()
+                    timing.duration_ms = round(timing.finished_ms - timing.started_ms, 1)
+                    if task.cancelled():
+                        timing.status = "cancelled"
+                        raise asyncio.CancelledError()
+                    error = task.exception()
+                    if error is not None:
+                        timing.status = "failed"
+                        raise PipelineError(name, error) from error
+                    timing.status = "done"
+                    self.results[name] = task.result()
+                    if self.on_stage_complete is not None:
+                        await self.on_stage_complete(name, self.results[name])
+        except BaseException:
+            # 任一阶段失败或整个流水线被取消：取消所有在途阶段与推测任务
+            if changed_waiter is not None:
+                changed_waiter.cancel()
+            for task, name in running.items():
+                self.timings[name].status = "cancelled"
+            await self._cancel_all(list(running) + list(self._speculative_tasks.values()))
+            raise
+
+
+async def run_pipeline(stages: List[Stage], preresolved: Optional[Dict[str, Any]] = None,
+                       on_stage_complete: Optional[Callable[[str, Any], Awaitable[None]]] = None,
+                       enable_speculation: bool = True) -> PipelineRun:
+    return await PipelineRun(stages, preresolved, on_stage_complete, enable_speculation).execute()
@@ -0,0 +1,146 @@
+# app/product_index.py
+# 产品文档近似重复索引：产品经理常常只改一个错别字或价格就重新提交，精确哈希缓存无法命中。
+# 对规范化后的 product_document 取词级 shingle 计算 MinHash 签名，按 LSH 分桶保存在共享状态库中
+# （所有 worker 共用，重启后保留）。新请求先按分桶找候选会话，再用原文的精确 Jaccard 相似度确认，
+# 超过阈值即可复用该会话的摘要/画像/问题（复用策略见 app/generation.py）。
+# 索引同时记录会话日期，确认候选时直接读取 data/<日期>_<会话 ID>/，不扫描数据目录。
+#
+# 命令行（在项目根目录）：python -m app.product_index rebuild   # 从已保存的会话重建索引
+import argparse
+import dataclasses
+import hashlib
+import json
+import struct
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from . import diversity
+from . import session_store
+from . import shared_state
+
+SHINGLE_SIZE = 3  # 词级 3-gram：改一个词只影响附近 3 个 shingle
+NUM_PERM = 64
+BANDS = 16  # 每段 4 行；相似度约 0.5 以上的文档大概率落入同一桶
+
+_hasher: Optional[diversity.MinHasher] = None
+
+
+@dataclasses.dataclass
+class ReuseCandidate:
+    session_id: str
+    similarity: float
+    input_data: Dict[str, Any]
+    output_data: Dict[str, Any]
+
+
+def _get_hasher() -> diversity.MinHasher:
+    global _hasher
+    if _hasher is None:
+        _hasher = diversity.MinHasher(NUM_PERM)
+    return _hasher
+
+
+def document_shingles(product_document: str) -> Set[str]:
+    return diversity.shingles(product_document, SHINGLE_SIZE, unit="word")
+
+
+def _band_hashes(signature: List[int]) -> List[str]:
+    rows = NUM_PERM // BANDS
+    return [hashlib.blake2b(struct.pack(f"<{rows}I", *signature[band * rows:(band + 1) * rows]),
+                            digest_size=8).hexdigest()
+            for band in range(BANDS)]
+
+
+def is_reusable(output_data: Optional[Dict[str, Any]]) -> bool:
+    # 只复用完整生成的普通会话（不含被取消的部分结果和大规模生成任务）
+    return bool(output_data) and output_data.get("status") is None and output_data.get("mode") is None \
+        and bool(output_data.get("customer_profiles_generated"))
+
+
+def add_document(session_id: str, session_date: str, product_document: str) -> None:
+    signature = _get_hasher().signature(document_shingles(product_document))
+    conn = shared_state.get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("INSERT OR REPLACE INTO product_signatures (session_id, session_date, signature, created_at) "
+                     "VALUES (?, ?, ?, ?)", (session_id, session_date, json.dumps(signature), time.time()))
+        conn.execute("DELETE FROM product_bands WHERE session_id = ?", (session_id,))
+        conn.executemany("INSERT INTO product_bands (band, band_hash, session_id) VALUES (?, ?, ?)",
+                         [(band, band_hash, session_id) for band, band_hash in enumerate(_band_hashes(signature))])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def remove_document(session_id: str) -> None:
+    conn = shared_state.get_connection()
+    conn.execute("DELETE FROM product_bands WHERE session_id = ?", (session_id,))
+    conn.execute("DELETE FROM product_signatures WHERE session_id = ?", (session_id,))
+
+
+def _candidates(signature: List[int]) -> List[Tuple[str, Optional[str], float]]:
+    conn = shared_state.get_connection()
+    session_ids = set()
+    for band, band_hash in enumerate(_band_hashes(signature)):
+        session_ids.update(row[0] for row in conn.execute(
+            "SELECT session_id FROM product_bands WHERE band = ? AND band_hash = ?", (band, band_hash)))
+    scored = []
+    for session_id in session_ids:
+        row = conn.execute("SELECT session_date, signature FROM product_signatures WHERE session_id = ?",
+                           (session_id,)).fetchone()
+        if row is not None:
+            scored.append((session_id, row[0], diversity.estimate_similarity(signature, json.loads(row[1]))))
+    # 估算相似度最高的优先用原文确认
+    return sorted(scored, key=lambda item: item[2], reverse=True)
+
+
+def find_similar(product_document: str, threshold: float, max_verify: int = 5) -> Optional[ReuseCandidate]:
+    """
+    Return the stored session whose product document is most similar to `product_document` (exact Jaccard over
+    word shingles, at or above `threshold`), or None. Sessions that no longer exist are dropped from the index.
+    """
+    doc_shingles = document_shingles(product_document)
+    if not doc_shingles:
+        return None
+    signature = _get_hasher().signature(doc_shingles)
+    best: Optional[ReuseCandidate] = None
+    for session_id, session_date, _ in _candidates(signature)[:max_verify]:
+        # 旧版本建立的索引没有日期（None），退回按会话 ID 查找
+        input_data = session_store.load_json_data(session_id, session_store.INPUT_FILENAME, session_date)
+        output_data = session_store.load_json_data(session_id, session_store.OUTPUT_FILENAME, session_date)
+        if input_data is None or not is_reusable(output_data):
+            if input_data is None or output_data is None:
+                remove_document(session_id)
+            continue
+        similarity = diversity.jaccard(doc_shingles, document_shingles(input_data.get("product_document", "")))
+        if similarity >= threshold and (best is None or similarity > best.similarity):
+            best = ReuseCandidate(session_id, round(similarity, 4), input_data, output_data)
+    return best
+
+
+def rebuild() -> Dict[str, int]:
+    conn = shared_state.get_connection()
+    conn.execute("DELETE FROM product_bands")
+    conn.execute("DELETE FROM product_signatures")
+    report = {"indexed": 0, "skipped": 0}
+    for session_id, session_date in session_store.iter_sessions():
+        input_data = session_store.load_json_data(session_id, session_store.INPUT_FILENAME, session_date)
+        output_data = session_store.load_json_data(session_id, session_store.OUTPUT_FILENAME, session_date)
+        if input_data is None or not is_reusable(output_data):
+            report["skipped"] += 1
+            continue
+        add_document(session_id, session_date, input_data.get("product_document", ""))
+        report["indexed"] += 1
+    return report
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Near-duplicate product document index.")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args(argv)
+    print(rebuild())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# app/prompt_sets.py
+# 提示词模板集：prompt_templates*.py 四个模块接口相同，可通过 PROMPT_TEMPLATE_SET 配置或按请求（template_set 字段）选择。
+# 当前请求的模板集保存在 contextvar 中（与 scheduler.current_client_id 相同），流水线创建的子任务会继承它。
+# 各模板集的 token 用量、延迟与解析成功率可用 python -m app.benchmark 比较。
+import contextvars
+import importlib
+from types import ModuleType
+from typing import Dict, Optional
+
+from .config import settings
+
+TEMPLATE_SETS: Dict[str, str] = {
+    "default": "prompt_templates",
+    "strict": "prompt_templates_strict",
+    "strict_simple": "prompt_templates_strict_simple",
+    "old": "prompt_templates_old",
+}
+
+current_template_set: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "current_template_set", default=None)
+
+_modules: Dict[str, ModuleType] = {}
+
+
+def resolve(name: Optional[str] = None) -> str:
+    """Template set name to use: explicit `name`, else the current request's, else PROMPT_TEMPLATE_SET."""
+    name = name or current_template_set.get() or settings.PROMPT_TEMPLATE_SET
+    if name not in TEMPLATE_SETS:
+        raise ValueError(f"Unknown prompt template set '{name}'. Available: {', '.join(TEMPLATE_SETS)}")
+    return name
+
+
+def get_templates(name: Optional[str] = None) -> ModuleType:
+    resolved = resolve(name)
+    module = _modules.get(resolved)
+    if module is None:
+        module = _modules[resolved] = importlib.import_module(f"{__package__}.{TEMPLATE_SETS[resolved]}")
+    return module
@@ -1,18 +1,56 @@
 # app/pydantic_models.py
 import uuid
-from pydantic import BaseModel, Field
-from typing import List, Optional, Any
+from pydantic import BaseModel, Field, ValidationInfo, model_validator
+from typing import Dict, List, Optional, Any, Literal
+
+from .prompt_sets import TEMPLATE_SETS
+
+# 校验 LLM 输出时传入的 context；此时忽略由服务端分配的字段（id、问题列表），避免模型自带的值造成重复 id
+LLM_OUTPUT_CONTEXT = {"llm_output": True}
+
+
+def _is_llm_output(info: ValidationInfo) -> bool:
+    return bool(info.context and info.context.get("llm_output"))
+
+# 可选的提示词模板集名称，由 app/prompt_sets.py 的 TEMPLATE_SETS 生成，新增模板集时无需修改请求模型
+TemplateSetName = Literal[tuple(TEMPLATE_SETS)]  # type: ignore[valid-type]
 
 class ProductInfoRequest(BaseModel):
     product_document: str
     num_customer_profiles: int = Field(default=3, ge=1, le=10) # 默认生成3个画像
     # 每个画像的总问题数，后端会尝试均分给B2B和B2C
     num_questions_per_profile: int = Field(default=6, ge=2, le=10) # 总问题数，确保是偶数方便均分或稍作调整
+    # 与已保存会话的产品文档近似重复时的复用方式，不指定时使用 PRODUCT_REUSE_MODE
+    reuse: Optional[Literal["off", "offer", "questions", "full"]] = None
+    # 提示词模板集（见 app/prompt_sets.py），不指定时使用 PROMPT_TEMPLATE_SET
+    template_set: Optional[TemplateSetName] = None
+
+class ScaleGenerationRequest(BaseModel):
+    # 大规模生成模式：画像按批次生成并追加写入会话文件，适合构建评测数据集
+    product_document: str
+    num_customer_profiles: int = Field(default=100, ge=1, le=500)
+    num_questions_per_profile: int = Field(default=6, ge=2, le=10)
+    # 每次 LLM 调用生成的画像数
+    batch_size: int = Field(default=10, ge=1, le=10)
+    template_set: Optional[TemplateSetName] = None
+
+class RegenerateQuestionsRequest(BaseModel):
+    # 需要重新生成的问题类型，默认 B2B 和 B2C 都重新生成
+    question_types: List[Literal["B2B", "B2C"]] = Field(default=["B2B", "B2C"], min_length=1)
+    # 每种类型的问题数；不指定时沿用该画像当前的问题数
+    num_questions: Optional[int] = Field(default=None, ge=1, le=10)
 
 class GeneratedQuestion(BaseModel):
     id: str = Field(default_factory=lambda: f"q-{uuid.uuid4().hex[:8]}")
     text: str
 
+    @model_validator(mode="before")
+    @classmethod
+    def _from_llm_output(cls, data: Any, info: ValidationInfo) -> Any:
+        if _is_llm_output(info) and isinstance(data, dict):
+            return {"text": data.get("text")}
+        return data
+
 class CustomerProfile(BaseModel):
     id: str = Field(default_factory=lambda: f"profile-{uuid.uuid4().hex[:8]}")
     name: str
@@ -26,6 +64,46 @@ class CustomerProfile(BaseModel):
     b2b_questions: List[GeneratedQuestion] = [] # 面向B端的问题
     b2c_questions: List[GeneratedQuestion] = [] # 面向C端的问题
 
+    @model_validator(mode="before")
+    @classmethod
+    def _from_llm_output(cls, data: Any, info: ValidationInfo) -> Any:
+        if _is_llm_output(info) and isinstance(data, dict):
+            data = {k: v for k, v in data.items() if k not in LLM_ASSIGNED_PROFILE_FIELDS}
+            data.setdefault("name", "Unnamed Profile")
+            data.setdefault("description", "No description provided.")
+            data.setdefault("main_concerns", [])
+        return data
+
+# 由服务端分配/稍后填充的画像字段，不出现在发给 LLM 的 JSON Schema 中
+LLM_ASSIGNED_PROFILE_FIELDS = ("id", "b2b_questions", "b2c_questions")
+
+class CustomerProfileList(BaseModel):
+    # json_schema 结构化输出要求根为对象，画像列表包在 profiles 键中
+    profiles: List[CustomerProfile]
+
+class GeneratedQuestionList(BaseModel):
+    questions: List[GeneratedQuestion]
+
+class DiversityReport(BaseModel):
+    # 1.0 表示所有条目互不相似；按 (总数 - 仍存在的近似重复数) / 总数 计算
+    score: float
+    profile_score: float
+    question_score: float
+    duplicates_flagged: int = 0 # 检测到的近似重复条目数
+    duplicates_regenerated: int = 0 # 已被重新生成替换的条目数
+
+class ReuseReport(BaseModel):
+    mode: str # 本次请求的复用方式 (off / offer / questions / full)
+    applied: Literal["none", "summary", "profiles", "all"] = "none" # 实际复用到哪一步
+    source_session_id: Optional[str] = None # 相似的已保存会话
+    similarity: Optional[float] = None # 产品文档相似度
+    reused_profiles: int = 0
+    reused_questions: int = 0
+    llm_calls_saved: int = 0
+
 class AiCustomerDataResponse(BaseModel):
     product_summary: Optional[str] = None
-    customer_profiles: List[CustomerProfile]
\ No newline at end of file
+    customer_profiles: List[CustomerProfile]
+    diversity: Optional[DiversityReport] = None
+    stage_timings_ms: Optional[Dict[str, Optional[float]]] = None # 各流水线阶段耗时（毫秒）
+    reuse: Optional[ReuseReport] = None
\ No newline at end of file
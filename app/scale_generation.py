@@ -0,0 +1,254 @@
+# app/scale_generation.py
+# 大规模生成模式：为单个产品生成数百个画像（用于构建评测数据集）。
+#   - 画像按批次并发生成，每批用不同的“地区 × 客户类型 × 认知水平”切片作为种子，保持多样性
+#   - 跨批次用 MinHash-LSH 去重（只保留签名，不保留全文）
+#   - 每个画像生成问题后立即追加写入会话的 generated_profiles.jsonl，内存中不保留结果
+#   - 并发批次数受 SCALE_MAX_CONCURRENT_BATCHES 限制，LLM 调用同样经过全局调度器与共享配额
+#   - 摘要与每个批次都经过与在线请求相同的准入控制（app/admission.py），后台任务不会绕过在途成本上限；
+#     被拒绝时按 Retry-After 等待后重试。每个 worker 同时运行的任务数受 SCALE_MAX_CONCURRENT_JOBS 限制
+# 任务在后台运行；进度写入会话的 generated_customer_data.json（status: running/completed/failed），
+# 任一 worker 都可以通过 GET /v1/scale_jobs/{session_id} 查询。
+import asyncio
+import contextlib
+import dataclasses
+import itertools
+import time
+from typing import Any, Dict, List, Optional
+
+from .config import settings
+from . import diversity
+from . import llm_service
+from . import prompt_sets
+from . import session_store
+from . import structured_logging
+from .admission import admission, AdmissionRejected
+from .generation import info_for_llm, split_question_counts
+from .pydantic_models import CustomerProfile, GeneratedQuestion, ScaleGenerationRequest
+from .session_store import save_json_data
+
+logger = structured_logging.get_logger(__name__)
+
+PROFILES_FILENAME = "generated_profiles.jsonl"
+
+SEED_REGIONS = [
+    "Germany", "United States", "Brazil", "India", "Japan", "Nigeria", "United Arab Emirates", "United Kingdom",
+    "Mexico", "Southeast Asia (Vietnam, Thailand, Indonesia)", "Australia", "Poland", "South Korea", "Turkey",
+    "Canada", "France", "Saudi Arabia", "South Africa", "Chile", "Italy",
+]
+SEED_SEGMENTS = [
+    "importers and wholesale distributors", "retail chain buyers", "e-commerce and marketplace sellers",
+    "small business owners", "end consumers buying for personal use", "project contractors and system integrators",
+    "OEM manufacturers sourcing components", "government or institutional procurement officers",
+]
+SEED_COGNITIVE_LEVELS = ["Novice", "Intermediate", "Expert"]
+
+
+def batch_focus(batch_index: int) -> str:
+    """Deterministic segment slice for a batch: regions vary fastest, then segments, then cognitive levels."""
+    region = SEED_REGIONS[batch_index % len(SEED_REGIONS)]
+    segment = SEED_SEGMENTS[(batch_index // len(SEED_REGIONS)) % len(SEED_SEGMENTS)]
+    level = SEED_COGNITIVE_LEVELS[(batch_index // (len(SEED_REGIONS) * len(SEED_SEGMENTS))) % len(SEED_COGNITIVE_LEVELS)]
+    return (f"{segment} from {region}; vary the cognitive level around '{level}' "
+            f"and make each profile's occupation and concerns different")
+
+
+@dataclasses.dataclass
+class ScaleJob:
+    request: ScaleGenerationRequest
+    session_id: str
+    session_date_str: str
+    status: str = "running"
+    product_summary: Optional[str] = None
+    profiles_generated: int = 0
+    questions_generated: int = 0
+    duplicates_skipped: int = 0
+    batches_started: int = 0
+    batches_failed: int = 0
+    profiles_failed: int = 0  # 问题生成或写入失败、名额交还给后续批次的画像数
+    started_at: float = dataclasses.field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    # 最近接受的画像名称，作为后续批次的“避免相似”提示（只保留少量）
+    recent_names: List[str] = dataclasses.field(default_factory=list)
+
+    def manifest(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "generation_date": self.session_date_str,
+            "mode": "scale",
+            "status": self.status,
+            "product_summary_generated": self.product_summary,
+            "customer_profiles_file": PROFILES_FILENAME,
+            "requested_profiles": self.request.num_customer_profiles,
+            "profiles_generated": self.profiles_generated,
+            "questions_generated": self.questions_generated,
+            "duplicates_skipped": self.duplicates_skipped,
+            "batches_started": self.batches_started,
+            "batches_failed": self.batches_failed,
+            "profiles_failed": self.profiles_failed,
+            "diversity_score": diversity.diversity_score(self.profiles_generated + self.duplicates_skipped,
+                                                         self.duplicates_skipped),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+# 本 worker 中运行的任务，用于快速查询进度；其他 worker 的任务从会话文件读取
+running_jobs: Dict[str, ScaleJob] = {}
+
+
+async def _save_manifest(job: ScaleJob) -> None:
+    await asyncio.to_thread(save_json_data, job.manifest(), session_store.OUTPUT_FILENAME,
+                            job.session_id, job.session_date_str)
+
+
+@contextlib.asynccontextmanager
+async def _admitted(cost: int):
+    # 后台任务没有等待中的客户端：准入被拒绝（队列已满或排队超时）时等待后重试，而不是让批次失败
+    while True:
+        try:
+            await admission.acquire(cost)
+            break
+        except AdmissionRejected as e:
+            await asyncio.sleep(e.retry_after)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        admission.release(cost, duration=time.perf_counter() - started)
+
+
+async def _generate_questions(profile: CustomerProfile, context: str, num_b2b: int, num_b2c: int) -> None:
+    async def one(question_type: str, num_questions: int) -> List[GeneratedQuestion]:
+        if num_questions <= 0:
+            return []
+        generate = (llm_service.generate_b2b_questions_for_profile if question_type == "B2B"
+                    else llm_service.generate_b2c_questions_for_profile)
+        return await generate(profile=profile, product_info_or_summary=context, num_questions=num_questions)
+
+    profile.b2b_questions, profile.b2c_questions = await asyncio.gather(one("B2B", num_b2b), one("B2C", num_b2c))
+
+
+async def run_scale_job(job: ScaleJob) -> None:
+    request = job.request
+    target = request.num_customer_profiles
+    num_b2b, num_b2c = split_question_counts(request.num_questions_per_profile)
+    batch_size = request.batch_size
+    question_types = (num_b2b > 0) + (num_b2c > 0)
+    # 去重会丢弃部分画像，允许额外的批次补足数量
+    max_batches = -(-target // batch_size) + max(1, int(-(-target // batch_size) * settings.SCALE_EXTRA_BATCH_RATIO))
+    index = diversity.NearDuplicateIndex(settings.DEDUP_SIMILARITY_THRESHOLD, keep_shingles=False)
+    batch_counter = itertools.count()
+    reserved = 0  # 已分配给在途批次、尚未写入的画像名额；profiles_generated + reserved 不超过 target
+    write_lock = asyncio.Lock()
+
+    try:
+        await asyncio.to_thread(save_json_data, {
+            "session_id": job.session_id,
+            "generation_date": job.session_date_str,
+            "product_document": request.product_document,
+            "requested_profiles": target,
+            "requested_questions_total_per_profile": request.num_questions_per_profile,
+            "mode": "scale",
+            "batch_size": batch_size,
+            "template_set": prompt_sets.resolve(request.template_set),
+        }, session_store.INPUT_FILENAME, job.session_id, job.session_date_str)
+
+        async with _admitted(1):
+            job.product_summary = await llm_service.generate_product_summary(request.product_document)
+        context = info_for_llm(job.product_summary, request.product_document)
+        await _save_manifest(job)
+
+        async def process_profile(profile: CustomerProfile) -> None:
+            # 每个画像单独处理失败：名额交还，由后续批次补足；只有写入成功后才计入 profiles_generated
+            nonlocal reserved
+            try:
+                await _generate_questions(profile, context, num_b2b, num_b2c)
+                async with write_lock:
+                    await asyncio.to_thread(session_store.append_json_record, profile.model_dump(exclude_none=True),
+                                            PROFILES_FILENAME, job.session_id, job.session_date_str)
+                    job.profiles_generated += 1
+                    job.questions_generated += len(profile.b2b_questions) + len(profile.b2c_questions)
+            except Exception as e:
+                job.profiles_failed += 1
+                logger.warning("大规模生成会话 %s 的画像 %s 生成问题失败: %s", job.session_id, profile.id, e)
+            finally:
+                reserved -= 1
+
+        async def worker() -> None:
+            nonlocal reserved
+            while True:
+                batch_index = next(batch_counter)
+                remaining = target - job.profiles_generated - reserved
+                if remaining <= 0 or batch_index >= max_batches:
+                    return
+                count = min(batch_size, remaining)
+                reserved += count
+                job.batches_started += 1
+                accepted: List[CustomerProfile] = []
+                try:
+                    # 批次成本：一次画像调用 + 每个画像每种问题类型一次调用
+                    async with _admitted(1 + count * question_types):
+                        batch_profiles = await llm_service.generate_customer_profiles_from_llm(
+                            context, count, avoid_texts=job.recent_names[-10:] or None,
+                            focus=batch_focus(batch_index), stage="scale_profiles")
+                        for profile in batch_profiles[:count]:
+                            key = f"{batch_index}:{len(accepted)}"
+                            if settings.DEDUP_ENABLED and index.check_and_add(
+                                    key, llm_service.profile_similarity_text(profile)) is not None:
+                                job.duplicates_skipped += 1
+                                continue
+                            accepted.append(profile)
+                        job.recent_names.extend(p.name for p in accepted)
+                        del job.recent_names[:-20]
+                        # 被去重丢弃的名额立即交还；通过去重的画像各自保留一个名额，直到写入成功或失败
+                        reserved -= count - len(accepted)
+                        count = 0
+                        await asyncio.gather(*(process_profile(p) for p in accepted))
+                except Exception as e:
+                    job.batches_failed += 1
+                    reserved -= count
+                    logger.warning("大规模生成会话 %s 第 %s 批失败: %s", job.session_id, batch_index, e)
+                await _save_manifest(job)
+
+        await asyncio.gather(*(worker() for _ in range(settings.SCALE_MAX_CONCURRENT_BATCHES)))
+        job.status = "completed"
+    except asyncio.CancelledError:
+        job.status = "cancelled"
+        raise
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+        logger.exception("大规模生成会话 %s 失败: %s", job.session_id, e)
+    finally:
+        job.finished_at = time.time()
+        await _save_manifest(job)
+        running_jobs.pop(job.session_id, None)
+
+
+# 持有后台任务的强引用，防止被垃圾回收
+_background_tasks: set = set()
+
+
+def start_scale_job(request: ScaleGenerationRequest, session_id: str, session_date_str: str) -> ScaleJob:
+    """Start a scale job in the background; raises AdmissionRejected when this worker already runs the maximum."""
+    if len(running_jobs) >= settings.SCALE_MAX_CONCURRENT_JOBS:
+        raise AdmissionRejected("scale_jobs", settings.ADMISSION_MAX_RETRY_AFTER)
+    job = ScaleJob(request=request, session_id=session_id, session_date_str=session_date_str)
+    running_jobs[session_id] = job
+    task = asyncio.create_task(run_scale_job(job))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return job
+
+
+def job_status(session_id: str, session_date_str: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Progress of a scale job; pass the session date (from the status URL) to read the manifest directly."""
+    job = running_jobs.get(session_id)
+    if job is not None:
+        return job.manifest()
+    manifest = session_store.load_json_data(session_id, session_store.OUTPUT_FILENAME, session_date_str)
+    if manifest is None or manifest.get("mode") != "scale":
+        return None
+    return manifest
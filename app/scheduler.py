@@ -0,0 +1,163 @@
+# app/scheduler.py
+# 上游 LLM 调用的全局调度器（每个 worker 一个实例）：
+#   - 全局并发上限 LLM_MAX_CONCURRENCY，每个客户端并发上限 LLM_PER_CLIENT_CONCURRENCY
+#   - 优先级：关键路径（摘要、画像）优先于扇出的问题生成调用
+#   - 同一优先级内按客户端做加权公平排队（WFQ，虚拟完成时间最小者先出队）
+#   - 记录排队等待时间，供 /v1/metrics 输出
+# 客户端标识通过 contextvar 传递（由 main 在请求入口设置），无需逐层传参。
+import asyncio
+import collections
+import contextlib
+import contextvars
+import itertools
+import time
+from typing import Deque, Dict, List, Optional
+
+from .config import settings
+
+current_client_id: contextvars.ContextVar[str] = contextvars.ContextVar("llm_client_id", default="anonymous")
+
+PRIORITY_CRITICAL = 0
+PRIORITY_FANOUT = 1
+
+# 未列出的阶段按扇出调用处理
+STAGE_PRIORITIES: Dict[str, int] = {
+    "summary": PRIORITY_CRITICAL,
+    "profiles": PRIORITY_CRITICAL,
+}
+
+
+def parse_client_weights(raw: str) -> Dict[str, float]:
+    """Parse "client-a:2,client-b:0.5" into {"client-a": 2.0, "client-b": 0.5}."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in raw.split(","))):
+        client, _, weight = item.rpartition(":")
+        if client and weight:
+            weights[client] = float(weight)
+    return weights
+
+
+class _Waiter:
+    __slots__ = ("client", "priority", "tag", "seq", "future", "enqueued_at")
+
+    def __init__(self, client: str, priority: int, tag: float, seq: int, future: asyncio.Future):
+        self.client = client
+        self.priority = priority
+        self.tag = tag
+        self.seq = seq
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class LLMCallScheduler:
+    def __init__(self, max_concurrency: int, per_client_limit: int, weights: Optional[Dict[str, float]] = None,
+                 default_weight: float = 1.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_client_limit = max(1, per_client_limit)
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self._running = 0
+        self._running_by_client: Dict[str, int] = collections.defaultdict(int)
+        self._waiting: List[_Waiter] = []
+        self._virtual_time = 0.0
+        self._last_finish_tag: Dict[str, float] = {}
+        self._seq = itertools.count()
+        # 最近的排队等待时间（秒），按优先级分别记录
+        self._recent_waits: Dict[int, Deque[float]] = collections.defaultdict(lambda: collections.deque(maxlen=1000))
+        self._total_waits: Dict[int, float] = collections.defaultdict(float)
+        self._total_calls: Dict[int, int] = collections.defaultdict(int)
+
+    def _weight(self, client: str) -> float:
+        return self.weights.get(client, self.default_weight)
+
+    def _can_run(self, client: str) -> bool:
+        return self._running < self.max_concurrency and self._running_by_client.get(client, 0) < self.per_client_limit
+
+    def _grant(self, client: str) -> None:
+        self._running += 1
+        self._running_by_client[client] += 1
+
+    def _dispatch(self) -> None:
+        # 已被取消（任务取消时其 future 随之取消）但尚未自行出队的等待者直接丢弃，不能再分配槽位
+        self._waiting = [w for w in self._waiting if not w.future.done()]
+        while self._running < self.max_concurrency and self._waiting:
+            eligible = [w for w in self._waiting if self._running_by_client.get(w.client, 0) < self.per_client_limit]
+            if not eligible:
+                return
+            waiter = min(eligible, key=lambda w: (w.priority, w.tag, w.seq))
+            self._waiting.remove(waiter)
+            self._virtual_time = max(self._virtual_time, waiter.tag)
+            self._grant(waiter.client)
+            waiter.future.set_result(None)
+
+    def _record_wait(self, priority: int, waited: float) -> None:
+        self._recent_waits[priority].append(waited)
+        self._total_waits[priority] += waited
+        self._total_calls[priority] += 1
+
+    async def acquire(self, client: str, priority: int) -> float:
+        """Wait for a slot; returns the time spent queued (seconds)."""
+        # 公平排队标签：客户端上一次的虚拟完成时间与全局虚拟时间取大，再加上 1/权重
+        tag = max(self._virtual_time, self._last_finish_tag.get(client, 0.0)) + 1.0 / self._weight(client)
+        self._last_finish_tag[client] = tag
+
+        if not self._waiting and self._can_run(client):
+            self._grant(client)
+            self._record_wait(priority, 0.0)
+            return 0.0
+
+        waiter = _Waiter(client, priority, tag, next(self._seq), asyncio.get_running_loop().create_future())
+        self._waiting.append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(client)  # 已分配到槽位但调用方被取消，归还槽位
+            elif waiter in self._waiting:
+                self._waiting.remove(waiter)
+            raise
+        waited = time.perf_counter() - waiter.enqueued_at
+        self._record_wait(priority, waited)
+        return waited
+
+    def release(self, client: str) -> None:
+        self._running -= 1
+        self._running_by_client[client] -= 1
+        if self._running_by_client[client] <= 0:
+            del self._running_by_client[client]
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, stage: Optional[str]):
+        client = current_client_id.get()
+        priority = STAGE_PRIORITIES.get(stage, PRIORITY_FANOUT)
+        await self.acquire(client, priority)
+        try:
+            yield
+        finally:
+            self.release(client)
+
+    def snapshot(self) -> dict:
+        queue_wait = {}
+        for priority, name in ((PRIORITY_CRITICAL, "critical"), (PRIORITY_FANOUT, "fanout")):
+            recent = sorted(self._recent_waits[priority])
+            calls = self._total_calls[priority]
+            queue_wait[name] = {
+                "calls": calls,
+                "avg_ms": round(self._total_waits[priority] / calls * 1000, 1) if calls else 0.0,
+                "p95_ms": round(recent[int(0.95 * (len(recent) - 1))] * 1000, 1) if recent else 0.0,
+                "max_recent_ms": round(recent[-1] * 1000, 1) if recent else 0.0,
+            }
+        return {
+            "running": self._running,
+            "queued": len(self._waiting),
+            "running_by_client": dict(self._running_by_client),
+            "max_concurrency": self.max_concurrency,
+            "per_client_limit": self.per_client_limit,
+            "queue_wait": queue_wait,
+        }
+
+
+scheduler = LLMCallScheduler(settings.LLM_MAX_CONCURRENCY, settings.LLM_PER_CLIENT_CONCURRENCY,
+                             parse_client_weights(settings.LLM_CLIENT_WEIGHTS))
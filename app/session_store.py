@@ -0,0 +1,552 @@
+# app/session_store.py
+# 会话数据的持久化，后端由 SESSION_STORE_BACKEND 选择：
+#   - "directory"（默认）：data/<YYYYMMDD>_<session_id>/<filename>.json，每个会话一个目录
+#   - "segment"：追加写入的压缩 JSONL 段文件 + SQLite 偏移索引，按 session_id 随机读取，
+#     支持段文件轮转与后台压缩（清理被覆盖的旧记录），避免海量小文件/目录
+#
+# 迁移工具（在项目根目录）:
+#   python -m app.session_store migrate [--delete-source]
+import argparse
+import gzip
+import json
+import os
+import pathlib
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Iterator, Optional, Tuple
+
+from .config import PROJECT_ROOT_DIR, settings
+from . import structured_logging
+
+logger = structured_logging.get_logger(__name__)
+
+DATA_BASE_DIR = PROJECT_ROOT_DIR / "data"  # Base directory for all session data
+DATA_BASE_DIR.mkdir(parents=True, exist_ok=True)  # 创建基础 data 目录
+
+SESSION_ID_RE = re.compile(r"^[0-9a-f]{8,32}$")
+SESSION_DIR_RE = re.compile(r"^(\d{8})_([0-9a-f]{8,32})$")
+
+INPUT_FILENAME = "input_product_info.json"
+OUTPUT_FILENAME = "generated_customer_data.json"
+
+
+def _to_jsonable(data_to_save: Any) -> Any:
+    # 如果 data_to_save 是 Pydantic 模型实例，先转换为字典
+    if hasattr(data_to_save, 'model_dump') and callable(data_to_save.model_dump):
+        return data_to_save.model_dump(mode="json", exclude_none=True)  # exclude_none for cleaner JSON
+    if hasattr(data_to_save, 'dict') and callable(data_to_save.dict):  # Fallback for Pydantic v1 or other dict-like
+        return data_to_save.dict(exclude_none=True)
+    return data_to_save  # 假设已经是字典或列表了
+
+
+def write_json_atomic(filepath: pathlib.Path, data: Any) -> None:
+    """
+    Write JSON to a temporary file in the same directory, then os.replace() it over the target,
+    so readers never observe a half-written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=filepath.parent, prefix=f".{filepath.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class DirectorySessionStore:
+    """One directory per session, one pretty-printed JSON file per document."""
+
+    name = "directory"
+
+    def __init__(self, base_dir: pathlib.Path = DATA_BASE_DIR):
+        self.base_dir = base_dir
+
+    def session_dir(self, session_id: str, session_date_str: str) -> pathlib.Path:
+        return self.base_dir / f"{session_date_str}_{session_id}"
+
+    def find_session_dir(self, session_id: str) -> Optional[pathlib.Path]:
+        """Locate data/<date>_<session_id>/ for a session id; returns None if unknown or malformed."""
+        if not SESSION_ID_RE.match(session_id):
+            return None
+        for path in sorted(self.base_dir.glob(f"*_{session_id}")):
+            if path.is_dir() and SESSION_DIR_RE.match(path.name):
+                return path
+        return None
+
+    def _locate(self, session_id: str, session_date_str: Optional[str]) -> Optional[pathlib.Path]:
+        # 已知日期（例如来自 iter_sessions）时直接拼出目录，不扫描整个 data 目录
+        if session_date_str is None:
+            return self.find_session_dir(session_id)
+        if not SESSION_ID_RE.match(session_id):
+            return None
+        session_path = self.session_dir(session_id, session_date_str)
+        return session_path if session_path.is_dir() else None
+
+    def save(self, data: Any, filename: str, session_id: str, session_date_str: str) -> str:
+        session_path = self.session_dir(session_id, session_date_str)
+        session_path.mkdir(parents=True, exist_ok=True)  # Create session-specific directory
+        filepath = session_path / filename  # e.g., data/20230509_abcdef12/input_product_info.json
+        write_json_atomic(filepath, data)
+        return str(filepath)
+
+    def load(self, session_id: str, filename: str, session_date_str: Optional[str] = None) -> Optional[Any]:
+        session_path = self._locate(session_id, session_date_str)
+        if session_path is None or not (session_path / filename).is_file():
+            return None
+        with open(session_path / filename, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def iter_sessions(self, date_from: Optional[str] = None, date_to: Optional[str] = None
+                      ) -> Iterator[Tuple[str, str]]:
+        # os.scandir 逐项读取，不会一次性把整个 data 目录列入内存
+        with os.scandir(self.base_dir) as entries:
+            for entry in entries:
+                match = SESSION_DIR_RE.match(entry.name)
+                if not match or not entry.is_dir():
+                    continue
+                date_str, session_id = match.groups()
+                if date_from and date_str < date_from:
+                    continue
+                if date_to and date_str > date_to:
+                    continue
+                yield session_id, date_str
+
+    def iter_files(self, session_id: str, session_date_str: Optional[str] = None) -> Iterator[str]:
+        session_path = self._locate(session_id, session_date_str)
+        if session_path is None:
+            return
+        for path in sorted([*session_path.glob("*.json"), *session_path.glob("*.jsonl")]):
+            yield path.name
+
+    def append(self, record: Any, filename: str, session_id: str, session_date_str: str) -> None:
+        session_path = self.session_dir(session_id, session_date_str)
+        session_path.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with _append_lock, open(session_path / filename, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def iter_records(self, session_id: str, filename: str, session_date_str: Optional[str] = None) -> Iterator[Any]:
+        session_path = self._locate(session_id, session_date_str)
+        if session_path is None or not (session_path / filename).is_file():
+            return
+        with open(session_path / filename, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+# 同一进程内多个线程追加同一个 JSONL 文件时串行化
+_append_lock = threading.Lock()
+
+
+# --- 段文件存储 ---
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _import_zstandard(purpose: str):
+    try:
+        import zstandard  # 可选依赖：pip install zstandard
+    except ImportError:
+        raise RuntimeError(f"zstandard is not installed but is required to {purpose}; "
+                           f"install it with: pip install zstandard") from None
+    return zstandard
+
+
+class _Codec:
+    """Per-record compression. Each record is an independent gzip member / zstd frame, so a
+    segment file is still a valid .jsonl.gz / .jsonl.zst stream and any record can be read by offset.
+    Records are decoded by their magic bytes, not the configured codec, so segments written before
+    SESSION_SEGMENT_COMPRESSION changed stay readable."""
+
+    def __init__(self, compression: str):
+        self.name = compression
+        self._zstd_d = None
+        if compression == "zstd":
+            # 配置了 zstd 却未安装时直接报错，而不是悄悄改写 gzip 段文件
+            self._zstd_c = _import_zstandard("write SESSION_SEGMENT_COMPRESSION=zstd segments").ZstdCompressor(level=3)
+        elif compression != "gzip":
+            raise ValueError(f"Unsupported SESSION_SEGMENT_COMPRESSION '{compression}', expected gzip or zstd.")
+        self.suffix = ".jsonl.zst" if self.name == "zstd" else ".jsonl.gz"
+
+    def compress(self, raw: bytes) -> bytes:
+        if self.name == "zstd":
+            return self._zstd_c.compress(raw)
+        return gzip.compress(raw, compresslevel=6, mtime=0)
+
+    def decompress(self, blob: bytes) -> bytes:
+        if blob.startswith(_GZIP_MAGIC):
+            return gzip.decompress(blob)
+        if blob.startswith(_ZSTD_MAGIC):
+            if self._zstd_d is None:
+                self._zstd_d = _import_zstandard("read zstd-compressed segments").ZstdDecompressor()
+            return self._zstd_d.decompress(blob)
+        raise ValueError(f"Unrecognised segment record compression (magic bytes {blob[:4].hex()}).")
+
+
+_SEGMENT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    live_bytes INTEGER NOT NULL DEFAULT 0,
+    sealed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS records (
+    session_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    session_date TEXT NOT NULL,
+    segment_id INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (session_id, filename)
+);
+CREATE INDEX IF NOT EXISTS idx_records_date ON records (session_date, session_id);
+CREATE INDEX IF NOT EXISTS idx_records_segment ON records (segment_id);
+"""
+
+
+class SegmentSessionStore:
+    """
+    Append-only compressed JSONL segments with a SQLite offset index.
+
+    Every save appends one compressed record {"session_id", "session_date", "filename", "data"} to the
+    active segment and points the (session_id, filename) index row at it; overwritten records become
+    dead bytes. Segments rotate at SESSION_SEGMENT_MAX_BYTES, and compact() rewrites the live records of
+    sealed segments whose live ratio fell below SESSION_COMPACTION_MIN_LIVE_RATIO, then deletes them.
+    Writers in different worker processes are serialised by the index's BEGIN IMMEDIATE transaction.
+    """
+
+    name = "segment"
+
+    def __init__(self, root_dir: pathlib.Path, compression: str, max_segment_bytes: int):
+        self.root_dir = root_dir
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        self.codec = _Codec(compression)
+        self.max_segment_bytes = max_segment_bytes
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.root_dir / "index.sqlite3", timeout=30.0, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SEGMENT_SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _segment_path(self, name: str) -> pathlib.Path:
+        return self.root_dir / name
+
+    def _active_segment(self, conn: sqlite3.Connection) -> Tuple[int, str, int]:
+        """Return (id, name, size) of the segment to append to, rotating if the current one is full."""
+        row = conn.execute("SELECT id, name, size FROM segments WHERE sealed = 0 ORDER BY id DESC LIMIT 1").fetchone()
+        if row is not None and row[2] < self.max_segment_bytes:
+            return row
+        if row is not None:
+            conn.execute("UPDATE segments SET sealed = 1 WHERE id = ?", (row[0],))
+        next_id = (conn.execute("SELECT COALESCE(MAX(id), 0) FROM segments").fetchone()[0]) + 1
+        name = f"segment-{next_id:06d}{self.codec.suffix}"
+        conn.execute("INSERT INTO segments (id, name) VALUES (?, ?)", (next_id, name))
+        return next_id, name, 0
+
+    def _append(self, conn: sqlite3.Connection, session_id: str, session_date_str: str, filename: str,
+                blob: bytes) -> None:
+        """Append a compressed record and repoint the index. Must run inside BEGIN IMMEDIATE."""
+        segment_id, segment_name, _ = self._active_segment(conn)
+        with open(self._segment_path(segment_name), "ab") as f:
+            offset = f.tell()
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+
+        previous = conn.execute("SELECT segment_id, length FROM records WHERE session_id = ? AND filename = ?",
+                                (session_id, filename)).fetchone()
+        if previous is not None:
+            conn.execute("UPDATE segments SET live_bytes = live_bytes - ? WHERE id = ?", (previous[1], previous[0]))
+        conn.execute(
+            "INSERT INTO records (session_id, filename, session_date, segment_id, offset, length, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(session_id, filename) DO UPDATE SET "
+            "session_date = excluded.session_date, segment_id = excluded.segment_id, offset = excluded.offset, "
+            "length = excluded.length, updated_at = excluded.updated_at",
+            (session_id, filename, session_date_str, segment_id, offset, len(blob), time.time())
+        )
+        conn.execute("UPDATE segments SET size = ?, live_bytes = live_bytes + ? WHERE id = ?",
+                     (offset + len(blob), len(blob), segment_id))
+
+    def _encode(self, data: Any, filename: str, session_id: str, session_date_str: str) -> bytes:
+        record = {"session_id": session_id, "session_date": session_date_str, "filename": filename, "data": data}
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        return self.codec.compress(line.encode("utf-8"))
+
+    def save(self, data: Any, filename: str, session_id: str, session_date_str: str) -> str:
+        blob = self._encode(data, filename, session_id, session_date_str)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._append(conn, session_id, session_date_str, filename, blob)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return f"{self.root_dir}#{session_id}/{filename}"
+
+    def _read_record(self, segment_name: str, offset: int, length: int) -> dict:
+        with open(self._segment_path(segment_name), "rb") as f:
+            f.seek(offset)
+            blob = f.read(length)
+        return json.loads(self.codec.decompress(blob))
+
+    def load(self, session_id: str, filename: str, session_date_str: Optional[str] = None) -> Optional[Any]:
+        # 索引按 (session_id, filename) 查找，不需要日期；压缩过程中段文件可能被删除，重新查索引后重试一次
+        for attempt in range(2):
+            row = self._conn().execute(
+                "SELECT s.name, r.offset, r.length FROM records r JOIN segments s ON s.id = r.segment_id "
+                "WHERE r.session_id = ? AND r.filename = ?", (session_id, filename)).fetchone()
+            if row is None:
+                return None
+            try:
+                return self._read_record(*row)["data"]
+            except FileNotFoundError:
+                if attempt:
+                    raise
+        return None
+
+    def iter_sessions(self, date_from: Optional[str] = None, date_to: Optional[str] = None
+                      ) -> Iterator[Tuple[str, str]]:
+        query = "SELECT DISTINCT session_id, session_date FROM records WHERE 1 = 1"
+        params = []
+        if date_from:
+            query += " AND session_date >= ?"
+            params.append(date_from)
+        if date_to:
+            query += " AND session_date <= ?"
+            params.append(date_to)
+        # 单独的连接与游标，逐行读取；调用方在迭代期间仍可使用 self._conn() 读写
+        # StreamingResponse 可能在不同线程中推进该生成器
+        conn = sqlite3.connect(self.root_dir / "index.sqlite3", timeout=30.0, check_same_thread=False)
+        try:
+            for session_id, session_date in conn.execute(query + " ORDER BY session_date, session_id", params):
+                yield session_id, session_date
+        finally:
+            conn.close()
+
+    def iter_files(self, session_id: str, session_date_str: Optional[str] = None) -> Iterator[str]:
+        for (filename,) in self._conn().execute(
+                "SELECT filename FROM records WHERE session_id = ? ORDER BY filename", (session_id,)).fetchall():
+            yield filename
+
+    def append(self, record: Any, filename: str, session_id: str, session_date_str: str) -> None:
+        """Append one record to a logical JSONL file, stored as index entries '<filename>#<seq>'."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            seq = conn.execute("SELECT COUNT(*) FROM records WHERE session_id = ? AND filename >= ? AND filename < ?",
+                               (session_id, f"{filename}#", f"{filename}$")).fetchone()[0]
+            entry_name = f"{filename}#{seq:08d}"
+            blob = self._encode(record, entry_name, session_id, session_date_str)
+            self._append(conn, session_id, session_date_str, entry_name, blob)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def iter_records(self, session_id: str, filename: str, session_date_str: Optional[str] = None) -> Iterator[Any]:
+        entries = self._conn().execute(
+            "SELECT filename FROM records WHERE session_id = ? AND filename >= ? AND filename < ? ORDER BY filename",
+            (session_id, f"{filename}#", f"{filename}$")).fetchall()
+        for (entry_name,) in entries:
+            record = self.load(session_id, entry_name)
+            if record is not None:
+                yield record
+
+    def count_records(self, session_id: str, filename: str) -> int:
+        """Number of records appended to the logical JSONL file `filename`."""
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM records WHERE session_id = ? AND filename >= ? AND filename < ?",
+            (session_id, f"{filename}#", f"{filename}$")).fetchone()[0]
+
+    def has_record(self, session_id: str, filename: str) -> bool:
+        return self._conn().execute("SELECT 1 FROM records WHERE session_id = ? AND filename = ?",
+                                    (session_id, filename)).fetchone() is not None
+
+    def compact(self, min_live_ratio: Optional[float] = None) -> dict:
+        """
+        Rewrite live records of sealed, mostly-dead segments into the active segment and delete the old files.
+        Also seals an over-full active segment so that it can be compacted later. Returns a small report.
+        """
+        if min_live_ratio is None:
+            min_live_ratio = settings.SESSION_COMPACTION_MIN_LIVE_RATIO
+        conn = self._conn()
+        report = {"segments_compacted": 0, "records_moved": 0, "bytes_reclaimed": 0}
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._active_segment(conn)  # 触发轮转
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        candidates = conn.execute(
+            "SELECT id, name, size FROM segments WHERE sealed = 1 AND (size = 0 OR live_bytes * 1.0 / size < ?)",
+            (min_live_ratio,)).fetchall()
+        for segment_id, segment_name, size in candidates:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                live = conn.execute("SELECT session_id, filename, session_date, offset, length FROM records "
+                                    "WHERE segment_id = ?", (segment_id,)).fetchall()
+                for session_id, filename, session_date, offset, length in live:
+                    with open(self._segment_path(segment_name), "rb") as f:
+                        f.seek(offset)
+                        blob = f.read(length)
+                    self._append(conn, session_id, session_date, filename, blob)
+                conn.execute("DELETE FROM segments WHERE id = ?", (segment_id,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._segment_path(segment_name).unlink(missing_ok=True)
+            report["segments_compacted"] += 1
+            report["records_moved"] += len(live)
+            report["bytes_reclaimed"] += size - sum(r[4] for r in live)
+        return report
+
+
+_store_lock = threading.Lock()
+_store = None
+
+
+def get_store():
+    """Return the configured session store backend (created once per process)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = settings.SESSION_STORE_BACKEND
+                if backend == "segment":
+                    _store = SegmentSessionStore(pathlib.Path(settings.SESSION_SEGMENT_DIR),
+                                                 settings.SESSION_SEGMENT_COMPRESSION,
+                                                 settings.SESSION_SEGMENT_MAX_BYTES)
+                elif backend == "directory":
+                    _store = DirectorySessionStore()
+                else:
+                    raise ValueError(f"Unsupported SESSION_STORE_BACKEND '{backend}', expected directory or segment.")
+    return _store
+
+
+def save_json_data(data_to_save: Any, filename: str, session_id: str, session_date_str: str,
+                   raise_errors: bool = False):
+    """
+    Helper function to save data for a session through the configured store.
+    With the directory backend the file is data/<session_date_str>_<session_id>/<filename>.
+    Errors are logged and swallowed unless `raise_errors` is set.
+    """
+    try:
+        location = get_store().save(_to_jsonable(data_to_save), filename, session_id, session_date_str)
+        logger.info("数据已保存到: %s", location)
+    except Exception as e:
+        logger.error("保存会话 %s 的 %s 时出错: %s", session_id, filename, e)
+        if raise_errors:
+            raise
+
+
+def load_json_data(session_id: str, filename: str, session_date_str: Optional[str] = None) -> Optional[Any]:
+    """Load a session document; pass the session date when known to avoid searching for the session."""
+    if not SESSION_ID_RE.match(session_id):
+        return None
+    return get_store().load(session_id, filename, session_date_str)
+
+
+def iter_sessions(date_from: Optional[str] = None, date_to: Optional[str] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Lazily yield (session_id, session_date_str) for stored sessions, optionally filtered by an inclusive
+    YYYYMMDD date range.
+    """
+    return get_store().iter_sessions(date_from, date_to)
+
+
+def append_json_record(record: Any, filename: str, session_id: str, session_date_str: str) -> None:
+    """Append one record to a session's JSONL file (used to stream large results to storage incrementally)."""
+    get_store().append(_to_jsonable(record), filename, session_id, session_date_str)
+
+
+def iter_json_records(session_id: str, filename: str, session_date_str: Optional[str] = None) -> Iterator[Any]:
+    if not SESSION_ID_RE.match(session_id):
+        return iter(())
+    return get_store().iter_records(session_id, filename, session_date_str)
+
+
+def migrate_directories_to_segments(delete_source: bool = False) -> dict:
+    """
+    Copy every data/<date>_<session_id>/*.json session into the segment store. Files already present in the
+    index are skipped and partially copied JSONL files continue after their last copied record, so an
+    interrupted migration can simply be re-run. With delete_source, a session directory is removed only after
+    every one of its files has been fully copied.
+    """
+    source = DirectorySessionStore()
+    target = SegmentSessionStore(pathlib.Path(settings.SESSION_SEGMENT_DIR), settings.SESSION_SEGMENT_COMPRESSION,
+                                 settings.SESSION_SEGMENT_MAX_BYTES)
+    report = {"sessions": 0, "files": 0, "skipped": 0, "incomplete": 0}
+    for session_id, session_date in source.iter_sessions():
+        session_path = source.session_dir(session_id, session_date)
+        complete = True
+        for filename in source.iter_files(session_id, session_date):
+            if filename.endswith(".jsonl"):
+                # 追加写入的 JSONL 文件逐条迁移；上次中断时已复制的前 copied 条跳过，从下一条继续
+                copied = target.count_records(session_id, filename)
+                total = 0
+                for record in source.iter_records(session_id, filename, session_date):
+                    if total >= copied:
+                        target.append(record, filename, session_id, session_date)
+                    total += 1
+                if target.count_records(session_id, filename) != total:
+                    complete = False  # 目标中的条数与源文件不一致，保留源目录
+                report["files" if total > copied else "skipped"] += 1
+                continue
+            if target.has_record(session_id, filename):
+                report["skipped"] += 1
+                continue
+            with open(session_path / filename, "r", encoding="utf-8") as f:
+                target.save(json.load(f), filename, session_id, session_date)
+            report["files"] += 1
+        report["sessions"] += 1
+        if not complete:
+            report["incomplete"] += 1
+            logger.warning("会话 %s 的 JSONL 记录数与迁移结果不一致，保留源目录", session_id)
+        elif delete_source:
+            shutil.rmtree(session_path)
+    return report
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Session store maintenance.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="Migrate data/<date>_<session_id>/ directories into segment files.")
+    migrate.add_argument("--delete-source", action="store_true", help="Remove each session directory once copied.")
+    sub.add_parser("compact", help="Compact sealed segments with many overwritten records.")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        print(migrate_directories_to_segments(delete_source=args.delete_source))
+    elif args.command == "compact":
+        store = get_store()
+        if not isinstance(store, SegmentSessionStore):
+            parser.error("compact requires SESSION_STORE_BACKEND=segment")
+        print(store.compact())
+
+
+if __name__ == "__main__":
+    main()
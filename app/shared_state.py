@@ -0,0 +1,238 @@
+# app/shared_state.py
+# 多 worker 部署时的本地共享状态（SQLite WAL 模式）。
+# 每个 worker 进程各自打开连接，通过同一个数据库文件共享：
+#   - 上游 LLM 的限流令牌桶（RPM / TPM），避免 N 个 worker 各自以为独占全部配额
+#   - 热点缓存（带 TTL 的键值对）
+#   - 各阶段 completion token 用量统计（见 app/token_stats.py），重启后保留
+#   - 产品文档的 MinHash 签名与 LSH 分桶（见 app/product_index.py）
+#   - 生成请求的幂等键索引（见 app/idempotency.py）
+#   - 正在生成的会话（带心跳），同一会话不会被两个 worker 同时生成或恢复
+import asyncio
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from .config import settings
+
+_local = threading.local()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache (expires_at);
+CREATE TABLE IF NOT EXISTS token_samples (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stage TEXT NOT NULL,
+    model TEXT NOT NULL,
+    tokens_per_item REAL NOT NULL,
+    truncated INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_token_samples_stage ON token_samples (stage, model, id);
+CREATE TABLE IF NOT EXISTS token_counters (
+    stage TEXT NOT NULL,
+    model TEXT NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 0,
+    truncated INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (stage, model)
+);
+CREATE TABLE IF NOT EXISTS product_signatures (
+    session_id TEXT PRIMARY KEY,
+    session_date TEXT,
+    signature TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS product_bands (
+    band INTEGER NOT NULL,
+    band_hash TEXT NOT NULL,
+    session_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_product_bands ON product_bands (band, band_hash);
+CREATE INDEX IF NOT EXISTS idx_product_bands_session ON product_bands (session_id);
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    session_date TEXT,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at);
+CREATE TABLE IF NOT EXISTS running_sessions (
+    session_id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+# 在已有数据库上补充的列（CREATE TABLE IF NOT EXISTS 不会修改旧表）：(表, 列, 类型)
+_ADDED_COLUMNS = [
+    ("idempotency_keys", "session_date", "TEXT"),
+    ("product_signatures", "session_date", "TEXT"),
+]
+
+
+def _ensure_column(conn: sqlite3.Connection, table: str, column: str, declaration: str) -> None:
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        try:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+        except sqlite3.OperationalError:
+            pass  # 另一个 worker 同时添加了该列
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return a per-thread, per-process SQLite connection to the shared state database.
+    Connections are never shared across fork() (e.g. gunicorn preload), so the pid is checked too.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "pid", None) == os.getpid():
+        return conn
+
+    db_path = pathlib.Path(settings.SHARED_STATE_PATH)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    # isolation_level=None: 自行控制事务（BEGIN IMMEDIATE 用于跨进程加写锁）
+    conn = sqlite3.connect(db_path, timeout=30.0, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    for table, column, declaration in _ADDED_COLUMNS:
+        _ensure_column(conn, table, column, declaration)
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+# --- 限流：跨进程令牌桶 ---
+
+def try_acquire_tokens(bucket: str, cost: float, per_minute: float, burst: float) -> float:
+    """
+    Try to take `cost` tokens from the named bucket.
+    Returns 0.0 when acquired, otherwise the number of seconds to wait before retrying.
+    """
+    rate_per_sec = per_minute / 60.0
+    capacity = max(burst, 1.0)
+    cost = min(cost, capacity)  # 单次请求超过桶容量时按满桶计，避免永远无法获取
+    now = time.time()
+
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT tokens, updated_at FROM rate_buckets WHERE name = ?", (bucket,)).fetchone()
+        if row is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, row[0] + max(0.0, now - row[1]) * rate_per_sec)
+
+        if tokens >= cost:
+            tokens -= cost
+            wait = 0.0
+        else:
+            wait = (cost - tokens) / rate_per_sec
+
+        conn.execute(
+            "INSERT INTO rate_buckets (name, tokens, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+            (bucket, tokens, now)
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return wait
+
+
+async def acquire_tokens(bucket: str, cost: float, per_minute: float, burst: float) -> float:
+    """
+    Wait until `cost` tokens are available in the shared bucket. Returns the total time waited (seconds).
+    """
+    waited = 0.0
+    while True:
+        wait = await asyncio.to_thread(try_acquire_tokens, bucket, cost, per_minute, burst)
+        if wait <= 0:
+            return waited
+        # 分段等待，其他 worker 可能在此期间消耗令牌，需要重新竞争
+        sleep_for = min(wait, 1.0)
+        await asyncio.sleep(sleep_for)
+        waited += sleep_for
+
+
+# --- 共享缓存 ---
+
+def make_cache_key(namespace: str, data: Any) -> str:
+    raw = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    return f"{namespace}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+def cache_get(key: str) -> Optional[str]:
+    row = get_connection().execute(
+        "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+    ).fetchone()
+    return row[0] if row else None
+
+
+def cache_set(key: str, value: str, ttl_seconds: float) -> None:
+    now = time.time()
+    conn = get_connection()
+    conn.execute(
+        "INSERT INTO cache (key, value, expires_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+        (key, value, now + ttl_seconds)
+    )
+    conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+
+
+async def cache_get_async(key: str) -> Optional[str]:
+    return await asyncio.to_thread(cache_get, key)
+
+
+async def cache_set_async(key: str, value: str, ttl_seconds: float) -> None:
+    await asyncio.to_thread(cache_set, key, value, ttl_seconds)
+
+
+# --- 正在生成的会话 ---
+
+def claim_running_session(session_id: str, stale_seconds: float) -> bool:
+    """
+    Mark `session_id` as being generated. Returns False when another request (on any worker) holds it and
+    has sent a heartbeat within `stale_seconds`.
+    """
+    now = time.time()
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # 超时未刷新的标记视为持有者已崩溃，顺带清理
+        conn.execute("DELETE FROM running_sessions WHERE updated_at < ?", (now - stale_seconds,))
+        claimed = conn.execute("INSERT OR IGNORE INTO running_sessions (session_id, updated_at) VALUES (?, ?)",
+                               (session_id, now)).rowcount == 1
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return claimed
+
+
+def touch_running_session(session_id: str) -> None:
+    get_connection().execute("UPDATE running_sessions SET updated_at = ? WHERE session_id = ?",
+                             (time.time(), session_id))
+
+
+def release_running_session(session_id: str) -> None:
+    get_connection().execute("DELETE FROM running_sessions WHERE session_id = ?", (session_id,))
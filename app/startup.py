@@ -0,0 +1,97 @@
+# app/startup.py
+# 启动预热：在 lifespan 中后台执行，完成前 /readyz 返回 503。
+#   1. dns          预解析 LLM 接口域名
+#   2. connections  预先建立连接池中的 TCP/TLS 连接
+#   3. templates    预编译 Jinja 模板，并渲染缓存首页
+#   4. validators   预热 Pydantic 校验/序列化路径
+# 每个阶段的耗时记录在 startup_report 中，由 /readyz 返回。
+import time
+
+# 进程导入 app 包的时间点（先于 fastapi 等重量级依赖的导入），用于计算导入阶段耗时
+PROCESS_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import socket
+from typing import Any, Dict
+from urllib.parse import urlsplit
+
+from fastapi.templating import Jinja2Templates
+
+from .config import settings
+from . import llm_service
+from . import structured_logging
+from .pydantic_models import AiCustomerDataResponse, ProductInfoRequest
+
+logger = structured_logging.get_logger(__name__)
+
+startup_report: Dict[str, Any] = {
+    "ready": False,
+    "phases_ms": {},
+    "errors": {},
+}
+
+
+async def _timed_phase(name: str, coro) -> Any:
+    started = time.perf_counter()
+    try:
+        return await coro
+    except Exception as e:
+        # 预热失败不影响服务可用，只是首个请求会慢一些
+        startup_report["errors"][name] = str(e)
+        logger.warning("启动预热阶段 %s 失败: %s", name, e)
+    finally:
+        startup_report["phases_ms"][name] = round((time.perf_counter() - started) * 1000, 1)
+
+
+async def _resolve_dns() -> None:
+    parts = urlsplit(settings.EXTERNAL_API_URL)
+    if not parts.hostname:
+        return
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    loop = asyncio.get_running_loop()
+    await loop.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+
+
+async def _open_connections() -> None:
+    opened = await llm_service.prewarm_connections(settings.STARTUP_PREWARM_CONNECTIONS)
+    startup_report["connections_opened"] = opened
+
+
+async def _compile_templates(templates: Jinja2Templates, template_names, pages) -> None:
+    for name in template_names:
+        templates.get_template(name)
+    for page in pages:
+        page.render()
+
+
+async def _warm_validators() -> None:
+    ProductInfoRequest.model_validate({"product_document": "warm-up"})
+    sample = AiCustomerDataResponse.model_validate({
+        "product_summary": "warm-up",
+        "customer_profiles": [{"name": "n", "description": "d", "main_concerns": ["c"],
+                               "b2b_questions": [{"text": "q"}], "b2c_questions": [{"text": "q"}]}],
+    })
+    sample.model_dump_json()
+
+
+async def warm_up(templates: Jinja2Templates, template_names=("ai_customer_generator.html",), pages=()) -> None:
+    """Run all warm-up phases and mark the worker ready. Total time is bounded by STARTUP_WARMUP_TIMEOUT."""
+    started = time.perf_counter()
+    startup_report["phases_ms"]["import"] = round((started - PROCESS_IMPORT_STARTED) * 1000, 1)
+
+    async def _all_phases():
+        # DNS 与模板/校验器互不依赖，可以并行；连接预热依赖 DNS 结果（命中解析缓存）
+        await asyncio.gather(
+            _timed_phase("dns", _resolve_dns()),
+            _timed_phase("templates", _compile_templates(templates, template_names, pages)),
+            _timed_phase("validators", _warm_validators()),
+        )
+        await _timed_phase("connections", _open_connections())
+
+    try:
+        await asyncio.wait_for(_all_phases(), timeout=settings.STARTUP_WARMUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        startup_report["errors"]["timeout"] = f"warm-up exceeded {settings.STARTUP_WARMUP_TIMEOUT}s"
+    startup_report["phases_ms"]["total_warmup"] = round((time.perf_counter() - started) * 1000, 1)
+    startup_report["ready"] = True
+    logger.info("启动预热完成", extra={"data": {"phases_ms": startup_report["phases_ms"]}})
@@ -0,0 +1,295 @@
+# app/static_assets.py
+# 静态资源的构建与发布：
+#   构建（python -m app.static_assets build，生产模式 run.py --prod 启动前自动执行）
+#     - 把 static/ 下的文件复制到 static/dist/，文件名带内容哈希（style.3f2a9c1b04.css）
+#     - CSS 中引用的其他资源改写为带哈希的文件名；背景 PNG 额外生成 WebP（需要 Pillow）
+#     - 文本类资源预压缩出 .gz 与 .br（需要 brotli）变体
+#     - 写出 manifest.json：逻辑文件名 -> 带哈希文件名与可用编码
+#   发布
+#     - PrecompressedStaticFiles：按 Accept-Encoding 直接返回预压缩变体；带哈希的文件
+#       返回 Cache-Control: immutable，其余文件要求按 ETag 重新验证（304）
+#     - asset_url()：模板中使用，manifest 存在时返回带哈希的 URL，否则返回原始文件 URL
+#     - HomepageCache：首页渲染结果（及其压缩版本）缓存在内存中，支持 ETag/304
+# Pillow 与 brotli 都是可选依赖，缺失时分别跳过 WebP 和 .br 变体。
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import pathlib
+import re
+import shutil
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.types import Scope
+
+from .config import PROJECT_ROOT_DIR
+
+STATIC_DIR = PROJECT_ROOT_DIR / "static"
+DIST_DIRNAME = "dist"
+DIST_DIR = STATIC_DIR / DIST_DIRNAME
+MANIFEST_PATH = DIST_DIR / "manifest.json"
+STATIC_URL_PREFIX = "/static/"
+
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".html", ".svg", ".ico", ".json", ".txt"}
+WEBP_SOURCE_SUFFIXES = {".png", ".jpg", ".jpeg"}
+# 压缩后至少小 10% 才保留变体
+MIN_COMPRESSION_GAIN = 0.9
+# 浏览器偏好顺序：br 优先于 gzip
+ENCODING_SUFFIXES = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+CSS_URL_RE = re.compile(r"url\((['\"]?)([^'\")]+)\1\)")
+CSS_BACKGROUND_RE = re.compile(r"^(\s*)background-image:\s*url\((['\"]?)([^'\")]+)\2\);[^\n]*$", re.MULTILINE)
+
+
+def _content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def _hashed_name(name: str, data: bytes) -> str:
+    stem, suffix = os.path.splitext(name)
+    return f"{stem}.{_content_hash(data)}{suffix}"
+
+
+def _compress_variants(data: bytes) -> Dict[str, bytes]:
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli  # 可选依赖：pip install brotli
+    except ImportError:
+        pass
+    else:
+        variants["br"] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items()
+            if len(body) < len(data) * MIN_COMPRESSION_GAIN}
+
+
+def _to_webp(source: pathlib.Path) -> Optional[bytes]:
+    try:
+        from PIL import Image  # 可选依赖：pip install Pillow
+    except ImportError:
+        print("提示：未安装 Pillow，跳过 WebP 转换。")
+        return None
+    import io
+    with Image.open(source) as image:
+        buffer = io.BytesIO()
+        image.save(buffer, format="WEBP", quality=80, method=6)
+    return buffer.getvalue()
+
+
+def _rewrite_css(css: str, assets: Dict[str, Dict[str, Any]]) -> str:
+    def background(match: re.Match) -> str:
+        indent, _, name = match.group(1), match.group(2), match.group(3)
+        entry = assets.get(name)
+        if not entry or not entry.get("webp"):
+            return match.group(0)
+        # 不支持 image-set 的浏览器使用第一条声明（原格式）
+        return (f"{indent}background-image: url('{entry['file']}');\n"
+                f"{indent}background-image: image-set(url('{entry['webp']}') type('image/webp'), "
+                f"url('{entry['file']}') type('{_image_type(name)}'));")
+
+    def plain_url(match: re.Match) -> str:
+        quote, name = match.group(1), match.group(2)
+        entry = assets.get(name)
+        return f"url({quote}{entry['file']}{quote})" if entry else match.group(0)
+
+    css = CSS_BACKGROUND_RE.sub(background, css)
+    return CSS_URL_RE.sub(plain_url, css)
+
+
+def _image_type(name: str) -> str:
+    suffix = os.path.splitext(name)[1].lower()
+    return "image/png" if suffix == ".png" else "image/jpeg"
+
+
+def build(source_dir: pathlib.Path = STATIC_DIR, dist_dir: pathlib.Path = DIST_DIR) -> Dict[str, Any]:
+    """
+    Build content-hashed, precompressed copies of every file in `source_dir` into `dist_dir` and write the
+    manifest. Files from previous builds that are no longer referenced are removed.
+    """
+    dist_dir.mkdir(parents=True, exist_ok=True)
+    sources = sorted(p for p in source_dir.iterdir() if p.is_file() and not p.name.startswith("."))
+    assets: Dict[str, Dict[str, Any]] = {}
+    outputs: Dict[str, bytes] = {}
+
+    # CSS 引用其他资源，最后处理
+    for source in sorted(sources, key=lambda p: p.suffix == ".css"):
+        data = source.read_bytes()
+        if source.suffix == ".css":
+            data = _rewrite_css(data.decode("utf-8"), assets).encode("utf-8")
+        entry: Dict[str, Any] = {"file": _hashed_name(source.name, data), "encodings": []}
+        outputs[entry["file"]] = data
+        if source.suffix.lower() in WEBP_SOURCE_SUFFIXES:
+            webp = _to_webp(source)
+            if webp is not None and len(webp) < len(data):
+                entry["webp"] = _hashed_name(os.path.splitext(source.name)[0] + ".webp", webp)
+                outputs[entry["webp"]] = webp
+        if source.suffix.lower() in COMPRESSIBLE_SUFFIXES:
+            for encoding, body in _compress_variants(data).items():
+                entry["encodings"].append(encoding)
+                outputs[entry["file"] + dict(ENCODING_SUFFIXES)[encoding]] = body
+        assets[source.name] = entry
+
+    for filename, data in outputs.items():
+        target = dist_dir / filename
+        if not target.exists():  # 文件名含内容哈希，已存在即内容相同
+            tmp = target.with_name(target.name + ".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, target)
+    for stale in dist_dir.iterdir():
+        if stale.is_file() and stale.name not in outputs and stale.name != MANIFEST_PATH.name:
+            stale.unlink()
+
+    manifest = {"assets": assets}
+    tmp = dist_dir / (MANIFEST_PATH.name + ".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, dist_dir / MANIFEST_PATH.name)
+    _manifest_cache.clear()
+    return manifest
+
+
+# --- 运行时 ---
+
+_manifest_cache: Dict[str, Any] = {}
+
+
+def load_manifest() -> Dict[str, Any]:
+    """Return the build manifest (empty when `build` has not been run); re-read when the file changes."""
+    try:
+        mtime = MANIFEST_PATH.stat().st_mtime
+    except FileNotFoundError:
+        return {}
+    if _manifest_cache.get("mtime") != mtime:
+        manifest = json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+        assets = manifest.get("assets", {})
+        _manifest_cache.update({
+            "mtime": mtime,
+            "assets": assets,
+            # dist 中带哈希的文件名 -> 可用的预压缩编码
+            "encodings": {entry["file"]: entry.get("encodings", []) for entry in assets.values()},
+            "hashed": {name for entry in assets.values() for name in (entry["file"], entry.get("webp")) if name},
+        })
+    return _manifest_cache
+
+
+def asset_url(name: str) -> str:
+    entry = load_manifest().get("assets", {}).get(name)
+    if entry:
+        return f"{STATIC_URL_PREFIX}{DIST_DIRNAME}/{entry['file']}"
+    return f"{STATIC_URL_PREFIX}{name}"
+
+
+def _accepted_encodings(headers: Headers) -> set:
+    accepted = set()
+    for part in headers.get("accept-encoding", "").split(","):
+        token, _, params = part.strip().partition(";")
+        if token and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            accepted.add(token.lower())
+    return accepted
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves prebuilt .br/.gz variants and sets cache headers for hashed build output."""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        path = pathlib.PurePath(full_path)
+        manifest = load_manifest()
+        is_build_output = path.parent.name == DIST_DIRNAME
+        hashed = is_build_output and path.name in manifest.get("hashed", ())
+        available = manifest.get("encodings", {}).get(path.name, []) if is_build_output else []
+
+        response: Optional[FileResponse] = None
+        if available:
+            accepted = _accepted_encodings(request_headers)
+            for encoding, suffix in ENCODING_SUFFIXES:
+                if encoding in available and encoding in accepted:
+                    variant = f"{full_path}{suffix}"
+                    try:
+                        variant_stat = os.stat(variant)
+                    except FileNotFoundError:
+                        continue
+                    response = FileResponse(variant, status_code=status_code, stat_result=variant_stat,
+                                            media_type=mimetypes.guess_type(str(full_path))[0] or "text/plain")
+                    response.headers["content-encoding"] = encoding
+                    break
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        if available:
+            response.headers["vary"] = "Accept-Encoding"
+        response.headers["cache-control"] = IMMUTABLE_CACHE_CONTROL if hashed else REVALIDATE_CACHE_CONTROL
+        if self.is_not_modified(response.headers, request_headers):
+            return Response(status_code=304, headers={k: v for k, v in response.headers.items()
+                                                      if k in ("etag", "cache-control", "vary", "last-modified")})
+        return response
+
+
+class HomepageCache:
+    """
+    Rendered homepage kept in memory with precomputed gzip/br bodies and an ETag. The page depends only on the
+    template and the asset manifest, so it is re-rendered only when one of those files changes.
+    """
+
+    def __init__(self, templates: Jinja2Templates, template_name: str):
+        self.templates = templates
+        self.template_name = template_name
+        self._key: Optional[Tuple[float, float]] = None
+        self._bodies: Dict[str, bytes] = {}
+        self._etag = ""
+
+    def _source_key(self) -> Tuple[float, float]:
+        template_path = pathlib.Path(self.templates.env.loader.searchpath[0]) / self.template_name
+        try:
+            manifest_mtime = MANIFEST_PATH.stat().st_mtime
+        except FileNotFoundError:
+            manifest_mtime = 0.0
+        return template_path.stat().st_mtime, manifest_mtime
+
+    def render(self) -> None:
+        key = self._source_key()
+        if key == self._key:
+            return
+        html = self.templates.get_template(self.template_name).render().encode("utf-8")
+        self._bodies = {"identity": html, **_compress_variants(html)}
+        self._etag = f'"{_content_hash(html)}"'
+        self._key = key
+
+    def response(self, request: Request) -> Response:
+        self.render()
+        headers = {"etag": self._etag, "cache-control": REVALIDATE_CACHE_CONTROL, "vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if self._etag in [tag.strip(" W/") for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        accepted = _accepted_encodings(request.headers)
+        for encoding, _ in ENCODING_SUFFIXES:
+            if encoding in self._bodies and encoding in accepted:
+                return Response(self._bodies[encoding], media_type="text/html; charset=utf-8",
+                                headers={**headers, "content-encoding": encoding})
+        return Response(self._bodies["identity"], media_type="text/html; charset=utf-8", headers=headers)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Build content-hashed, precompressed static assets.")
+    parser.add_argument("command", choices=["build", "clean"])
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        manifest = build()
+        for name, entry in manifest["assets"].items():
+            variants = [*entry["encodings"], *(["webp"] if entry.get("webp") else [])]
+            print(f"{name} -> {entry['file']} {variants}")
+    else:
+        shutil.rmtree(DIST_DIR, ignore_errors=True)
+        _manifest_cache.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# app/structured_logging.py
+# 非阻塞结构化日志，替代请求路径上的 print()：
+#   - 调用方（事件循环）只做级别判断、采样、参数截断，然后把记录放入有界队列；
+#     后台线程（logging.handlers.QueueListener）格式化为 JSON 并写 stdout，慢速的 stdout 不会阻塞事件循环
+#   - 每条记录带 session_id（contextvar，流水线子任务继承）与调度器的客户端标识
+#   - 超长参数（例如完整的 LLM 回复）截断到 LOG_MAX_FIELD_CHARS
+#   - 同一消息模板在 LOG_SAMPLE_WINDOW_SECONDS 内最多输出 LOG_SAMPLE_BURST 条，其余只计数，
+#     之后输出的第一条记录附带被抑制的条数（suppressed）
+#   - 队列已满时丢弃记录并计数，不阻塞调用方
+# 统计（记录数、丢弃/抑制数、调用方与写出线程耗时）为每个 worker 独立，由 /v1/metrics 输出；
+# python -m app.benchmark 报告基准运行期间的日志开销。
+#
+# 用法：logger = structured_logging.get_logger(__name__); logger.warning("...: %s", value)
+# 参数用 %s 占位而不是 f-string：被级别或采样过滤掉的记录不会格式化。
+import collections
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from .config import settings
+from .scheduler import current_client_id
+
+ROOT_LOGGER_NAME = "app"
+
+current_session_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_session_id", default=None)
+
+_stats: Dict[str, int] = collections.defaultdict(int)
+_listener: Optional[logging.handlers.QueueListener] = None
+_configured_pid: Optional[int] = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    # 应用模块的 __name__ 是 app.xxx，都挂在 "app" logger 下
+    return logging.getLogger(name if name.startswith(ROOT_LOGGER_NAME) else f"{ROOT_LOGGER_NAME}.{name}")
+
+
+def truncate(value: Any, limit: Optional[int] = None) -> Any:
+    limit = limit or settings.LOG_MAX_FIELD_CHARS
+    if isinstance(value, (str, bytes)) and len(value) > limit:
+        return f"{value[:limit]}...[{len(value) - limit} more chars]"
+    if isinstance(value, (dict, list)):
+        text = str(value)
+        if len(text) > limit:
+            return f"{text[:limit]}...[{len(text) - limit} more chars]"
+    return value
+
+
+class _SamplingFilter(logging.Filter):
+    """Lets at most `burst` records per message template through in each `window` seconds."""
+
+    def __init__(self, burst: int, window: float):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._lock = threading.Lock()
+        # (logger, 级别, 消息模板) -> [窗口开始时间, 本窗口已输出条数, 待报告的抑制条数]
+        self._windows: Dict[Tuple[str, int, str], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None:
+                if len(self._windows) >= 10000:
+                    self._windows.clear()  # 防止非模板消息（f-string）使字典无限增长
+                state = self._windows[key] = [now, 0, 0]
+            elif now - state[0] >= self.window:
+                state[0], state[1] = now, 0
+            if state[1] >= self.burst:
+                state[2] += 1
+                _stats["suppressed"] += 1
+                return False
+            state[1] += 1
+            record.suppressed, state[2] = state[2], 0
+        return True
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    Runs in the caller: attaches session/client ids, truncates arguments, merges the message and enqueues.
+    Without a listener (LOG_ASYNC=false) the record is written synchronously to `sync_target` instead.
+    """
+
+    def __init__(self, log_queue: queue.Queue, sync_target: Optional[logging.Handler] = None):
+        super().__init__(log_queue)
+        self.sync_target = sync_target
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        started = time.perf_counter_ns()
+        try:
+            return super().handle(record)
+        finally:
+            _stats["caller_ns"] += time.perf_counter_ns() - started
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            args = record.args
+            if isinstance(args, tuple):
+                args = tuple(truncate(arg) for arg in args)
+            elif isinstance(args, dict):
+                args = {key: truncate(value) for key, value in args.items()}
+            record.msg = str(record.msg) % args
+            record.args = None
+        record.msg = truncate(str(record.msg), settings.LOG_MAX_FIELD_CHARS * 2)
+        record.session_id = current_session_id.get()
+        record.client_id = current_client_id.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        _stats["records"] += 1
+        if self.sync_target is not None:
+            self.sync_target.handle(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _stats["dropped"] += 1
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(
+                timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in ("session_id", "client_id", "suppressed"):
+            value = getattr(record, field, None)
+            if value:
+                entry[field] = value
+        data = getattr(record, "data", None)  # logger.info("...", extra={"data": {...}}) 的结构化字段
+        if isinstance(data, dict):
+            entry.update({key: truncate(value) for key, value in data.items()})
+        if record.exc_info:
+            entry["exc"] = truncate(self.formatException(record.exc_info), settings.LOG_MAX_FIELD_CHARS * 4)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        session_id = getattr(record, "session_id", None)
+        suppressed = getattr(record, "suppressed", 0)
+        prefix = f"[{session_id}] " if session_id else ""
+        return prefix + text + (f" (+{suppressed} suppressed)" if suppressed else "")
+
+
+class _TimedStreamHandler(logging.StreamHandler):
+    def emit(self, record: logging.LogRecord) -> None:
+        started = time.perf_counter_ns()
+        super().emit(record)
+        _stats["writer_ns"] += time.perf_counter_ns() - started
+
+
+def configure() -> None:
+    """
+    Install the handler on the "app" logger; idempotent per process. Call it in each worker (lifespan) and in
+    command-line entry points: a listener thread started before fork() does not exist in the children.
+    """
+    global _listener, _configured_pid
+    if _configured_pid == os.getpid():
+        return
+    logger = logging.getLogger(ROOT_LOGGER_NAME)
+    for handler in list(logger.handlers):
+        if isinstance(handler, _ContextQueueHandler):
+            logger.removeHandler(handler)
+    logger.setLevel(settings.LOG_LEVEL.upper())
+    logger.propagate = False
+
+    stream_handler = _TimedStreamHandler(sys.stdout)
+    stream_handler.setFormatter(_TextFormatter() if settings.LOG_FORMAT == "text" else _JsonFormatter())
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    handler = _ContextQueueHandler(log_queue, sync_target=None if settings.LOG_ASYNC else stream_handler)
+    handler.addFilter(_SamplingFilter(settings.LOG_SAMPLE_BURST, settings.LOG_SAMPLE_WINDOW_SECONDS))
+    logger.addHandler(handler)
+
+    _listener = None
+    if settings.LOG_ASYNC:
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+        _listener.start()
+    _configured_pid = os.getpid()
+
+
+def shutdown() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener, _configured_pid
+    if _listener is not None and _configured_pid == os.getpid():
+        _listener.stop()
+    _listener = None
+    _configured_pid = None
+
+
+def snapshot() -> dict:
+    records = _stats["records"]
+    return {
+        "mode": "async" if settings.LOG_ASYNC else "sync",
+        "records": records,
+        "dropped": _stats["dropped"],
+        "suppressed": _stats["suppressed"],
+        "queue_depth": _listener.queue.qsize() if _listener is not None else 0,
+        "caller_time_ms": round(_stats["caller_ns"] / 1e6, 3),
+        "avg_caller_us": round(_stats["caller_ns"] / records / 1e3, 2) if records else 0.0,
+        "writer_time_ms": round(_stats["writer_ns"] / 1e6, 3),
+    }
@@ -0,0 +1,148 @@
+# app/structured_output.py
+# LLM 结构化输出：
+#   - LLM_RESPONSE_FORMAT=json_schema 时，画像/问题调用按 CustomerProfile / GeneratedQuestion 派生的 JSON Schema
+#     请求 response_format: json_schema（支持约束解码的后端保证输出符合结构）；后端拒绝该参数时本进程退回 json_object
+#   - 返回内容用预先构建的 TypeAdapter 一次解析并校验（validate_json 直接从字符串构建模型，不经过中间字典）
+#   - 一次校验不通过时（json_object 模式下偶尔缺字段、类型不对）才逐条校验，保留合法条目
+# 各结果（一次通过 / 逐条修复 / 失败）的计数为每个 worker 独立，由 /v1/metrics 输出。
+import collections
+import json
+from typing import Any, Dict, List, Optional, Sequence, Type, Union
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from .config import settings
+from . import structured_logging
+from .pydantic_models import CustomerProfile, CustomerProfileList, GeneratedQuestion, GeneratedQuestionList, \
+    LLM_ASSIGNED_PROFILE_FIELDS, LLM_OUTPUT_CONTEXT
+
+logger = structured_logging.get_logger(__name__)
+
+
+class StructuredOutputError(ValueError):
+    def __init__(self, kind: str, reason: str, raw: str):
+        super().__init__(f"Invalid {kind} output from LLM: {reason}")
+        self.kind = kind
+        self.raw = raw
+
+
+def _item_schema(model: Type[BaseModel], exclude: Sequence[str] = ()) -> Dict[str, Any]:
+    schema = model.model_json_schema()
+    properties = {name: {k: v for k, v in prop.items() if k not in ("title", "default")}
+                  for name, prop in schema["properties"].items() if name not in exclude}
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": [name for name in schema.get("required", []) if name in properties],
+        "additionalProperties": False,
+    }
+
+
+def _list_schema(name: str, key: str, item_schema: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "name": name,
+        "schema": {
+            "type": "object",
+            "properties": {key: {"type": "array", "items": item_schema}},
+            "required": [key],
+            "additionalProperties": False,
+        },
+    }
+
+
+PROFILES_SCHEMA = _list_schema("customer_profiles", "profiles",
+                               _item_schema(CustomerProfile, LLM_ASSIGNED_PROFILE_FIELDS))
+QUESTIONS_SCHEMA = _list_schema("generated_questions", "questions", _item_schema(GeneratedQuestion, ("id",)))
+
+# 根为对象（json_schema 模式）或数组（提示词要求的格式）都接受
+_PROFILES_ADAPTER = TypeAdapter(Union[CustomerProfileList, List[CustomerProfile]])
+_QUESTIONS_ADAPTER = TypeAdapter(Union[GeneratedQuestionList, List[GeneratedQuestion]])
+_PROFILE_LIST_ADAPTER = TypeAdapter(List[CustomerProfile])
+_PROFILE_ADAPTER = TypeAdapter(CustomerProfile)
+_QUESTION_ADAPTER = TypeAdapter(GeneratedQuestion)
+
+_schema_unsupported = False
+_counters: Dict[str, Dict[str, int]] = collections.defaultdict(lambda: collections.defaultdict(int))
+
+
+def schema_enabled() -> bool:
+    return settings.LLM_RESPONSE_FORMAT == "json_schema" and not _schema_unsupported
+
+
+def response_format(schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if schema is not None and schema_enabled():
+        return {"type": "json_schema", "json_schema": schema}
+    return {"type": "json_object"}
+
+
+def is_schema_rejection(status_code: int, response_text: str) -> bool:
+    text = response_text.lower()
+    return status_code in (400, 422) and ("response_format" in text or "schema" in text)
+
+
+def mark_schema_unsupported(detail: str) -> None:
+    global _schema_unsupported
+    if not _schema_unsupported:
+        logger.warning("LLM 后端不支持 json_schema 结构化输出，本进程改用 json_object: %s", detail)
+    _schema_unsupported = True
+
+
+def envelope_hint(key: str) -> str:
+    """Prompt suffix telling the model where the array goes when the json_schema response format is used."""
+    if not schema_enabled():
+        return ""
+    return f'\nReturn the array as the value of the "{key}" key of a single JSON object.\n'
+
+
+def _parse_list(raw: str, kind: str, key: str, adapter: TypeAdapter, item_adapter: TypeAdapter) -> List[Any]:
+    counters = _counters[kind]
+    try:
+        result = adapter.validate_json(raw, context=LLM_OUTPUT_CONTEXT)
+        counters["validated"] += 1
+        return getattr(result, key) if isinstance(result, BaseModel) else result
+    except ValidationError:
+        pass
+
+    # 逐条修复：跳过不合法的条目，保留其余
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError as e:
+        counters["failed"] += 1
+        raise StructuredOutputError(kind, f"malformed JSON ({e})", raw) from None
+    if isinstance(data, dict) and isinstance(data.get(key), list):
+        data = data[key]
+    if not isinstance(data, list):
+        counters["failed"] += 1
+        raise StructuredOutputError(kind, f"expected a list, got {type(data).__name__}", raw)
+    items = []
+    for item in data:
+        try:
+            items.append(item_adapter.validate_python(item, context=LLM_OUTPUT_CONTEXT))
+        except ValidationError:
+            counters["items_skipped"] += 1
+    counters["repaired"] += 1
+    return items
+
+
+def parse_profiles(raw: str) -> List[CustomerProfile]:
+    """Validate an LLM profiles reply into CustomerProfile objects (fresh ids, empty question lists)."""
+    return _parse_list(raw, "profiles", "profiles", _PROFILES_ADAPTER, _PROFILE_ADAPTER)
+
+
+def parse_questions(raw: str) -> List[GeneratedQuestion]:
+    return _parse_list(raw, "questions", "questions", _QUESTIONS_ADAPTER, _QUESTION_ADAPTER)
+
+
+def fresh_profiles(stored_profiles: List[Dict[str, Any]]) -> List[CustomerProfile]:
+    """Stored profile dicts as new profiles: new ids and no questions (used when reusing a session's profiles)."""
+    return _PROFILE_LIST_ADAPTER.validate_python(stored_profiles, context=LLM_OUTPUT_CONTEXT)
+
+
+def snapshot() -> dict:
+    kinds = ("profiles", "questions")
+    return {
+        "response_format": "json_schema" if schema_enabled() else "json_object",
+        "schema_unsupported": _schema_unsupported,
+        **{kind: {outcome: _counters[kind][outcome]
+                  for outcome in ("validated", "repaired", "failed", "items_skipped")} for kind in kinds},
+    }
@@ -0,0 +1,133 @@
+# app/token_stats.py
+# 按阶段/模型统计 LLM 实际 completion token 用量，并据此自适应设置 max_tokens：
+#   max_tokens = 每条目 token 数的高分位值 × 条目数 × (1 + 安全余量)
+# 样本保存在共享状态库（SQLite WAL）中，所有 worker 共用，重启后保留。
+# 被截断（finish_reason == "length"）的样本只代表下限，计算分位数时按 TRUNCATED_SAMPLE_BOOST 放大。
+import asyncio
+import math
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import settings
+from . import shared_state
+from . import structured_logging
+
+logger = structured_logging.get_logger(__name__)
+
+TRUNCATED_SAMPLE_BOOST = 1.5
+_RECOMMENDATION_TTL_SECONDS = 30.0
+
+# (stage, model) -> (计算时间, 每条目 token 高分位值 或 None)
+_recommendation_cache: Dict[Tuple[str, str], Tuple[float, Optional[float]]] = {}
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100.0 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def _load_per_item_percentile(stage: str, model: str) -> Optional[float]:
+    rows = shared_state.get_connection().execute(
+        "SELECT tokens_per_item, truncated FROM token_samples WHERE stage = ? AND model = ? "
+        "ORDER BY id DESC LIMIT ?", (stage, model, settings.ADAPTIVE_MAX_TOKENS_WINDOW)).fetchall()
+    if len(rows) < settings.ADAPTIVE_MAX_TOKENS_MIN_SAMPLES:
+        return None
+    values = [tokens * (TRUNCATED_SAMPLE_BOOST if truncated else 1.0) for tokens, truncated in rows]
+    return _percentile(values, settings.ADAPTIVE_MAX_TOKENS_PERCENTILE)
+
+
+def recommend_max_tokens(stage: str, model: str, num_items: int, default: int) -> int:
+    """
+    Return the adaptive max_tokens for a call producing `num_items` items, or `default` while there are
+    fewer than ADAPTIVE_MAX_TOKENS_MIN_SAMPLES observations for this stage and model.
+    """
+    if not settings.ADAPTIVE_MAX_TOKENS:
+        return default
+    key = (stage, model)
+    cached = _recommendation_cache.get(key)
+    now = time.monotonic()
+    if cached is None or now - cached[0] > _RECOMMENDATION_TTL_SECONDS:
+        cached = (now, _load_per_item_percentile(stage, model))
+        _recommendation_cache[key] = cached
+    per_item = cached[1]
+    if per_item is None:
+        return default
+    budget = math.ceil(per_item * max(num_items, 1) * (1 + settings.ADAPTIVE_MAX_TOKENS_MARGIN))
+    return max(settings.ADAPTIVE_MAX_TOKENS_FLOOR, min(budget, settings.ADAPTIVE_MAX_TOKENS_CEILING))
+
+
+async def recommend_max_tokens_async(stage: str, model: str, num_items: int, default: int) -> int:
+    return await asyncio.to_thread(recommend_max_tokens, stage, model, num_items, default)
+
+
+def record_usage(stage: str, model: str, num_items: int, usage: Dict[str, Any], finish_reason: Optional[str],
+                 max_tokens: int) -> None:
+    """Record one call's completion tokens (per item) and whether it was cut off by max_tokens."""
+    completion_tokens = usage.get("completion_tokens")
+    truncated = finish_reason == "length"
+    if completion_tokens is None:
+        if not truncated:
+            return
+        completion_tokens = max_tokens
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    now = time.time()
+
+    conn = shared_state.get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("INSERT INTO token_samples (stage, model, tokens_per_item, truncated, created_at) "
+                     "VALUES (?, ?, ?, ?, ?)",
+                     (stage, model, completion_tokens / max(num_items, 1), int(truncated), now))
+        # 只保留最近 ADAPTIVE_MAX_TOKENS_WINDOW 个样本
+        conn.execute(
+            "DELETE FROM token_samples WHERE stage = ? AND model = ? AND id <= ("
+            "SELECT id FROM token_samples WHERE stage = ? AND model = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (stage, model, stage, model, settings.ADAPTIVE_MAX_TOKENS_WINDOW))
+        conn.execute(
+            "INSERT INTO token_counters (stage, model, calls, truncated, completion_tokens, prompt_tokens) "
+            "VALUES (?, ?, 1, ?, ?, ?) ON CONFLICT(stage, model) DO UPDATE SET calls = calls + 1, "
+            "truncated = truncated + excluded.truncated, "
+            "completion_tokens = completion_tokens + excluded.completion_tokens, "
+            "prompt_tokens = prompt_tokens + excluded.prompt_tokens",
+            (stage, model, int(truncated), int(completion_tokens), int(prompt_tokens)))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+async def record_usage_async(stage: str, model: str, num_items: int, usage: Dict[str, Any],
+                             finish_reason: Optional[str], max_tokens: int) -> None:
+    try:
+        await asyncio.to_thread(record_usage, stage, model, num_items, usage, finish_reason, max_tokens)
+    except Exception as e:
+        # 统计失败不影响主流程
+        logger.warning("记录 token 用量失败 (%s/%s): %s", stage, model, e)
+
+
+def snapshot() -> List[Dict[str, Any]]:
+    """Per stage/model usage, truncation rate and the current adaptive per-item budget."""
+    conn = shared_state.get_connection()
+    result = []
+    for stage, model, calls, truncated, completion_tokens, prompt_tokens in conn.execute(
+            "SELECT stage, model, calls, truncated, completion_tokens, prompt_tokens FROM token_counters "
+            "ORDER BY stage, model").fetchall():
+        samples = [round(row[0], 1) for row in conn.execute(
+            "SELECT tokens_per_item FROM token_samples WHERE stage = ? AND model = ? ORDER BY id DESC LIMIT ?",
+            (stage, model, settings.ADAPTIVE_MAX_TOKENS_WINDOW)).fetchall()]
+        adaptive = _load_per_item_percentile(stage, model)
+        result.append({
+            "stage": stage,
+            "model": model,
+            "calls": calls,
+            "truncated": truncated,
+            "truncation_rate": round(truncated / calls, 4) if calls else 0.0,
+            "avg_completion_tokens": round(completion_tokens / calls, 1) if calls else 0.0,
+            "avg_prompt_tokens": round(prompt_tokens / calls, 1) if calls else 0.0,
+            "samples": len(samples),
+            "p50_tokens_per_item": _percentile(samples, 50) if samples else None,
+            "p95_tokens_per_item": _percentile(samples, 95) if samples else None,
+            "adaptive_tokens_per_item": round(adaptive, 1) if adaptive is not None else None,
+        })
+    return result
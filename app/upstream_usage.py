@@ -0,0 +1,69 @@
+# app/upstream_usage.py
+# 按调用方统计上游 LLM 用量的 httpx 传输层（离线批量生成 app/batch.py 与模板集基准 app/benchmark.py 共用）：
+#   - 包装真实的上游传输层，读取每个响应的 usage（缺失时按字符数估算 prompt tokens）与延迟
+#   - 计入当前上下文（current_usage）中的 CallUsage；流水线阶段任务继承该 contextvar，调用自动归属到所在的文档/阶段
+#   - 子类可以覆盖 latency_ms / on_response（例如回放录制的延迟、把响应录制到文件）
+import contextvars
+import dataclasses
+import json
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from . import llm_service
+
+current_usage: contextvars.ContextVar[Optional["CallUsage"]] = contextvars.ContextVar("upstream_usage", default=None)
+
+
+@dataclasses.dataclass
+class CallUsage:
+    llm_calls: int = 0
+    http_errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def record(self, body: Dict[str, Any], status_code: int, data: Any, latency_ms: float) -> None:
+        reported = (data.get("usage") if isinstance(data, dict) else None) or {}
+        self.llm_calls += 1
+        if status_code >= 400:
+            self.http_errors += 1
+        self.prompt_tokens += reported.get("prompt_tokens") or llm_service.estimate_request_tokens(
+            body.get("messages", []), 0)
+        self.completion_tokens += reported.get("completion_tokens") or 0
+
+    def add(self, other: "CallUsage") -> None:
+        for field in dataclasses.fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+
+class MeteringTransport(httpx.AsyncBaseTransport):
+    """Wraps the upstream transport and records each call's usage and latency in the current CallUsage."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport):
+        self.inner = inner
+
+    def latency_ms(self, response: httpx.Response, started: float) -> float:
+        return (time.perf_counter() - started) * 1000
+
+    def on_response(self, body: Dict[str, Any], response: httpx.Response, data: Any, latency_ms: float) -> None:
+        pass
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        started = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        await response.aread()
+        latency_ms = self.latency_ms(response, started)
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        usage = current_usage.get()
+        if usage is not None:
+            usage.record(body, response.status_code, data, latency_ms)
+        self.on_response(body, response, data, latency_ms)
+        return response
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
@@ -0,0 +1,19 @@
+# gunicorn.conf.py (生产环境配置，python run.py --prod 或 gunicorn -c gunicorn.conf.py app.main:app)
+# - preload_app: 在 master 进程中预先导入应用，worker fork 后共享只读内存，启动更快
+# - kill -HUP <master pid>: 平滑重启 worker；graceful_timeout 内完成在途请求
+# - 上游配额与缓存通过 SHARED_STATE_PATH (SQLite WAL) 在 worker 间共享，见 app/shared_state.py
+import multiprocessing
+
+from app.config import settings
+
+bind = f"{settings.SERVER_HOST}:{settings.SERVER_PORT}"
+workers = settings.SERVER_WORKERS or multiprocessing.cpu_count() * 2 + 1
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+graceful_timeout = settings.SERVER_GRACEFUL_TIMEOUT
+# LLM 调用链较长（2 + 2×N 次上游调用），worker 超时需要足够宽松
+timeout = 300
+keepalive = 5
+# 定期回收 worker，防止长期运行导致的内存增长；jitter 避免所有 worker 同时重启
+max_requests = 1000
+max_requests_jitter = 100
@@ -1,8 +1,52 @@
 # run.py (在项目根目录)
+import argparse
+import multiprocessing
+
 import uvicorn
 from app.config import settings # <--- 修改: 直接从 app.config 导入
 
+
+def default_worker_count() -> int:
+    # 2 * CPU核心数 + 1，可通过 SERVER_WORKERS 或 --workers 覆盖
+    return settings.SERVER_WORKERS or multiprocessing.cpu_count() * 2 + 1
+
+
+def run_production(host: str, port: int, workers: int):
+    """
+    生产环境启动：多 worker、无 reload。
+    优先使用 gunicorn（支持 preload_app 与 SIGHUP 平滑重启，配置见 gunicorn.conf.py）；
+    gunicorn 不可用时（例如 Windows）退回 uvicorn 自带的多进程管理器（同样支持 SIGHUP 重启 worker）。
+    """
+    try:
+        from gunicorn.app.wsgiapp import WSGIApplication
+    except ImportError:
+        WSGIApplication = None
+
+    if WSGIApplication is not None:
+        import sys
+        sys.argv = [
+            "gunicorn", "app.main:app",
+            "--config", "gunicorn.conf.py",
+            "--bind", f"{host}:{port}",
+            "--workers", str(workers),
+        ]
+        WSGIApplication("%(prog)s [OPTIONS] [APP_MODULE]").run()
+    else:
+        print("  gunicorn not installed, falling back to uvicorn process manager (no preload).")
+        uvicorn.run("app.main:app", host=host, port=port, reload=False, workers=workers,
+                    timeout_graceful_shutdown=settings.SERVER_GRACEFUL_TIMEOUT)
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Start the {settings.PROJECT_NAME} server.")
+    parser.add_argument("--prod", action="store_true", help="Production mode: multiple workers, no auto-reload.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (production mode).")
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument("--skip-static-build", action="store_true",
+                        help="Production mode: do not rebuild hashed/precompressed static assets before starting.")
+    args = parser.parse_args()
+
     print(f"Starting {settings.PROJECT_NAME} server...")
     print(f"  External API URL configured: {settings.EXTERNAL_API_URL}")
     print(f"  Default LLM Model: {settings.DEFAULT_LLM_MODEL}")
@@ -11,11 +55,15 @@ if __name__ == "__main__":
     else:
         print("  External API Key: NOT SET (CRITICAL - LLM calls will use mock data or fail)")
 
-    # Uvicorn会查找名为 app 的模块中名为 app 的FastAPI实例
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
-
-    # 生产环境配置
-    # reload=False, workers 可以根据CPU核心数设置，例如 2 * CPU核心数 + 1
-    # 例如，如果有2核CPU，可以设置 workers=5
-    # 如果不确定，可以先不设置 workers，Uvicorn 默认是1个 worker
-    # uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=False, workers=4) # 示例 workers=4
\ No newline at end of file
+    if args.prod:
+        workers = args.workers or default_worker_count()
+        print(f"  Mode: production ({workers} workers)")
+        print(f"  Shared state: {settings.SHARED_STATE_PATH}")
+        if not args.skip_static_build:
+            from app import static_assets
+            static_assets.build()
+            print(f"  Static assets built: {static_assets.DIST_DIR}")
+        run_production(args.host, args.port, workers)
+    else:
+        # Uvicorn会查找名为 app 的模块中名为 app 的FastAPI实例
+        uvicorn.run("app.main:app", host=args.host, port=args.port, reload=True)
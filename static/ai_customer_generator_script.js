@@ -19,7 +19,66 @@ document.addEventListener('DOMContentLoaded', () => {
     const b2bQuestionsUl = document.getElementById('b2b-questions-ul');
     const b2cQuestionsUl = document.getElementById('b2c-questions-ul');
 
+    const recentSection = document.getElementById('recent-generations');
+    const recentList = document.getElementById('recent-generations-list');
+    const cacheNotice = document.getElementById('cache-notice');
+    const cacheNoticeText = document.getElementById('cache-notice-text');
+    const refreshButton = document.getElementById('refresh-button');
+
+    const PROFILE_BATCH_SIZE = 24;  // 每次追加渲染的画像卡片数
+    const QUESTION_BATCH_SIZE = 50; // 每次追加渲染的问题数
+
     let currentProfilesData = [];
+    let profileObservers = [];
+    let questionObservers = [];
+
+    // --- 懒渲染：先渲染第一批，列表末尾的哨兵元素进入视口附近时再追加下一批 ---
+    // 返回 IntersectionObserver（全部渲染完时为 null），调用方在清空容器时负责 disconnect
+    function renderLazily(container, items, renderItem, batchSize) {
+        let rendered = 0;
+        const sentinel = document.createElement('div');
+        sentinel.className = 'lazy-sentinel';
+
+        function renderNextBatch() {
+            const fragment = document.createDocumentFragment();
+            const end = Math.min(items.length, rendered + batchSize);
+            for (; rendered < end; rendered++) {
+                fragment.appendChild(renderItem(items[rendered], rendered));
+            }
+            container.insertBefore(fragment, sentinel);
+            return rendered < items.length;
+        }
+
+        container.appendChild(sentinel);
+        if (!('IntersectionObserver' in window)) {
+            while (renderNextBatch()) { /* 不支持时一次渲染全部 */ }
+            sentinel.remove();
+            return null;
+        }
+        if (!renderNextBatch()) { sentinel.remove(); return null; }
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting) && !renderNextBatch()) {
+                observer.disconnect();
+                sentinel.remove();
+            }
+        }, { rootMargin: '600px 0px' });
+        observer.observe(sentinel);
+        return observer;
+    }
+
+    function disconnectObservers(observers) {
+        observers.forEach(observer => observer && observer.disconnect());
+        return [];
+    }
+
+    function appendField(parent, label, value) {
+        if (!value) return;
+        const p = document.createElement('p');
+        const strong = document.createElement('strong');
+        strong.textContent = `${label}:`;
+        p.append(strong, ` ${value}`);
+        parent.appendChild(p);
+    }
 
     // --- 点击特效 (假设 createRipple 函数已存在) ---
     function createRipple(event) {
@@ -53,8 +112,37 @@ document.addEventListener('DOMContentLoaded', () => {
         if (isNaN(numProfiles) || numProfiles < 1 || numProfiles > 10) { displayError("画像数量必须在1到10之间！"); return; }
         if (isNaN(numQuestions) || numQuestions < 2 || numQuestions > 10) { displayError("每个画像的总问题数必须在2到10之间！"); return; }
 
+        const params = {
+            product_document: productDocument,
+            num_customer_profiles: numProfiles,
+            num_questions_per_profile: numQuestions
+        };
+        // 相同参数已有本地结果时直接显示，用户可点击“重新生成”强制请求
+        const cached = await ResultCache.get(params);
+        if (cached) {
+            hideError();
+            showResults(cached.data, cached);
+            return;
+        }
+        await generate(params);
+    });
+
+    refreshButton.addEventListener('click', async (event) => {
+        createRipple(event);
+        const params = refreshButton.dataset.cacheKey
+            ? ((await ResultCache.getByKey(refreshButton.dataset.cacheKey)) || {}).params : null;
+        if (params) {
+            productInfoTextarea.value = params.product_document;
+            numProfilesInput.value = params.num_customer_profiles;
+            numQuestionsInput.value = params.num_questions_per_profile;
+            await generate(params);
+        }
+    });
+
+    async function generate(params) {
         loadingSpinner.style.display = 'block';
         generateButton.disabled = true;
+        refreshButton.disabled = true;
         clearResults(); // clearResults 会隐藏 resultsSection
         hideError();
 
@@ -62,11 +150,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const response = await fetch('/v1/generate_ai_customer_data', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json', },
-                body: JSON.stringify({
-                    product_document: productDocument,
-                    num_customer_profiles: numProfiles,
-                    num_questions_per_profile: numQuestions
-                }),
+                body: JSON.stringify(params),
             });
 
             if (!response.ok) {
@@ -81,8 +165,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(errorDetail);
             }
             const data = await response.json();
-            resultsSection.style.display = 'block'; // 显示结果区域
-            renderResults(data);
+            await ResultCache.put(params, data);
+            showResults(data, null);
+            renderRecentGenerations();
         } catch (error) {
             console.error('Error fetching AI customer data:', error);
             displayError(error.message || '生成数据时发生未知错误。');
@@ -90,8 +175,56 @@ document.addEventListener('DOMContentLoaded', () => {
         } finally {
             loadingSpinner.style.display = 'none';
             generateButton.disabled = false;
+            refreshButton.disabled = false;
         }
-    });
+    }
+
+    // cachedEntry 非空表示结果来自本地缓存，显示提示和“重新生成”按钮
+    function showResults(data, cachedEntry) {
+        clearResults();
+        if (cachedEntry) {
+            cacheNoticeText.textContent =
+                `显示的是 ${new Date(cachedEntry.created_at).toLocaleString()} 保存在本地的结果。`;
+            cacheNotice.style.display = 'flex';
+            refreshButton.dataset.cacheKey = cachedEntry.key;
+        }
+        resultsSection.style.display = 'block'; // 显示结果区域
+        renderResults(data);
+    }
+
+    async function renderRecentGenerations() {
+        const entries = await ResultCache.listRecent();
+        recentList.innerHTML = '';
+        if (entries.length === 0) {
+            recentSection.style.display = 'none';
+            return;
+        }
+        entries.forEach(entry => {
+            const item = document.createElement('button');
+            item.type = 'button';
+            item.className = 'recent-item';
+            const title = document.createElement('span');
+            title.className = 'recent-item-title';
+            title.textContent = entry.title || '未命名产品';
+            const meta = document.createElement('span');
+            meta.className = 'recent-item-meta';
+            meta.textContent = `${entry.params.num_customer_profiles} 个画像 · ` +
+                `${new Date(entry.created_at).toLocaleString()}`;
+            item.append(title, meta);
+            item.addEventListener('click', () => {
+                productInfoTextarea.value = entry.params.product_document;
+                numProfilesInput.value = entry.params.num_customer_profiles;
+                numQuestionsInput.value = entry.params.num_questions_per_profile;
+                hideError();
+                showResults(entry.data, entry);
+                resultsSection.scrollIntoView({ behavior: 'smooth' });
+            });
+            recentList.appendChild(item);
+        });
+        recentSection.style.display = 'block';
+    }
+
+    renderRecentGenerations();
 
     function displayError(message) {
         errorBox.textContent = message;
@@ -102,7 +235,10 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     function clearResults() {
+        profileObservers = disconnectObservers(profileObservers);
+        questionObservers = disconnectObservers(questionObservers);
         if(resultsSection) resultsSection.style.display = 'none'; // 隐藏整个结果区域
+        cacheNotice.style.display = 'none';
         productSummaryText.textContent = '';
         productSummaryContainer.style.display = 'none';
         profilesDisplay.innerHTML = '';
@@ -133,32 +269,30 @@ document.addEventListener('DOMContentLoaded', () => {
             return; // 如果没有画像，直接返回，不尝试渲染第一个画像的问题
         }
 
-        currentProfilesData.forEach((profile, index) => {
+        // 画像卡片分批懒渲染；内容由 LLM 生成，一律用 textContent 写入
+        profileObservers.push(renderLazily(profilesDisplay, currentProfilesData, (profile, index) => {
             const card = document.createElement('div');
             card.classList.add('profile-card');
             card.dataset.profileIndex = index;
-            let concernsHTML = profile.main_concerns && profile.main_concerns.length > 0
-                ? `<p><strong>主要关注点:</strong> ${profile.main_concerns.join(', ')}</p>` : '';
-
-            card.innerHTML = `
-                <h3>${profile.name || '未命名画像'}</h3>
-                <p>${profile.description || '无详细描述'}</p>
-                ${profile.country_region ? `<p><strong>国家/地区:</strong> ${profile.country_region}</p>` : ''}
-                ${profile.occupation ? `<p><strong>职业:</strong> ${profile.occupation}</p>` : ''}
-                ${profile.cognitive_level ? `<p><strong>认知水平:</strong> ${profile.cognitive_level}</p>` : ''}
-                ${concernsHTML}
-                ${profile.potential_needs ? `<p><strong>潜在需求:</strong> ${profile.potential_needs}</p>` : ''}
-                ${profile.cultural_background_summary ? `<p><strong>文化背景:</strong> ${profile.cultural_background_summary}</p>` : ''}
-                <small>B2B问题: ${profile.b2b_questions ? profile.b2b_questions.length : 0} | B2C问题: ${profile.b2c_questions ? profile.b2c_questions.length : 0}</small>
-            `;
-
-            card.addEventListener('click', (event) => {
-                document.querySelectorAll('.profile-card').forEach(c => c.classList.remove('active'));
-                card.classList.add('active');
-                renderQuestionsForProfile(index);
-            });
-            profilesDisplay.appendChild(card);
-        });
+
+            const title = document.createElement('h3');
+            title.textContent = profile.name || '未命名画像';
+            const description = document.createElement('p');
+            description.textContent = profile.description || '无详细描述';
+            card.append(title, description);
+            appendField(card, '国家/地区', profile.country_region);
+            appendField(card, '职业', profile.occupation);
+            appendField(card, '认知水平', profile.cognitive_level);
+            appendField(card, '主要关注点', profile.main_concerns && profile.main_concerns.length > 0
+                ? profile.main_concerns.join(', ') : '');
+            appendField(card, '潜在需求', profile.potential_needs);
+            appendField(card, '文化背景', profile.cultural_background_summary);
+            const counts = document.createElement('small');
+            counts.textContent = `B2B问题: ${profile.b2b_questions ? profile.b2b_questions.length : 0} | ` +
+                `B2C问题: ${profile.b2c_questions ? profile.b2c_questions.length : 0}`;
+            card.appendChild(counts);
+            return card;
+        }, PROFILE_BATCH_SIZE));
 
         if(currentProfilesData.length > 0){
             const firstCard = profilesDisplay.querySelector('.profile-card');
@@ -171,6 +305,29 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // 卡片是懒创建的，点击事件委托给容器处理
+    profilesDisplay.addEventListener('click', (event) => {
+        const card = event.target.closest('.profile-card');
+        if (!card) return;
+        profilesDisplay.querySelectorAll('.profile-card.active').forEach(c => c.classList.remove('active'));
+        card.classList.add('active');
+        renderQuestionsForProfile(parseInt(card.dataset.profileIndex));
+    });
+
+    function renderQuestionList(ul, questions, emptyText) {
+        if (questions && questions.length > 0) {
+            questionObservers.push(renderLazily(ul, questions, question => {
+                const li = document.createElement('li');
+                li.textContent = question.text;
+                return li;
+            }, QUESTION_BATCH_SIZE));
+        } else {
+            const li = document.createElement('li');
+            li.textContent = emptyText;
+            ul.appendChild(li);
+        }
+    }
+
     function renderQuestionsForProfile(profileIndex) {
         const profile = currentProfilesData[profileIndex];
         if (!profile) {
@@ -179,28 +336,11 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         selectedProfileNameHeader.textContent = `“${profile.name || '该画像'}” 可能提出的问题:`;
+        questionObservers = disconnectObservers(questionObservers);
         b2bQuestionsUl.innerHTML = '';
         b2cQuestionsUl.innerHTML = '';
-
-        if (profile.b2b_questions && profile.b2b_questions.length > 0) {
-            profile.b2b_questions.forEach(question => {
-                const li = document.createElement('li');
-                li.textContent = question.text;
-                b2bQuestionsUl.appendChild(li);
-            });
-        } else {
-            b2bQuestionsUl.innerHTML = '<li>未能生成B2B问题。</li>';
-        }
-
-        if (profile.b2c_questions && profile.b2c_questions.length > 0) {
-            profile.b2c_questions.forEach(question => {
-                const li = document.createElement('li');
-                li.textContent = question.text;
-                b2cQuestionsUl.appendChild(li);
-            });
-        } else {
-            b2cQuestionsUl.innerHTML = '<li>未能生成B2C问题。</li>';
-        }
+        renderQuestionList(b2bQuestionsUl, profile.b2b_questions, '未能生成B2B问题。');
+        renderQuestionList(b2cQuestionsUl, profile.b2c_questions, '未能生成B2C问题。');
         // 确保 questionsDisplayContainer 在有内容时是可见的
         // （它现在是 results-section 的子元素，results-section 的显示已控制）
         // 如果 questionsDisplayContainer 内部还有独立的 display:none 逻辑，这里可以强制显示
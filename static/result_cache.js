@@ -0,0 +1,116 @@
+// static/result_cache.js
+// 在浏览器 IndexedDB 中保存最近的生成结果，按请求参数（产品文档 + 画像数 + 问题数）作为键。
+// 重新打开页面后可以直接从“最近生成”中找回结果，相同参数再次生成时先显示本地结果。
+// 浏览器不支持 IndexedDB（或处于禁用存储的隐私模式）时所有方法静默降级为空操作。
+window.ResultCache = (() => {
+    const DB_NAME = 'ai-customer-generator';
+    const DB_VERSION = 1;
+    const STORE_NAME = 'results';
+    const MAX_ENTRIES = 20; // 最多保留的结果数，超出后删除最旧的
+
+    let dbPromise = null;
+
+    function openDb() {
+        if (dbPromise) return dbPromise;
+        dbPromise = new Promise((resolve) => {
+            if (!window.indexedDB) { resolve(null); return; }
+            let request;
+            try {
+                request = indexedDB.open(DB_NAME, DB_VERSION);
+            } catch (e) {
+                resolve(null);
+                return;
+            }
+            request.onupgradeneeded = () => {
+                const store = request.result.createObjectStore(STORE_NAME, { keyPath: 'key' });
+                store.createIndex('created_at', 'created_at');
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => {
+                console.warn('IndexedDB 不可用，结果不会缓存:', request.error);
+                resolve(null);
+            };
+        });
+        return dbPromise;
+    }
+
+    function promisify(request) {
+        return new Promise((resolve, reject) => {
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    async function withStore(mode, fn) {
+        const db = await openDb();
+        if (!db) return null;
+        try {
+            const tx = db.transaction(STORE_NAME, mode);
+            // 先挂上完成回调：只读事务可能在 fn 的 Promise 解决之前就已提交
+            const done = new Promise((resolve, reject) => {
+                tx.oncomplete = resolve;
+                tx.onerror = () => reject(tx.error);
+                tx.onabort = () => reject(tx.error);
+            });
+            const result = await fn(tx.objectStore(STORE_NAME));
+            await done;
+            return result;
+        } catch (e) {
+            console.warn('IndexedDB 操作失败:', e);
+            return null;
+        }
+    }
+
+    async function makeKey(params) {
+        const text = JSON.stringify([params.product_document, params.num_customer_profiles,
+            params.num_questions_per_profile]);
+        if (window.crypto && crypto.subtle) {
+            const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(text));
+            return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+        }
+        return text; // 非安全上下文（http 非 localhost）没有 crypto.subtle，直接用原文作键
+    }
+
+    function productTitle(productDocument) {
+        const firstLine = productDocument.split('\n').map(line => line.trim()).find(line => line) || '';
+        return firstLine.slice(0, 80);
+    }
+
+    async function get(params) {
+        const key = await makeKey(params);
+        return withStore('readonly', store => promisify(store.get(key)));
+    }
+
+    async function put(params, data) {
+        const key = await makeKey(params);
+        const entry = {
+            key,
+            params,
+            title: productTitle(params.product_document),
+            created_at: Date.now(),
+            data
+        };
+        await withStore('readwrite', async store => {
+            store.put(entry);
+            // 删除超出上限的最旧条目
+            const keys = await promisify(store.index('created_at').getAllKeys());
+            keys.slice(0, Math.max(0, keys.length - MAX_ENTRIES)).forEach(oldKey => store.delete(oldKey));
+        });
+        return entry;
+    }
+
+    async function listRecent(limit = MAX_ENTRIES) {
+        const entries = await withStore('readonly', store => promisify(store.index('created_at').getAll()));
+        return (entries || []).reverse().slice(0, limit);
+    }
+
+    async function getByKey(key) {
+        return withStore('readonly', store => promisify(store.get(key)));
+    }
+
+    async function clear() {
+        await withStore('readwrite', store => promisify(store.clear()));
+    }
+
+    return { get, put, listRecent, getByKey, clear };
+})();